@@ -6,12 +6,25 @@ import uuid
 import sys
 import os
 import json
+import pandas as pd
 
 # Individual imports
-from database.db import table, update_db_item, float_to_decimal, decimal_to_float
-from bace.design_optimization import get_design_tuner, get_next_design, get_conf_dict, get_objective, context
+from database.db import table as db_table, update_db_item, float_to_decimal, decimal_to_float
+from database.async_db import AsyncTable
+from bace.parallel_scoring import set_max_threads
+from bace.batch_scoring import ScoringBatcher
+from bace.design_refinement import refine_design
+from bace.mi_cache import mi_cache
+from bace.design_optimization import get_design_tuner, get_next_design, get_next_design_halving, design_searches, get_conf_dict, get_objective, context
 from bace.pmc_inference import pmc, sample_thetas
-from bace.user_config import answers, design_params, theta_params, likelihood_pdf, author, size_thetas, conf_dict, max_opt_time
+from bace.grid_inference import grid_posterior
+from bace.laplace_inference import laplace_posterior
+from bace.estimates import get_config_version, get_accuracy, get_posterior_summary, get_cached_estimates
+from bace.first_designs import uses_profile, compute_first_designs, load_first_designs, draw_first_design, first_designs_file
+from bace.design_tree import load_design_tree, lookup_design, design_tree_file
+from bace.runtime_model import compile_config
+from bace.user_config import answers, theta_params, author, size_thetas, conf_dict, max_opt_time
+import bace.user_config as user_config
 from bace.user_convert import add_to_profile, convert_design
 from bace.user_survey import nquestions, display_estimates
 from bace.user_surveycto import convert_design_surveycto, convert_dict_to_string
@@ -22,10 +35,13 @@ from utils.flask_lambda.flask_lambda import FlaskLambda
 
 # Helper functions for app.py
 from utils.app_utils import format_response, get_request, is_empty
+from utils.job_queue import LocalJobQueue
+from utils.submissions import InFlightSubmissions, get_answer_index, is_replay, get_replayed_design, record_answer, submission_key
 
 # Specify application. Change if deploying via Lambda or directly as a Flask application.
 app = FlaskLambda(__name__)     # Uncomment if deploying via AWS Lambda.
 # app = Flask(__name__)          # Uncomment if deploying directly as standard Flask application.
+# FlaskLambda also serves standard WSGI requests. For production serving outside of Lambda, use serve.py (preforked worker pool).
 
 @app.errorhandler(HTTPException)
 def handle_exception(e):
@@ -44,9 +60,19 @@ def handle_exception(e):
 # Add file path for relative imports
 sys.path.append(os.path.join(os.path.dirname(__file__)))
 
+def json_route(rule, methods=['GET']):
+    # Register a route that returns JSON. The handler takes the request data and method instead of using flask.request,
+    # so on AWS Lambda it is called directly from the event, without going through WSGI (see utils/flask_lambda/flask_lambda.py).
+    def decorator(handler):
+        app.add_url_rule(rule, handler.__name__, lambda: handler(get_request(request), request.method), methods=methods)
+        if isinstance(app, FlaskLambda):
+            app.native_route(rule, methods)(handler)
+        return handler
+    return decorator
+
 # Homepage to check that Lambda application is up and running
-@app.route('/')
-def homepage():
+@json_route('/')
+def homepage(request_data, method):
     return format_response({ 'message': 'Hello! Your BACE application is up and running.', 'author': f"{author or 'Update author in bace/user_config.py'}"})
 
 # Set up the optimization tuner using parameters from user_config
@@ -54,27 +80,183 @@ context.max_opt_time = max_opt_time
 conf_dict_earlystop = get_conf_dict(conf_dict)
 default_J = 5
 
+# Optional settings from user_config (defaults are used if a setting is not specified)
+precision = getattr(user_config, 'precision', 'float64')
+
+# Validate user_config and use its runtime model (see bace/runtime_model.py). Likelihoods are replaced by array-based wrappers if compatible,
+# so likelihood_pdf, log_likelihood_pdf and design_params are taken from the model rather than imported from user_config.
+model = compile_config(user_config)
+likelihood_pdf = model.likelihood_pdf
+log_likelihood_pdf = model.log_likelihood_pdf
+design_params = model.design_params # Categorical attributes are integer codes if design_encoding = 'codes'. Designs are decoded only for output.
+
+# Posterior summaries are reused for the same history and config version (see bace/estimates.py)
+config_version = get_config_version(user_config)
+standard_accuracy = get_accuracy(size_thetas, default_J)
+high_accuracy = get_accuracy(size_thetas*10, 10)
+estimates_accuracy = getattr(user_config, 'estimates_accuracy', 'high') # Default accuracy requested by /estimates: 'high' or 'standard'
+
+# With estimates_mode = 'background', /estimates POST records the answer and computes estimates on a job queue.
+# Clients poll /estimates GET for the result. Replace `estimates_queue` to use an external queue instead (see utils/job_queue.py).
+# Not available on AWS Lambda, where the execution environment can be frozen once a response is returned.
+estimates_mode = getattr(user_config, 'estimates_mode', 'inline')
+if estimates_mode == 'background' and os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+    print("estimates_mode = 'background' is not supported on AWS Lambda. Using 'inline' instead.")
+    estimates_mode = 'inline'
+estimates_queue = LocalJobQueue(max_workers=getattr(user_config, 'estimates_workers', 1)) if estimates_mode == 'background' else None
+
+# With db_write_mode = 'write_behind', database writes are queued and responses are returned without waiting for them (see database/async_db.py).
+# Not available on AWS Lambda, where the execution environment can be frozen once a response is returned.
+db_write_mode = getattr(user_config, 'db_write_mode', 'sync')
+if db_write_mode == 'write_behind' and os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+    print("db_write_mode = 'write_behind' is not supported on AWS Lambda. Using 'sync' instead.")
+    db_write_mode = 'sync'
+table = AsyncTable(db_table, write_behind=(db_write_mode == 'write_behind'))
+
+# Repeated answer submissions (retries) return the stored next design without recomputing it (see utils/submissions.py).
+# Requests identify the answered question with question_number (sent by the Qualtrics template) or an idempotency_key.
+# Retries of a submission that is still being computed in this process wait for its result.
+submissions = InFlightSubmissions()
+
+# Design search: 'bayesian' optimizes mutual information with Mango; 'successive_halving' screens halving_candidates random designs
+# on a subset of halving_min_particles particles and re-scores the best half on twice as many particles until all are used.
+design_search = getattr(user_config, 'design_search', 'bayesian')
+halving_candidates = getattr(user_config, 'halving_candidates', 256)
+halving_min_particles = getattr(user_config, 'halving_min_particles', 100)
+
+# Threads used to score batches of candidate designs within a request: 1 (serial), a number, or 'auto' for every available core.
+# Backs off automatically when concurrent requests are already using the cores (see bace/parallel_scoring.py).
+# Batches of designs are split by design, and single designs (the default Mango search) by particles.
+set_max_threads(getattr(user_config, 'scoring_threads', 1))
+
+# With design_refinement = True, the continuous attributes of the design found by the search are refined by gradient ascent
+# on mutual information (see bace/design_refinement.py).
+design_refinement = getattr(user_config, 'design_refinement', False)
+
+def search_design(thetas, design_tuner, profile=None):
+    if design_search == 'successive_halving':
+        design = get_next_design_halving(thetas, design_tuner, n_candidates=halving_candidates, min_particles=halving_min_particles)
+    else:
+        design = get_next_design(thetas, design_tuner)
+    if design_refinement:
+        design = refine_design(design, thetas, design_tuner, answers, likelihood_pdf, profile, log_likelihood_pdf)
+    if mi_cache.max_size > 0:
+        stats = mi_cache.stats()
+        print(f'Mutual information cache (since cold start): {stats["hits"]} hits, {stats["misses"]} misses, hit rate {stats["hit_rate"]:.1%}, {stats["size"]} entries.')
+    return design
+
+# Pool of first designs under the prior for new profiles (see bace/first_designs.py).
+# Loaded from bace/first_designs.json if built for this config, or computed at cold start if first_design_pool_size > 0.
+# Not used if the likelihood depends on the profile (override with profile_dependent_likelihood = True/False).
+profile_dependent_likelihood = getattr(user_config, 'profile_dependent_likelihood', None)
+if profile_dependent_likelihood is None:
+    profile_dependent_likelihood = uses_profile(likelihood_pdf) or uses_profile(log_likelihood_pdf)
+
+first_design_pool = None
+if not profile_dependent_likelihood:
+    first_design_pool = load_first_designs(os.path.join(os.path.dirname(__file__), 'bace', first_designs_file), config_version)
+    first_design_pool_size = getattr(user_config, 'first_design_pool_size', 0)
+    if first_design_pool is None and first_design_pool_size > 0:
+        first_design_pool = compute_first_designs(theta_params, answers, likelihood_pdf, design_params, conf_dict_earlystop, size_thetas, first_design_pool_size, precision, log_likelihood_pdf)
+
+# Precomputed designs for the first questions of the survey (see bace/design_tree.py).
+# Loaded from bace/design_tree.json if built for this config. Not used if the likelihood depends on the profile.
+design_tree = None
+if not profile_dependent_likelihood:
+    design_tree = load_design_tree(os.path.join(os.path.dirname(__file__), 'bace', design_tree_file), config_version)
+
+# With scoring_batch_window > 0 (milliseconds), a server process that serves requests on several threads (see serve.py --threads)
+# scores the designs of concurrent requests together in stacked computations (see bace/batch_scoring.py).
+# Requires a likelihood that is vectorized over designs and does not use the profile. Not used on AWS Lambda (one request per process).
+scoring_batch_window = getattr(user_config, 'scoring_batch_window', 0)
+scoring_batcher = None
+if scoring_batch_window > 0 and not os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+    if profile_dependent_likelihood:
+        print('scoring_batch_window is ignored because the likelihood depends on the profile.')
+    else:
+        scoring_batcher = ScoringBatcher(window=scoring_batch_window / 1000)
+
+# Inference engine: 'pmc' (population Monte Carlo), 'grid' (posterior on a grid over theta space, for models with
+# few preference parameters; grid_size sets the number of grid points, see bace/grid_inference.py), or 'laplace'
+# (Gaussian approximation with importance correction, falling back to PMC if the posterior is not close to Gaussian,
+# see bace/laplace_inference.py).
+inference = getattr(user_config, 'inference', 'pmc')
+grid_size = getattr(user_config, 'grid_size', 50000)
+grid_refine = getattr(user_config, 'grid_refine', True)
+laplace_min_ess = getattr(user_config, 'laplace_min_ess', 0.5)
+
+def infer_thetas(profile, N=size_thetas, J=default_J, prior_thetas=None):
+    # Sample of size N from the posterior given the profile's answers. prior_thetas is PMC's starting sample (see read_profile).
+    # Grid states are reused between questions unless the likelihood depends on the profile (which can change between answers).
+    # Laplace modes are only used as starting points, so they are always reused.
+    answer_history = profile['answer_history']
+    design_history = profile['design_history'][:len(answer_history)]
+    if inference == 'grid':
+        return grid_posterior(theta_params, answer_history, design_history, likelihood_pdf, N, grid_size=grid_size, refine=grid_refine, cache_key=None if profile_dependent_likelihood else profile.get('profile_id'), profile=profile, precision=precision, log_likelihood_pdf=log_likelihood_pdf)
+    if inference == 'laplace':
+        return laplace_posterior(theta_params, answer_history, design_history, likelihood_pdf, N, J=J, min_ess=laplace_min_ess, cache_key=profile.get('profile_id'), profile=profile, precision=precision, log_likelihood_pdf=log_likelihood_pdf)
+    return pmc(theta_params, answer_history, design_history, likelihood_pdf, N, J=J, profile=profile, precision=precision, log_likelihood_pdf=log_likelihood_pdf, prior_thetas=prior_thetas)
+
+def read_profile(key, N=None):
+    # Read the profile on a background thread (see database/async_db.py). If N is given and PMC will run, draw PMC's starting
+    # sample of size N from the prior meanwhile, since it does not depend on the profile. Callers only pass N for requests
+    # that run inference after the read (the sample is unused if the request turns out to be a retry).
+    # Returns the database response and the prior sample (None if not drawn).
+    response = table.get_item_async(Key=key)
+    prior_thetas = sample_thetas(theta_params, N, precision) if N is not None and inference == 'pmc' else None
+    return response.result(), prior_thetas
+
+# Mutual information is memoized by particle set and design, up to mi_cache_size entries (0 disables it, see bace/mi_cache.py).
+# Cache statistics are logged after each design search.
+# The profile is only passed to the objective if the likelihood uses it, so that scores can be shared across profiles.
+mi_cache.max_size = getattr(user_config, 'mi_cache_size', 10000)
+
+def select_first_design(profile, thetas=None):
+    # Use the root of the design tree or draw the first design from the pool if available. Otherwise, optimize it under the prior.
+    if design_tree and '' in design_tree:
+        return dict(design_tree[''])
+    if first_design_pool:
+        return draw_first_design(first_design_pool)
+
+    objective = get_objective(answers, likelihood_pdf, profile if profile_dependent_likelihood else None, log_likelihood_pdf, batcher=scoring_batcher)
+    design_tuner = get_design_tuner(design_params, objective, conf_dict_earlystop)
+    return search_design(thetas if thetas is not None else sample_thetas(theta_params, size_thetas, precision), design_tuner, profile)
+
+def select_next_design(profile, prior_thetas=None):
+    # Select the next design after a new answer. Uses the design tree if the profile's history is in it.
+    # Returns the design and the posterior thetas (None if the design was looked up, since no PMC is run).
+    if design_tree:
+        next_design = lookup_design(design_tree, profile['answer_history'], profile['design_history'])
+        if next_design is not None:
+            return next_design, None
+
+    # Compute posterior distribution after answer
+    thetas = infer_thetas(profile, prior_thetas=prior_thetas)
+
+    # Compute next design
+    objective = get_objective(answers, likelihood_pdf, profile if profile_dependent_likelihood else None, log_likelihood_pdf, batcher=scoring_batcher)
+    design_tuner = get_design_tuner(design_params, objective, conf_dict_earlystop)
+    return search_design(thetas, design_tuner, profile), thetas
+
 # Return a random design
-@app.route('/random_design', methods=['GET'])
-def random_design():
+@json_route('/random_design', methods=['GET'])
+def random_design(request_data, method):
     objective = get_objective(answers, likelihood_pdf)
     design_tuner = get_design_tuner(design_params, objective, conf_dict_earlystop)
     design = design_tuner.ds.get_random_sample(size=1)[0]
-    return format_response(design)
+    return format_response(model.decode(design))
 
 # Create a new profile in the database
-@app.route('/create_profile', methods=['POST'])
-def create_profile():
+@json_route('/create_profile', methods=['POST'])
+def create_profile(request_data, method):
 
     # Store profile-specific information
-    profile = get_request(request)
+    profile = request_data
     profile['profile_id'] = str(uuid.uuid4()) # Create new profile_id
     profile = add_to_profile(profile)
 
     # Select first design
-    objective = get_objective(answers, likelihood_pdf, profile)
-    design_tuner = get_design_tuner(design_params, objective, conf_dict_earlystop)
-    next_design = get_next_design(sample_thetas(theta_params, size_thetas), design_tuner)
+    next_design = select_first_design(profile)
 
     # Add next_design to design history and store placeholder for answer_history
     profile['design_history'] = [next_design]
@@ -82,7 +264,7 @@ def create_profile():
 
     # Put item into database
     table.put_item(Item=float_to_decimal(profile))
-    output_design = convert_design(next_design, profile, profile)
+    output_design = convert_design(model.decode(next_design), profile, profile)
 
     print(f'Successfully created profile for {profile.get("survey_id") or profile.get("profile_id")}')
 
@@ -94,11 +276,10 @@ def create_profile():
     return format_response(response)
 
 # Update profile and return next design.
-@app.route('/update_profile', methods=["POST"])
-def update_profile():
+@json_route('/update_profile', methods=["POST"])
+def update_profile(request_data, method):
 
     # Store profile specific information
-    request_data = get_request(request)
     print(request_data)
 
     # If profile_id is present, proceed
@@ -107,34 +288,37 @@ def update_profile():
         key={'profile_id': request_data.get('profile_id')}
         answer=request_data.get('answer')
 
-        # Retrieve profile from database
-        profile = table.get_item(Key=key)['Item']
-        profile = decimal_to_float(profile)
+        # Retrieve profile from database. A new answer runs inference unless the design tree has the next design.
+        response, prior_thetas = read_profile(key, N=None if is_empty(answer) or design_tree else size_thetas)
+        profile = decimal_to_float(response['Item'])
 
         if is_empty(answer):
             next_design = profile['design_history'][-1]
+        elif is_replay(profile, request_data):
+            # Repeated submission (e.g. a retry after a timeout). Return the design computed for it.
+            next_design = get_replayed_design(profile, request_data) or profile['design_history'][-1]
         else:
-            profile['answer_history'].append(answer)
+            def compute():
+                updates = record_answer(profile, answer, request_data)
 
-            # Compute pmc to get posterior distribution after answer
-            thetas = pmc(theta_params, profile['answer_history'], profile['design_history'], likelihood_pdf, size_thetas, J=default_J, profile=profile)
+                # Compute next design
+                next_design, thetas = select_next_design(profile, prior_thetas)
 
-            # Compute next design
-            objective = get_objective(answers, likelihood_pdf, profile)
-            design_tuner = get_design_tuner(design_params, objective, conf_dict_earlystop)
-            next_design = get_next_design(thetas, design_tuner)
+                # Update item
+                profile['design_history'].append(next_design)
 
-            # Update item
-            profile['design_history'].append(next_design)
+                # Store updates
+                updates['design_history'] = profile.get('design_history')
+                if thetas is not None:
+                    updates['posterior_summary'] = get_posterior_summary(thetas, profile, config_version, standard_accuracy)
 
-            # Store updates
-            updates = {
-                'design_history': profile.get('design_history'),
-                'answer_history': profile.get('answer_history')
-            }
+                # Push changes to database
+                update_db_item(table, key, updates)
+                return profile
 
-            # Push changes to database
-            update_db_item(table, key, updates)
+            # Retries that wait for this submission use the updated profile
+            profile = submissions.run(submission_key(profile, request_data), compute)
+            next_design = profile['design_history'][-1]
     else:
         # Select random design
         objective = get_objective(answers, likelihood_pdf)
@@ -142,58 +326,120 @@ def update_profile():
         next_design = design_tuner.ds.get_random_sample(size=1)[0]
         profile = dict()
 
-    output_design = convert_design(next_design, profile, request_data)
+    output_design = convert_design(model.decode(next_design), profile, request_data)
     return format_response(output_design)
 
-@app.route('/estimates', methods=["GET", "POST"])
-def update_estimates():
+def compute_estimates(profile, accuracy, prior_thetas=None):
+    # Return estimates for the profile's answered questions, reusing stored estimates if they are accurate enough.
+    # Also returns the new posterior summary to store (None if the stored one was reused).
+    estimates = get_cached_estimates(profile, config_version, accuracy)
+    if estimates is not None:
+        return estimates, None
+
+    # Calculate estimates
+    thetas = infer_thetas(profile, size_thetas*10, J=10, prior_thetas=prior_thetas)
+    posterior_summary = get_posterior_summary(thetas, profile, config_version, high_accuracy)
+
+    return posterior_summary['estimates'], posterior_summary
+
+def estimate_profile(profile_id, accuracy):
+    # Background job: compute estimates for a stored profile and write them to the database.
+    key = {'profile_id': profile_id}
+    profile = decimal_to_float(table.get_item(Key=key)['Item'])
+
+    try:
+        estimates, posterior_summary = compute_estimates(profile, accuracy)
+    except Exception:
+        update_db_item(table, key, {'estimates_status': 'failed'})
+        raise
+
+    updates = {
+        'estimates': estimates,
+        'estimates_status': 'complete'
+    }
+    if posterior_summary is not None:
+        updates['posterior_summary'] = posterior_summary
 
-    # Store profile specific information
-    data = get_request(request)
+    update_db_item(table, key, updates)
+    print(f'Finished estimates for {profile_id}')
+
+@json_route('/estimates', methods=["GET", "POST"])
+def update_estimates(data, method):
 
     if data.get('profile_id') != "${e://Field/profile_id}":
 
         key={'profile_id': data.get('profile_id')}
         answer = data.get('answer')
 
-        # Retrieve profile from database
-        profile = table.get_item(Key=key)['Item']
+        # Retrieve profile from database. POST requests compute estimates inline unless they are already stored.
+        response, prior_thetas = read_profile(key, N=size_thetas*10 if method == 'POST' and estimates_mode != 'background' else None)
+        profile = response['Item']
 
         print('Profile from database')
         print(profile)
 
-        if request.method == 'GET':
+        if method == 'GET':
 
-            estimates = profile.get('estimates')
+            if profile.get('estimates_status') == 'pending':
+                estimates = {'estimates_status': 'pending'}
+            else:
+                estimates = profile.get('estimates')
 
         else:
 
+            profile = decimal_to_float(profile)
+
+            replay = not is_empty(answer) and is_replay(profile, data)
+
             if is_empty(answer):
                 profile['design_history'].pop()
-            else:
-                # Update item
-                profile['answer_history'].append(answer)
+            elif replay:
+                # Repeated submission (e.g. a retry after a timeout). Return the stored estimates.
+                if profile.get('estimates_status') == 'pending':
+                    return format_response({'estimates_status': 'pending'})
+                if profile.get('estimates') is not None:
+                    return format_response(profile['estimates'])
+
+            # Reuse stored estimates for this history if they are accurate enough.
+            # With accuracy='standard', estimates computed while the survey was running are accepted.
+            accuracy = standard_accuracy if (data.get('accuracy') or estimates_accuracy) == 'standard' else high_accuracy
+
+            def compute():
+                # Store values to be updated
+                if is_empty(answer) or replay:
+                    updates = {
+                        'answer_history': profile.get('answer_history')
+                    }
+                else:
+                    updates = record_answer(profile, answer, data)
 
-            profile = decimal_to_float(profile)
+                if estimates_mode == 'background' and get_cached_estimates(profile, config_version, accuracy) is None:
+
+                    # Record the answer, then compute estimates in the background. Clients poll /estimates GET.
+                    updates['estimates_status'] = 'pending'
+                    update_db_item(table, key, updates)
+                    estimates_queue.submit(estimate_profile, profile['profile_id'], accuracy)
+
+                    return {'estimates_status': 'pending'}
 
-            # Calculate estimates
-            estimates = pmc(theta_params, profile['answer_history'], profile['design_history'], likelihood_pdf, size_thetas*10, J=10, profile=profile)
-            estimates = estimates.agg(['mean', 'median', 'std']).to_dict()
+                estimates, posterior_summary = compute_estimates(profile, accuracy, prior_thetas)
 
-            # Store values to be updated
-            updates = {
-                'answer_history': profile.get('answer_history'),
-                'estimates': estimates
-            }
+                updates['estimates'] = estimates
+                if posterior_summary is not None:
+                    updates['posterior_summary'] = posterior_summary
 
-            # Push changes to database
-            update_db_item(table, key, updates)
+                # Push changes to database
+                update_db_item(table, key, updates)
+                return estimates
+
+            # Retries that arrive while the estimates are computed wait for them
+            estimates = submissions.run(submission_key(profile, data), compute)
 
         return format_response(estimates)
     else:
 
         # Sample from prior distribution
-        thetas = sample_thetas(theta_params, size_thetas)
+        thetas = sample_thetas(theta_params, size_thetas, precision)
         # Calculate mean and median estimates
         estimates = thetas.agg(['mean', 'median', 'std']).to_dict()
         # Return sample output
@@ -223,55 +469,68 @@ def survey():
             # Retrieve profile from database
             profile = table.get_item(Key=key)['Item']
             profile = decimal_to_float(profile)
-            profile['answer_history'].append(answer)
             print(profile)
 
-            # Compute pmc to get posterior distribution after answer
-            thetas = pmc(theta_params, profile['answer_history'], profile['design_history'], likelihood_pdf, size_thetas, J=default_J, profile=profile)
+            if is_replay(profile, request_data):
+                # Repeated submission (e.g. the form was sent twice). Show the page that followed it.
+                next_design = get_replayed_design(profile, request_data)
+                question_number = get_answer_index(profile, request_data) + 2
+                estimates = profile.get('estimates')
+            else:
+                def compute():
+                    updates = record_answer(profile, answer, request_data)
 
-            if len(profile['design_history']) + 1 <= nquestions:
+                    if len(profile['design_history']) + 1 <= nquestions:
 
-                # Compute next design
-                objective = get_objective(answers, likelihood_pdf, profile)
-                design_tuner = get_design_tuner(design_params, objective, conf_dict_earlystop)
-                next_design = get_next_design(thetas, design_tuner)
+                        # Compute next design
+                        next_design, thetas = select_next_design(profile)
 
-                # Update item
-                profile['design_history'].append(next_design)
+                        # Update item
+                        profile['design_history'].append(next_design)
 
-                # Store updates
-                updates = {
-                    'design_history': profile.get('design_history'),
-                    'answer_history': profile.get('answer_history')
-                }
+                        # Store updates
+                        updates['design_history'] = profile.get('design_history')
+                        if thetas is not None:
+                            updates['posterior_summary'] = get_posterior_summary(thetas, profile, config_version, standard_accuracy)
 
-                # Push changes to database
-                update_db_item(table, key, updates)
+                        # Push changes to database
+                        update_db_item(table, key, updates)
 
-                # Convert Next Design
-                profile['question_number'] = 'survey'
-                output_design = convert_design(next_design, profile, profile)
+                        return next_design, len(profile.get('design_history')), None
 
-                inputs = {'profile_id': profile['profile_id']}
+                    else:
 
-                return render_template('survey.html', output_design=output_design, inputs=inputs, answer_values = answers, question_number=len(profile.get("design_history")), nquestions=nquestions, redirect_url='survey', css_style=css_style_markup)
+                        # Compute posterior distribution after answer
+                        thetas = infer_thetas(profile)
 
-            else:
+                        estimates = thetas.agg(['mean', 'median', 'std']).to_dict()
 
-                estimates = thetas.agg(['mean', 'median', 'std'])
+                        # Store values to be updated
+                        updates['estimates'] = estimates
+                        updates['posterior_summary'] = get_posterior_summary(thetas, profile, config_version, standard_accuracy)
 
-                # Store values to be updated
-                updates = {
-                    'answer_history': profile.get('answer_history'),
-                    'estimates': estimates.to_dict()
-                }
+                        # Push changes to database
+                        update_db_item(table, key, updates)
 
-                # Push changes to database
-                update_db_item(table, key, updates)
+                        return None, None, estimates
+
+                next_design, question_number, estimates = submissions.run(submission_key(profile, request_data), compute)
+
+            if next_design is not None:
+
+                # Convert Next Design
+                profile['question_number'] = 'survey'
+                output_design = convert_design(model.decode(next_design), profile, profile)
+
+                inputs = {'profile_id': profile['profile_id'], 'question_number': question_number + 1}
+
+                return render_template('survey.html', output_design=output_design, inputs=inputs, answer_values = answers, question_number=question_number, nquestions=nquestions, redirect_url='survey', css_style=css_style_markup)
+
+            else:
 
-                if display_estimates:
+                if display_estimates and estimates is not None:
                     # calculate the mean and median of the dataframe using agg()
-                    result_df = estimates.transpose()
+                    result_df = pd.DataFrame(estimates).transpose()
 
                     # add the parameter names as a separate column
                     result_df['Parameter'] = result_df.index
@@ -291,9 +550,7 @@ def survey():
             profile = add_to_profile(profile)
 
             # Select first design
-            objective = get_objective(answers, likelihood_pdf, profile)
-            design_tuner = get_design_tuner(design_params, objective, conf_dict_earlystop)
-            next_design = get_next_design(sample_thetas(theta_params, size_thetas), design_tuner)
+            next_design = select_first_design(profile)
 
             # Add next_design to design history and store placeholder for answer_history
             profile['design_history'] = [next_design]
@@ -302,22 +559,21 @@ def survey():
             # Put item into database
             table.put_item(Item=float_to_decimal(profile))
             profile['question_number'] = 'survey'
-            output_design = convert_design(next_design, profile, profile)
+            output_design = convert_design(model.decode(next_design), profile, profile)
 
-            inputs = {'profile_id': profile['profile_id']}
+            inputs = {'profile_id': profile['profile_id'], 'question_number': 2}
 
             return render_template('survey.html', output_design=output_design, inputs=inputs, answer_values = answers, question_number=1, nquestions=nquestions, redirect_url='survey', css_style=css_style_markup)
 
-@app.route('/surveyCTO', methods=['GET', 'POST'])
-def surveyCTO():
+@json_route('/surveyCTO', methods=['GET', 'POST'])
+def surveyCTO(request_data, method):
 
     # Get data from request
-    request_data = get_request(request)
     profile_id = request_data.get('profile_id')
 
     print(f'Working with profile_id: {profile_id}. Request data: {request_data}')
 
-    if request.method == "GET":
+    if method == "GET":
 
         # If GET request, simply return random design.
         profile = dict()
@@ -325,13 +581,14 @@ def surveyCTO():
         objective = get_objective(answers, likelihood_pdf)
         design_tuner = get_design_tuner(design_params, objective, conf_dict_earlystop)
         design = design_tuner.ds.get_random_sample(size=1)[0]
-        return format_response(convert_design_surveycto(design, profile, {}), allow_CORS=True)
+        return format_response(convert_design_surveycto(model.decode(design), profile, {}), allow_CORS=True)
 
     if profile_id:
 
-        # Try to retrieve the item from the database
+        # Try to retrieve the item from the database. An answer runs inference, unless the design tree has the next design.
         key = {'profile_id': profile_id}
-        response = table.get_item(Key=key)
+        new_answer = str(request_data.get('answer')) in [str(a) for a in answers]
+        response, prior_thetas = read_profile(key, N=size_thetas if new_answer and (request_data.get('return_estimates') or not design_tree) else None)
 
         if 'Item' in response:
 
@@ -352,14 +609,14 @@ def surveyCTO():
 
                     if len(d_hist) == 0:
                         # Use new thetas if no designs have been asked.
-                        thetas = sample_thetas(theta_params, size_thetas)
+                        thetas = sample_thetas(theta_params, size_thetas, precision)
                     else:
-                        thetas = pmc(theta_params, profile['answer_history'], profile['design_history'], likelihood_pdf, size_thetas, J=default_J, profile=profile)
+                        thetas = infer_thetas(profile)
 
                     # Select design
-                    objective = get_objective(answers, likelihood_pdf, profile)
+                    objective = get_objective(answers, likelihood_pdf, profile if profile_dependent_likelihood else None, log_likelihood_pdf, batcher=scoring_batcher)
                     design_tuner = get_design_tuner(design_params, objective, conf_dict_earlystop)
-                    next_design = get_next_design(thetas, design_tuner)
+                    next_design = search_design(thetas, design_tuner, profile)
 
                     # Add next_design to design history
                     profile['design_history'].append(next_design)
@@ -371,7 +628,7 @@ def surveyCTO():
 
                     # Push changes to database
                     update_db_item(table, key, updates)
-                    next_design = convert_design_surveycto(next_design, profile, profile)
+                    next_design = convert_design_surveycto(model.decode(next_design), profile, profile)
                     print('Received request for profile with no design history. Sending new design.')
 
                     return format_response(next_design, allow_CORS=True)
@@ -380,32 +637,43 @@ def surveyCTO():
 
                     # Return previous design history
                     prev_design = d_hist[-1]
-                    prev_design = convert_design_surveycto(prev_design, profile, request_data)
+                    prev_design = convert_design_surveycto(model.decode(prev_design), profile, request_data)
                     return format_response(prev_design, allow_CORS=True)
 
+            # If the answer was already submitted (e.g. a retry after a timeout), return the stored result
+            elif is_replay(profile, request_data):
+
+                if request_data.get('return_estimates') and profile.get('estimates') is not None:
+                    return format_response({ "estimates": convert_dict_to_string(profile['estimates']) }, allow_CORS=True)
+
+                next_design = get_replayed_design(profile, request_data) or profile['design_history'][-1]
+                next_design = convert_design_surveycto(model.decode(next_design), profile, request_data)
+                return format_response(next_design, allow_CORS=True)
+
             # If answer is in answers
             else:
 
-                # Update answer history
-                profile['answer_history'].append(answer)
+                if request_data.get('return_estimates'):
 
-                # Compute pmc to get posterior distribution after answer
-                thetas = pmc(theta_params, profile['answer_history'], profile['design_history'], likelihood_pdf, size_thetas, J=default_J, profile=profile)
+                    def compute():
+                        # Update answer history
+                        updates = record_answer(profile, answer, request_data)
 
-                if request_data.get('return_estimates'):
+                        # Compute posterior distribution after answer
+                        thetas = infer_thetas(profile, prior_thetas=prior_thetas)
 
-                    # New
+                        posterior_summary = get_posterior_summary(thetas, profile, config_version, standard_accuracy)
+                        estimates = posterior_summary['estimates']
 
-                    estimates = thetas.agg(['mean', 'median', 'std']).to_dict()
+                        # Store values to be updated
+                        updates['estimates'] = estimates
+                        updates['posterior_summary'] = posterior_summary
 
-                    # Store values to be updated
-                    updates = {
-                        'answer_history': profile.get('answer_history'),
-                        'estimates': estimates
-                    }
+                        # Push changes to database
+                        update_db_item(table, key, updates)
+                        return estimates
 
-                    # Push changes to database
-                    update_db_item(table, key, updates)
+                    estimates = submissions.run(submission_key(profile, request_data), compute)
 
                     # Convert estimates
                     formatted_estimates = convert_dict_to_string(estimates)
@@ -413,24 +681,30 @@ def surveyCTO():
 
                 else:
 
-                    # Compute next design
-                    objective = get_objective(answers, likelihood_pdf, profile)
-                    design_tuner = get_design_tuner(design_params, objective, conf_dict_earlystop)
-                    next_design = get_next_design(thetas, design_tuner)
+                    def compute():
+                        # Update answer history
+                        updates = record_answer(profile, answer, request_data)
 
-                    # Update item
-                    profile['design_history'].append(next_design)
+                        # Compute next design
+                        next_design, thetas = select_next_design(profile, prior_thetas)
 
-                    # Store updates
-                    updates = {
-                        'design_history': profile.get('design_history'),
-                        'answer_history': profile.get('answer_history')
-                    }
+                        # Update item
+                        profile['design_history'].append(next_design)
 
-                    # Push changes to database
-                    update_db_item(table, key, updates)
+                        # Store updates
+                        updates['design_history'] = profile.get('design_history')
+                        if thetas is not None:
+                            updates['posterior_summary'] = get_posterior_summary(thetas, profile, config_version, standard_accuracy)
+
+                        # Push changes to database
+                        update_db_item(table, key, updates)
+                        return profile
+
+                    # Retries that wait for this submission use the updated profile
+                    profile = submissions.run(submission_key(profile, request_data), compute)
+                    next_design = profile['design_history'][-1]
 
-                    next_design = convert_design_surveycto(next_design, profile, request_data)
+                    next_design = convert_design_surveycto(model.decode(next_design), profile, request_data)
                     return format_response(next_design, allow_CORS=True)
 
         else:
@@ -443,9 +717,7 @@ def surveyCTO():
             profile = add_to_profile(profile)
 
             # Select first design
-            objective = get_objective(answers, likelihood_pdf, profile)
-            design_tuner = get_design_tuner(design_params, objective, conf_dict_earlystop)
-            next_design = get_next_design(sample_thetas(theta_params, size_thetas), design_tuner)
+            next_design = select_first_design(profile, prior_thetas)
 
             # Add next_design to design history and store placeholder for answer_history
             profile['design_history'] = [next_design]
@@ -453,7 +725,7 @@ def surveyCTO():
 
             # Put item into database
             table.put_item(Item=float_to_decimal(profile))
-            next_design = convert_design_surveycto(next_design, profile, profile)
+            next_design = convert_design_surveycto(model.decode(next_design), profile, profile)
 
             print(f'Successfully created profile for {profile.get("survey_id") or profile.get("profile_id")}')
 
@@ -469,7 +741,7 @@ def surveyCTO():
         objective = get_objective(answers, likelihood_pdf)
         design_tuner = get_design_tuner(design_params, objective, conf_dict_earlystop)
         design = design_tuner.ds.get_random_sample(size=1)[0]
-        return format_response(convert_design_surveycto(design, profile, {}), allow_CORS=True)
+        return format_response(convert_design_surveycto(model.decode(design), profile, {}), allow_CORS=True)
 
 if __name__ == "__main__":
     app.run()
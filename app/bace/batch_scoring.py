@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+import traceback
+
+import numpy as np
+import pandas as pd
+
+from .particles import Particles, accepts_arrays
+from .design_optimization import mutual_information_stacked
+
+# Micro-batching of design scoring across concurrent requests (long-running server with threaded workers, see serve.py).
+# Requests that score designs at about the same time submit them to a ScoringBatcher. A scheduler thread collects
+# the submissions that arrive within a short window and computes the mutual information of all of them in one stacked
+# computation (mutual_information_stacked, one "respondent" per design with its particles repeated), then hands each
+# request its scores. Many small matrix operations become a few large ones, which raises throughput under bursty load.
+# Designs are passed to the likelihood as arrays of attributes that broadcast against the stacked particles, so the likelihood
+# must be vectorized over designs as well (as required by tools/simulation/cohort_simulation.py) and must not use the profile.
+
+class ScoringBatcher:
+    def __init__(self, window=0.002, max_rows=65536):
+        """
+        Input:
+            window: seconds to wait for submissions from other requests before scoring a batch
+            max_rows: maximum number of stacked particle rows computed at once (bounds memory)
+        """
+        self.window = window
+        self.max_rows = max_rows
+        self.pending = []
+        self.condition = threading.Condition()
+        self.thread = None
+        self.thread_pid = None
+        self.n_batches = 0
+        self.n_submissions = 0
+
+    def score(self, thetas, designs, answers, likelihood_pdf, log_likelihood_pdf=None):
+        """
+        Score designs under particles thetas, together with the submissions of concurrent requests. Blocks until done.
+
+        Returns:
+            scores: list of mutual information values, in the order of designs
+        """
+        if len(designs) == 0:
+            return []
+
+        submission = dict(
+            thetas=thetas, designs=designs, answers=answers, likelihood_pdf=likelihood_pdf, log_likelihood_pdf=log_likelihood_pdf,
+            done=threading.Event(), scores=None, error=None
+        )
+        with self.condition:
+            self.start()
+            self.pending.append(submission)
+            self.condition.notify()
+
+        submission['done'].wait()
+        if submission['error'] is not None:
+            raise submission['error']
+        return submission['scores']
+
+    def start(self):
+        # Start the scheduler thread on first use (in each process, so server workers forked after startup get their own)
+        if self.thread is None or self.thread_pid != os.getpid():
+            self.pending = []
+            self.thread = threading.Thread(target=self.run, name='bace-scoring-batcher', daemon=True)
+            self.thread_pid = os.getpid()
+            self.thread.start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+
+            # Collect the submissions of other requests that arrive within the window
+            time.sleep(self.window)
+            with self.condition:
+                batch, self.pending = self.pending, []
+
+            self.n_batches += 1
+            self.n_submissions += len(batch)
+            try:
+                self.score_batch(batch)
+            except Exception as e:
+                # Never leave a request waiting
+                for submission in batch:
+                    if not submission['done'].is_set():
+                        submission['error'] = e
+                        submission['done'].set()
+
+    def score_batch(self, batch):
+        # Submissions can be stacked if they use the same likelihood and particles of the same size and columns
+        groups = dict()
+        for submission in batch:
+            key = (
+                tuple(submission['answers']), submission['likelihood_pdf'], submission['log_likelihood_pdf'],
+                len(submission['thetas']), tuple(submission['thetas'].columns)
+            )
+            groups.setdefault(key, []).append(submission)
+
+        for group in groups.values():
+            try:
+                scores = []
+                for chunk in split_designs(group, self.max_rows):
+                    scores.append(score_stacked(chunk, group[0]))
+                scores = np.concatenate(scores)
+
+                start = 0
+                for submission in group:
+                    end = start + len(submission['designs'])
+                    submission['scores'] = [float(score) for score in scores[start:end]]
+                    start = end
+            except Exception as e:
+                traceback.print_exception(type(e), e, e.__traceback__)
+                for submission in group:
+                    submission['error'] = e
+            finally:
+                for submission in group:
+                    submission['done'].set()
+
+def split_designs(group, max_rows):
+    # (thetas, design) pairs of a group, in chunks of at most max_rows stacked particle rows
+    n_particles = len(group[0]['thetas'])
+    chunk_size = max(1, max_rows // max(1, n_particles))
+    pairs = [(submission['thetas'], design) for submission in group for design in submission['designs']]
+    return [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+
+def score_stacked(pairs, submission):
+    # Mutual information of each (thetas, design) pair, computed as one stacked problem
+    thetas = pairs[0][0]
+    R, n_particles = len(pairs), len(thetas)
+    values = np.stack([pair_thetas.to_numpy() for pair_thetas, _ in pairs]) # (R x n x d)
+    designs = {key: np.asarray([pair_design[key] for _, pair_design in pairs]) for key in pairs[0][1]}
+
+    likelihood = submission['log_likelihood_pdf'] if submission['log_likelihood_pdf'] is not None else submission['likelihood_pdf']
+    if accepts_arrays(likelihood):
+        # Columns of the particles are (R x n) and design attributes are (R x 1), so each design attribute
+        # is evaluated once per design and broadcast over its particles
+        stacked = Particles(values.reshape(R * n_particles, -1), thetas.columns)
+        stacked.arrays = {name: values[:, :, i] for i, name in enumerate(stacked.columns)}
+        design = {key: value[:, np.newaxis] for key, value in designs.items()}
+    else:
+        # DataFrames have one row per particle, so repeat each design's attributes for its particles
+        stacked = pd.DataFrame(values.reshape(R * n_particles, -1), columns=thetas.columns)
+        design = {key: np.repeat(value, n_particles) for key, value in designs.items()}
+
+    return mutual_information_stacked(
+        stacked, submission['answers'], submission['likelihood_pdf'], design, R,
+        profile=submission.get('profile'), log_likelihood_pdf=submission['log_likelihood_pdf']
+    )
@@ -1,13 +1,34 @@
 # External packages
-from mango import scheduler, Tuner
+from mango import Tuner
 import numpy as np
+from scipy.special import xlogy, logsumexp
+import threading
 import time
 
+from .particles import to_particles, take_rows, accepts_arrays
+from .parallel_scoring import score_designs, map_blocks
+from .jit_likelihood import uses_kernel
+from .mi_cache import mi_cache
+
 # Set it up so optimization stops after max_opt_time seconds
-class context:
-    max_opt_time=5 # default is 5 seconds if unchanged
-    start_time=None
-    thetas=None
+# max_opt_time is shared by all threads. The state of the current optimization (start_time, thetas) is kept per thread,
+# so requests served concurrently by threads of the same process do not overwrite each other's particles.
+class Context(threading.local):
+    shared_max_opt_time = 5 # default is 5 seconds if unchanged
+
+    def __init__(self):
+        self.start_time = None
+        self.thetas = None
+
+    @property
+    def max_opt_time(self):
+        return Context.shared_max_opt_time
+
+    @max_opt_time.setter
+    def max_opt_time(self, value):
+        Context.shared_max_opt_time = value
+
+context = Context()
 
 # early_stopping examples: https://github.com/ARM-software/mango/blob/main/examples/EarlyStopping.ipynb
 def early_stop(results):
@@ -24,38 +45,147 @@ def early_stop(results):
             return True
     return False
 
-def get_objective(answers, likelihood_pdf, profile=None):
-    # Specify optimizer
-    @scheduler.serial
-    def objective(**design):
-        return mutual_information(
-            thetas=context.thetas,
-            answers=answers,
-            likelihood_pdf=likelihood_pdf,
-            design=design,
-            profile=profile
-        )
+def get_objective(answers, likelihood_pdf, profile=None, log_likelihood_pdf=None, batcher=None):
+    """
+    Objective for the Tuner: takes a list of designs and returns their mutual information under context.thetas.
+
+    Input:
+        batcher: (optional) ScoringBatcher (see bace/batch_scoring.py) that scores designs together with those of
+            concurrent requests. Only for likelihoods that do not use the profile.
+    """
+    def score(thetas, designs):
+        return [
+            mutual_information(
+                thetas=thetas,
+                answers=answers,
+                likelihood_pdf=likelihood_pdf,
+                design=design,
+                profile=profile,
+                log_likelihood_pdf=log_likelihood_pdf
+            ) for design in designs
+        ]
+
+    def compute(thetas, designs):
+        if batcher is not None:
+            return batcher.score(thetas, designs, answers, likelihood_pdf, log_likelihood_pdf)
+        # Batches of designs are scored in parallel chunks when cores are available (see bace/parallel_scoring.py)
+        return score_designs(lambda chunk: score(thetas, chunk), designs)
+
+    # Everything other than the particles and the design that the scores depend on (see bace/mi_cache.py).
+    # Profiles are identified by profile_id. Scores for a profile without one are not cached.
+    profile_key = profile.get('profile_id') if profile is not None else None
+    scope = (tuple(str(answer) for answer in answers), id(likelihood_pdf), id(log_likelihood_pdf), profile_key)
+
+    def objective(designs):
+        # Particles of the calling thread's optimization, also used by the threads that score chunks
+        thetas = context.thetas
+        if profile is not None and profile_key is None:
+            return list(compute(thetas, designs))
+        return mi_cache.score(thetas, designs, scope, lambda missing: compute(thetas, missing))
+
     return objective
 
 def get_conf_dict(conf_dict):
     conf_dict['early_stopping'] = early_stop
     return conf_dict
 
+class Codes(list):
+    """
+    Integer codes of a categorical design attribute (design_encoding = 'codes', see bace/runtime_model.py).
+    Mango treats lists of integers as ordinal values in its GP, so the Tuner searches over the codes as strings
+    (one-hot encoded like other categories), and designs are converted back to integer codes before they reach
+    the objective and constraints, and in the designs returned by get_next_design and get_next_design_halving.
+    """
+
 def get_design_tuner(design_params, objective, conf_dict):
+    coded_params = [key for key, values in design_params.items() if isinstance(values, Codes)]
+    if coded_params:
+        def decode(designs):
+            return [from_search(design, coded_params) for design in designs]
+
+        constraint = conf_dict.get('constraint')
+        search_objective = objective
+        objective = lambda designs: search_objective(decode(designs))
+        if constraint is not None:
+            conf_dict = dict(conf_dict, constraint=lambda designs: constraint(decode(designs)))
+        design_params = {key: [str(code) for code in values] if key in coded_params else values for key, values in design_params.items()}
+
     design_tuner = Tuner(design_params, objective, conf_dict)
+    design_tuner.coded_params = coded_params
     return design_tuner
 
+def from_search(design, coded_params):
+    # Design from the Tuner with the categorical codes searched as strings converted back to integers
+    return {key: int(value) if key in coded_params else value for key, value in design.items()}
+
 def get_next_design(thetas, tuner):
     context.start_time=None
     context.thetas=thetas.copy()
-    return tuner.maximize()['best_params']
+    return from_search(tuner.maximize()['best_params'], tuner.coded_params)
+
+# Design search methods: 'bayesian' (Mango, get_next_design) or 'successive_halving' (get_next_design_halving)
+design_searches = ['bayesian', 'successive_halving']
+
+def get_next_design_halving(thetas, tuner, n_candidates=256, min_particles=100, eta=2):
+    """
+    Successive halving: score many random candidate designs on a small random subset of the particles,
+    keep the best 1/eta of the candidates, and re-score them on eta times as many particles,
+    until the full population decides between the remaining candidates.
+    Alternative to Bayesian optimization (get_next_design) using the tuner's domain (including constraints) and objective.
+    Stops early with the best candidate so far if context.max_opt_time is exceeded.
+
+    Input:
+        thetas: (n x d DataFrame) particle population
+        tuner: Tuner from get_design_tuner
+        n_candidates: number of random candidate designs scored in the first round
+        min_particles: number of particles used in the first round
+        eta: factor by which candidates are cut and particles are increased in each round
+
+    Returns:
+        next_design: the candidate with the highest mutual information in the last round
+    """
+    start_time = time.time()
+
+    # Constraints can reject samples, so draw until there are enough designs
+    candidates = []
+    while len(candidates) < n_candidates:
+        candidates.extend(from_search(design, tuner.coded_params) for design in tuner.ds.get_random_sample(size=n_candidates - len(candidates)))
+
+    # Particles from resampling are ordered, so use a random subset for each fidelity
+    order = np.random.permutation(len(thetas))
+    n_particles = min(min_particles, len(thetas))
+
+    while True:
+        context.thetas = thetas.iloc[order[:n_particles]].reset_index(drop=True)
+        scores = np.asarray(tuner.objective_function(candidates))
+
+        if n_particles >= len(thetas) or len(candidates) == 1 or time.time() - start_time > context.max_opt_time:
+            break
+
+        # Keep the leaders and re-score them on more particles
+        n_keep = max(1, int(np.ceil(len(candidates) / eta)))
+        candidates = [candidates[i] for i in np.argsort(-scores, kind='stable')[:n_keep]]
+        n_particles = min(len(thetas), n_particles * eta)
+        if len(candidates) == 1:
+            return candidates[0]
+
+    return candidates[int(np.argmax(scores))]
+
+def to_rows(values, n_particles, R):
+    # Likelihood values as an (R x n) array. Likelihoods can return a scalar, one value per particle, or an (R x n) array
+    # (if the particles' columns are (R x n), as in bace/batch_scoring.py).
+    values = np.asarray(values)
+    if values.size == n_particles:
+        return values.reshape(R, -1)
+    return np.broadcast_to(values, (n_particles,)).reshape(R, -1)
 
 # Specify objective function - Mutual Information
 def mutual_information(thetas,
                        answers,
                        likelihood_pdf,
                        design,
-                       profile=None):
+                       profile=None,
+                       log_likelihood_pdf=None):
     """
     Formula for calculating the mutual information. The utility function we are maximizing when optimizing future designs.
 
@@ -64,49 +194,98 @@ def mutual_information(thetas,
         answers: possible answers that likelihood can take on
         likelihood_pdf: returns l(answer | theta, design)
         design: design we are evaluating mutual information at
+        log_likelihood_pdf: (optional) returns log l(answer | theta, design). If provided, it is used instead of likelihood_pdf.
 
     Returns:
         mutual_info: Mutual information given design
     """
 
-    # Note for computation, we only need to calculate the likelihood and normalizing constants for n-1 answers since probabilities sum to 1
-    # likelihood(final_option) = 1 - sum(likelihood(other options))
-    # mean(likelihood(final_option)) = 1 - sum(mean(likelihood(other_options)))
+    return mutual_information_stacked(thetas, answers, likelihood_pdf, design, 1, profile, log_likelihood_pdf)[0]
+
+def mutual_information_stacked(thetas,
+                               answers,
+                               likelihood_pdf,
+                               design,
+                               R,
+                               profile=None,
+                               log_likelihood_pdf=None):
+    """
+    Mutual information for R respondents at once.
 
-    # Initialize components for final option
-    likelihood_final_option = np.ones(len(thetas))
-    mean_final_option = 1
+    Input:
+        thetas: (R*n x d DataFrame) particle populations of R respondents, stacked as in pmc_inference.pmc_stacked
+        design: a single design, or a design whose attributes are arrays aligned with the rows of thetas
+        R: number of respondents
+        (other inputs as in mutual_information)
 
-    # Initialize mutual_info to keep track of sum.
-    mutual_info = 0
+    Returns:
+        mutual_info: (R,) array of mutual information given design for each respondent
+    """
 
-    # Calculate components for all but final answer option.
-    for answer in answers[:-1]:
+    # MI = sum over answers of [ mean(l * log(l)) - mean(l) * log(mean(l)) ]
+    # Every answer is evaluated directly (rather than as 1 - sum of the other answers) and 0 * log(0) is taken to be 0,
+    # so likelihoods do not need to be clipped away from 0 and 1. Means are always accumulated in float64.
 
-        # Compute likelihood of observing answer to design given preferences theta
-        likelihood = likelihood_pdf(answer, thetas, design, profile)
-        # Compute mean
-        mean_likelihood = np.mean(likelihood)
+    # Compiled kernel loop over particles for a single design (see bace/jit_likelihood.py)
+    if R == 1 and uses_kernel(log_likelihood_pdf) and not any(np.ndim(value) for value in design.values()):
+        return np.array([log_likelihood_pdf.mutual_information(thetas, design)])
+
+    # Convert particles to arrays once if the likelihood accepts them (see bace/runtime_model.py: compile_config)
+    if accepts_arrays(log_likelihood_pdf if log_likelihood_pdf is not None else likelihood_pdf):
+        thetas = to_particles(thetas)
+
+    # For a single respondent, the particles are split into blocks scored in parallel if cores are available
+    # (see bace/parallel_scoring.py), and the blocks' sums are added up
+    def sums(start, stop):
+        return likelihood_sums(take_rows(thetas, start, stop) if R == 1 else thetas, answers, likelihood_pdf, design, R, profile, log_likelihood_pdf)
+    blocks = map_blocks(sums, len(thetas)) if R == 1 else [sums(0, len(thetas))]
+
+    n = len(thetas) // R
+    sum_l_log_l = np.sum([block[1] for block in blocks], axis=0)
+
+    if log_likelihood_pdf is None:
+        mean_likelihood = np.sum([block[0] for block in blocks], axis=0) / n
+        mean_l_log_mean_l = xlogy(mean_likelihood, mean_likelihood)
+    else:
+        # log(mean(l)) via log-sum-exp
+        log_mean_likelihood = logsumexp([block[0] for block in blocks], axis=0) - np.log(n)
+        with np.errstate(invalid='ignore'):
+            mean_l_log_mean_l = np.where(np.isfinite(log_mean_likelihood), np.exp(log_mean_likelihood) * log_mean_likelihood, 0)
+
+    # Compute mutual information, summed over answers
+    mutual_info = np.sum(sum_l_log_l / n - mean_l_log_mean_l, axis=0)
+
+    return mutual_info
+
+def likelihood_sums(thetas, answers, likelihood_pdf, design, R, profile=None, log_likelihood_pdf=None):
+    """
+    Sums over particles from which mutual information is computed, for each answer and respondent.
+
+    Returns:
+        sum_l: (A x R) array of sums of l, or of log-sum-exp of log(l) if log_likelihood_pdf is given
+        sum_l_log_l: (A x R) array of sums of l * log(l)
+    """
+    sum_l = np.zeros((len(answers), R))
+    sum_l_log_l = np.zeros((len(answers), R))
 
-        # Compute mutual information for given answer
-        with np.errstate(divide='ignore'):
-            mutual_info_component = np.mean(likelihood * np.log(likelihood)) - mean_likelihood * np.log(mean_likelihood)
+    for a, answer in enumerate(answers):
 
-        mutual_info += mutual_info_component
+        if log_likelihood_pdf is None:
 
-        # Update components for final option
-        likelihood_final_option -= likelihood
-        mean_final_option -= mean_likelihood
+            # Compute likelihood of observing answer to design given preferences theta (one row per respondent)
+            likelihood = to_rows(likelihood_pdf(answer, thetas, design, profile), len(thetas), R)
+            sum_l[a] = np.sum(likelihood, axis=1, dtype=np.float64)
+            sum_l_log_l[a] = np.sum(xlogy(likelihood, likelihood), axis=1, dtype=np.float64)
 
-    # For numerical reasons, set zeroes equal to eps
-    likelihood_final_option[likelihood_final_option == 0] = np.finfo(float).eps
-    mean_final_option = np.finfo(float).eps if mean_final_option==0 else mean_final_option
+        else:
 
-    # Add information from final option
-    with np.errstate(divide='ignore'):
-        mutual_info_final_component = np.mean(likelihood_final_option * np.log(likelihood_final_option)) - mean_final_option * np.log(mean_final_option)
+            # Compute log-likelihood of observing answer to design given preferences theta (one row per respondent)
+            log_likelihood = to_rows(log_likelihood_pdf(answer, thetas, design, profile), len(thetas), R)
+            sum_l[a] = logsumexp(log_likelihood, axis=1)
 
-    mutual_info += mutual_info_final_component
+            # Terms with l = 0 (log(l) = -inf) contribute 0
+            with np.errstate(invalid='ignore'):
+                l_log_l = np.where(np.isneginf(log_likelihood), 0, np.exp(log_likelihood) * log_likelihood)
+            sum_l_log_l[a] = np.sum(l_log_l, axis=1, dtype=np.float64)
 
-    # Return total mutual information. Return 0 if mutual_info < 0 due to numerical issues.
-    return mutual_info if mutual_info > 0 else 0
+    return sum_l, sum_l_log_l
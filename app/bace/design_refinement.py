@@ -0,0 +1,89 @@
+import numpy as np
+from scipy.stats import rv_continuous
+
+from .batch_scoring import score_stacked
+
+# Local refinement of the continuous attributes of a design.
+# Mango explores continuous attributes (scipy.stats distributions in design_params) only through its random domain
+# sample and the GP acquisition. After the search, refine_design takes the best design and improves its continuous
+# attributes by projected gradient ascent on mutual information within the attributes' support. Gradients are
+# central finite differences, and the design and all its perturbations are scored in one stacked computation
+# (see bace/batch_scoring.py: score_stacked), so each step costs about one vectorized MI evaluation.
+# Categorical, list-valued and discrete (e.g. scipy.stats.randint) attributes are kept as they are. Steps that break the Tuner's constraint are rejected.
+#
+# Enable with design_refinement = True in user_config (requires a likelihood that is vectorized over designs).
+
+step = 1e-3 # Finite difference step, as a fraction of each attribute's range
+
+def get_bounds(distribution):
+    # Range of a continuous attribute: its support, or its 0.1% and 99.9% quantiles if the support is unbounded
+    lower, upper = distribution.support()
+    if not np.isfinite(lower):
+        lower = distribution.ppf(0.001)
+    if not np.isfinite(upper):
+        upper = distribution.ppf(0.999)
+    return float(lower), float(upper)
+
+def is_continuous(values):
+    # Continuous attributes are frozen scipy.stats continuous distributions
+    return isinstance(getattr(values, 'dist', None), rv_continuous)
+
+def refine_design(design, thetas, tuner, answers, likelihood_pdf, profile=None, log_likelihood_pdf=None, max_steps=10, learning_rate=0.1):
+    """
+    Improve the continuous attributes of a design by projected gradient ascent on mutual information.
+
+    Input:
+        design: design to start from (e.g. the best design found by get_next_design)
+        thetas: (n x d DataFrame) particle population
+        tuner: Tuner from get_design_tuner (for the design parameters and constraint)
+        max_steps: maximum number of gradient steps
+        learning_rate: initial step length, as a fraction of the attributes' ranges
+
+    Returns:
+        design: the refined design (the input design if no continuous attribute can be improved)
+    """
+    keys = [key for key, values in tuner.ds.param_dict.items() if is_continuous(values) and key in design]
+    if len(keys) == 0:
+        return design
+
+    bounds = np.array([get_bounds(tuner.ds.param_dict[key]) for key in keys])
+    lower, width = bounds[:, 0], bounds[:, 1] - bounds[:, 0]
+    submission = dict(answers=answers, likelihood_pdf=likelihood_pdf, log_likelihood_pdf=log_likelihood_pdf, profile=profile)
+    constraint = tuner.ds.constraint
+
+    def to_design(x):
+        # Design with continuous attributes at x (scaled to [0, 1])
+        return {**design, **{key: float(lower[k] + x[k] * width[k]) for k, key in enumerate(keys)}}
+
+    def score(points):
+        return score_stacked([(thetas, to_design(x)) for x in points], submission)
+
+    x = np.clip((np.array([design[key] for key in keys], dtype=np.float64) - lower) / width, 0, 1)
+    offsets = step * np.vstack([np.eye(len(keys)), -np.eye(len(keys))])
+    t = learning_rate
+    improved = False
+
+    for _ in range(max_steps):
+        # Score the design and its perturbations at once
+        scores = score(np.vstack([x, np.clip(x + offsets, 0, 1)]))
+        value = scores[0]
+        gradient = (scores[1:len(keys)+1] - scores[len(keys)+1:]) / (2 * step)
+        norm = np.linalg.norm(gradient)
+        if not np.isfinite(norm) or norm == 0:
+            break
+
+        # Backtracking along the projected gradient direction
+        while t > 1e-3:
+            candidate = np.clip(x + t * gradient / norm, 0, 1)
+            feasible = constraint is None or bool(np.all(constraint([to_design(candidate)])))
+            if feasible and score([candidate])[0] > value:
+                x = candidate
+                improved = True
+                t *= 1.5
+                break
+            t /= 2
+        else:
+            break
+
+    # Without an improvement, keep the original design (x may have been clipped to the range of an unbounded attribute)
+    return to_design(x) if improved else design
@@ -0,0 +1,87 @@
+import json
+
+from .design_optimization import get_objective, get_design_tuner, get_next_design
+from .pmc_inference import pmc, sample_thetas
+from .estimates import to_native
+
+# Precomputed designs for the first questions of a survey.
+# Until the likelihood depends on the profile, the next design is determined by the answers given so far
+# (up to the randomness of sampling and optimization). The design tree stores the optimal design for every answer path
+# up to a given depth: the root is the first design, its children are the second designs after each possible answer, etc.
+# tools/design_tree/build_design_tree.py compiles the tree and saves it next to user_config (bace/design_tree.json).
+# The app serves questions in the tree by lookup and computes later questions as usual.
+# A saved tree is only used if it was built with the same config version (see bace/estimates.py: get_config_version).
+
+design_tree_file = 'design_tree.json' # Default location, in the same folder as this file
+
+def get_path_key(answer_history):
+    # Key of a node in the tree: the answers given so far, e.g. '1|0' ('' for the first design)
+    return '|'.join(str(answer) for answer in answer_history)
+
+def compile_design_tree(theta_params, answers, likelihood_pdf, design_params, conf_dict, size_thetas, depth, J=5, precision=None, log_likelihood_pdf=None):
+    """
+    Compute the optimal design for every answer path with fewer than `depth` answers.
+
+    Returns:
+        nodes: dict mapping path keys (see get_path_key) to designs. Has 1 + A + ... + A^(depth-1) entries for A possible answers.
+    """
+    objective = get_objective(answers, likelihood_pdf, None, log_likelihood_pdf)
+
+    nodes = dict()
+    level = [([], [])] # (answer_history, design_history) of each node at the current depth
+    for d in range(depth):
+        next_level = []
+        for answer_history, design_history in level:
+
+            if len(answer_history) == 0:
+                thetas = sample_thetas(theta_params, size_thetas, precision)
+            else:
+                thetas = pmc(theta_params, answer_history, design_history, likelihood_pdf, size_thetas, J=J, precision=precision, log_likelihood_pdf=log_likelihood_pdf)
+
+            design = get_next_design(thetas, get_design_tuner(design_params, objective, conf_dict))
+            design = {key: to_native(value) for key, value in design.items()}
+            nodes[get_path_key(answer_history)] = design
+
+            next_level.extend((answer_history + [answer], design_history + [design]) for answer in answers)
+
+        print(f'Computed designs for question {d+1} of {depth} ({len(level)} answer paths)')
+        level = next_level
+
+    return nodes
+
+def save_design_tree(path, nodes, depth, config_version):
+    with open(path, 'w') as f:
+        json.dump({'config_version': config_version, 'depth': depth, 'nodes': nodes}, f, indent=1)
+
+def load_design_tree(path, config_version):
+    # Return the saved tree if it exists and was built for this config version. Otherwise, return None.
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    if saved.get('config_version') != config_version:
+        print(f'Ignoring {path}: built for config version {saved.get("config_version")}, current version is {config_version}.')
+        return None
+
+    return saved['nodes']
+
+def lookup_design(nodes, answer_history, design_history):
+    """
+    Return the next design for a profile from the tree, or None if the profile's history is not in the tree.
+    The designs already asked must match the tree (e.g. a profile created before the tree was deployed will not).
+
+    Input:
+        answer_history: answers given so far
+        design_history: designs asked for those answers (designs after the last answer are ignored)
+    """
+    if len(design_history) < len(answer_history):
+        return None
+
+    for i in range(len(answer_history)):
+        if nodes.get(get_path_key(answer_history[:i])) != design_history[i]:
+            return None
+
+    design = nodes.get(get_path_key(answer_history))
+    return dict(design) if design is not None else None
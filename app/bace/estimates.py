@@ -0,0 +1,66 @@
+import hashlib
+import inspect
+import json
+
+# Posterior summaries (mean, median, std of each preference parameter) are stored in the profile under `posterior_summary`.
+# Each summary records a key for the history it summarizes and the accuracy (number of particles x PMC rounds) used to compute it,
+# so repeat requests for the same history can reuse it instead of re-running PMC.
+
+def get_config_version(user_config):
+    # Use `config_version` from user_config if specified. Otherwise, use a hash of the config's source code.
+    version = getattr(user_config, 'config_version', None)
+    if version is None:
+        try:
+            version = hashlib.sha256(inspect.getsource(user_config).encode()).hexdigest()[:16]
+        except (OSError, TypeError):
+            version = user_config.__name__
+    return str(version)
+
+def get_accuracy(N, J):
+    # Accuracy of a PMC posterior, measured as the total number of weighted samples drawn.
+    return N * J
+
+def to_native(obj):
+    # Convert numpy scalars (e.g. from mango designs) to Python types so that keys are stable across database round-trips.
+    return obj.item() if hasattr(obj, 'item') else str(obj)
+
+def get_summary_key(profile, config_version):
+    """
+    Hash of (profile_id, answer_history, design_history, config version) identifying a posterior.
+    Only answered designs are included, so a pending next design does not change the key.
+    """
+    answer_history = profile.get('answer_history') or []
+    design_history = (profile.get('design_history') or [])[:len(answer_history)]
+
+    history = [
+        profile.get('profile_id'),
+        [str(answer) for answer in answer_history],
+        design_history,
+        config_version
+    ]
+
+    return hashlib.sha256(json.dumps(history, sort_keys=True, default=to_native).encode()).hexdigest()
+
+def summarize_thetas(thetas):
+    return thetas.agg(['mean', 'median', 'std']).to_dict()
+
+def get_posterior_summary(thetas, profile, config_version, accuracy):
+    # Summarize the posterior for the profile's current history, to be stored as `posterior_summary`.
+    return {
+        'key': get_summary_key(profile, config_version),
+        'accuracy': accuracy,
+        'estimates': summarize_thetas(thetas)
+    }
+
+def get_cached_estimates(profile, config_version, accuracy):
+    # Return stored estimates if they summarize the profile's current history with at least the requested accuracy.
+    summary = profile.get('posterior_summary')
+
+    if (
+        summary is not None
+        and summary.get('key') == get_summary_key(profile, config_version)
+        and summary.get('accuracy', 0) >= accuracy
+    ):
+        return summary.get('estimates')
+
+    return None
@@ -0,0 +1,95 @@
+import dis
+import inspect
+import json
+import random
+
+from .design_optimization import get_objective, get_design_tuner, get_next_design, mutual_information
+from .pmc_inference import sample_thetas
+from .estimates import to_native
+
+# Pool of first designs computed under the prior.
+# Before the first answer, the posterior is the prior, so unless the likelihood depends on the profile,
+# choosing the first design is the same optimization problem for every new profile.
+# The pool is computed ahead of time (tools/first_designs/build_first_designs.py writes a file bundled with the app)
+# or at cold start (first_design_pool_size in user_config), and new profiles draw a design from it at random.
+# A saved pool is only used if it was built with the same config version (see bace/estimates.py: get_config_version).
+
+first_designs_file = 'first_designs.json' # Default location, in the same folder as this file
+
+def profile_parameter(likelihood):
+    # Name of the parameter that receives the profile (the 4th positional parameter), or None if there is none
+    try:
+        parameters = list(inspect.signature(likelihood).parameters.values())
+    except (TypeError, ValueError):
+        return 'profile'
+    positional = [p for p in parameters if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)]
+    if len(positional) >= 4:
+        return positional[3].name
+    if any(p.kind == p.VAR_POSITIONAL for p in parameters):
+        return next(p.name for p in parameters if p.kind == p.VAR_POSITIONAL)
+    return None
+
+def uses_profile(likelihood):
+    """
+    Check whether a likelihood function reads its profile argument (the 4th parameter, whatever its name).
+    Functions that cannot be inspected are assumed to use the profile.
+    """
+    if likelihood is None:
+        return False
+    likelihood = inspect.unwrap(likelihood) # Inspect the user's function, not the wrappers around it (e.g. KernelLikelihood of ArrayLikelihood)
+    name = profile_parameter(likelihood)
+    if name is None:
+        return False
+    try:
+        instructions = list(dis.get_instructions(likelihood))
+    except TypeError:
+        return True
+    for instruction in instructions:
+        if instruction.opname.startswith(('LOAD_FAST', 'LOAD_DEREF', 'LOAD_CLOSURE')):
+            argval = instruction.argval if isinstance(instruction.argval, tuple) else (instruction.argval,)
+            if name in argval:
+                return True
+    return False
+
+def compute_first_designs(theta_params, answers, likelihood_pdf, design_params, conf_dict, size_thetas, n_designs, precision=None, log_likelihood_pdf=None):
+    """
+    Run the design optimization under the prior n_designs times, each with a fresh prior sample.
+
+    Returns:
+        designs: list of {'design': design, 'mutual_information': value}
+    """
+    objective = get_objective(answers, likelihood_pdf, None, log_likelihood_pdf)
+
+    designs = []
+    for i in range(n_designs):
+        thetas = sample_thetas(theta_params, size_thetas, precision)
+        design = get_next_design(thetas, get_design_tuner(design_params, objective, conf_dict))
+        design = {key: to_native(value) for key, value in design.items()}
+        designs.append({
+            'design': design,
+            'mutual_information': float(mutual_information(thetas, answers, likelihood_pdf, design, log_likelihood_pdf=log_likelihood_pdf))
+        })
+        print(f'Computed first design {i+1} of {n_designs}')
+
+    return designs
+
+def save_first_designs(path, designs, config_version):
+    with open(path, 'w') as f:
+        json.dump({'config_version': config_version, 'designs': designs}, f, indent=1)
+
+def load_first_designs(path, config_version):
+    # Return the saved pool if it exists and was built for this config version. Otherwise, return None.
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    if saved.get('config_version') != config_version:
+        print(f'Ignoring {path}: built for config version {saved.get("config_version")}, current version is {config_version}.')
+        return None
+
+    return saved['designs']
+
+def draw_first_design(designs):
+    return dict(random.choice(designs)['design'])
@@ -0,0 +1,146 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from .pmc_inference import get_dtype, compute_lklhd_logpdf, systematic_sample
+from .densities import get_logpdf
+
+# Grid-based posterior for models with few preference parameters.
+# Theta space is discretized on a grid and the log-posterior is held as an array over the grid points:
+# the log prior mass of each cell plus one log-likelihood term per answer. An answer costs one likelihood
+# evaluation over the grid, with no importance sampling or resampling noise in the posterior itself.
+#
+# The initial grid has equal prior mass per cell (points at prior quantiles), so unbounded priors are covered.
+# When the posterior concentrates on a small part of the grid (effective number of points below refine_ess_fraction
+# of the grid), the grid is refined: a new grid of the same size is placed over the box that holds all but
+# refine_tail of the posterior mass, and the log-likelihood of all answers is recomputed on it.
+#
+# Grid states are kept in memory per profile and extended with new answers, so each question only adds the
+# log-likelihood of the latest answer. Designs are chosen with particles drawn from the grid posterior by systematic
+# sampling, i.e. the grid points with their posterior weights rounded to multiples of 1/N.
+#
+# Select with inference = 'grid' in user_config (grid_size sets the total number of grid points, grid_refine = False
+# keeps the initial grid).
+
+refine_ess_fraction = 0.05
+refine_tail = 1e-6
+max_cached_grids = 1024
+
+grid_cache = OrderedDict()
+grid_cache_lock = threading.Lock()
+
+def points_per_dimension(grid_size, n_params):
+    return max(2, int(np.floor(grid_size ** (1 / n_params) + 1e-9)))
+
+def product_grid(axes):
+    # (G x d) array of all combinations of the values on each axis
+    mesh = np.meshgrid(*axes, indexing='ij')
+    return np.column_stack([m.ravel() for m in mesh])
+
+def prior_grid(theta_params, grid_size):
+    """
+    Grid with equal prior mass per cell: on each axis, the prior quantiles at the midpoints of m equal-probability intervals.
+
+    Returns:
+        points: (G x d) array of grid points
+        log_prior: (G,) log prior mass of each cell
+    """
+    m = points_per_dimension(grid_size, len(theta_params))
+    u = (np.arange(m) + 0.5) / m
+    points = product_grid([dist.ppf(u) for dist in theta_params.values()])
+    return points, np.full(len(points), -len(theta_params) * np.log(m))
+
+def box_grid(theta_params, lower, upper, grid_size):
+    """
+    Grid of cell midpoints over the box [lower, upper], with log prior mass = log prior density + log cell volume.
+    """
+    m = points_per_dimension(grid_size, len(theta_params))
+    widths = (upper - lower) / m
+    points = product_grid([lower[k] + (np.arange(m) + 0.5) * widths[k] for k in range(len(lower))])
+    log_prior = np.sum([get_logpdf(dist)(points[:, k]) for k, dist in enumerate(theta_params.values())], axis=0) + np.sum(np.log(widths))
+    return points, log_prior
+
+def new_grid_state(theta_params, grid_size):
+    points, log_prior = prior_grid(theta_params, grid_size)
+    return dict(points=points, log_prior=log_prior, log_lklhd=np.zeros(len(points)), answer_history=[], design_history=[])
+
+def get_weights(state):
+    log_post = state['log_prior'] + state['log_lklhd']
+    w = np.exp(log_post - np.max(log_post))
+    return w / np.sum(w)
+
+def add_answers(state, theta_params, answer_history, design_history, likelihood_pdf, profile=None, log_likelihood_pdf=None):
+    # Add the log-likelihood of the answers that are not yet in the grid state
+    k = len(state['answer_history'])
+    if len(answer_history) > k:
+        thetas = pd.DataFrame(state['points'], columns=list(theta_params))
+        state['log_lklhd'] = state['log_lklhd'] + compute_lklhd_logpdf(thetas, answer_history[k:], design_history[k:len(answer_history)], likelihood_pdf, profile, log_likelihood_pdf)
+        state['answer_history'] = list(answer_history)
+        state['design_history'] = list(design_history[:len(answer_history)])
+    return state
+
+def refine_grid(state, theta_params, grid_size, likelihood_pdf, profile=None, log_likelihood_pdf=None):
+    """
+    Replace the grid with one of the same size over the box that holds all but refine_tail of the posterior mass
+    (extended by one cell of the current grid on each side, within the prior's support).
+    """
+    w = get_weights(state)
+    order = np.argsort(-w)
+    n_keep = int(np.searchsorted(np.cumsum(w[order]), 1 - refine_tail)) + 1
+    kept = state['points'][order[:n_keep]]
+
+    lower, upper = kept.min(axis=0), kept.max(axis=0)
+    for k, dist in enumerate(theta_params.values()):
+        axis = np.unique(state['points'][:, k])
+        spacing = np.min(np.diff(axis)) if len(axis) > 1 else 0
+        support = dist.support()
+        lower[k] = max(lower[k] - spacing, support[0])
+        upper[k] = min(upper[k] + spacing, support[1])
+
+    if not np.all(np.isfinite(lower) & np.isfinite(upper) & (upper > lower)):
+        return state
+
+    points, log_prior = box_grid(theta_params, lower, upper, grid_size)
+    refined = dict(points=points, log_prior=log_prior, log_lklhd=np.zeros(len(points)), answer_history=[], design_history=[])
+    return add_answers(refined, theta_params, state['answer_history'], state['design_history'], likelihood_pdf, profile, log_likelihood_pdf)
+
+def grid_posterior(theta_params, answer_history, design_history, likelihood_pdf, N, grid_size=50000, refine=True, cache_key=None, profile=None, precision=None, log_likelihood_pdf=None):
+    """
+    Posterior on a grid, updated from the cached grid state of the profile if its history is a prefix of this one.
+
+    Input:
+        (as in pmc_inference.pmc)
+        grid_size: total number of grid points
+        refine: refine the grid when the posterior concentrates
+        cache_key: key of the cached grid state (e.g. the profile id). States are not cached if None.
+
+    Returns:
+        thetas: (N x d DataFrame) sample from the grid posterior
+    """
+    state = None
+    if cache_key is not None:
+        with grid_cache_lock:
+            state = grid_cache.get(cache_key)
+
+    k = len(state['answer_history']) if state is not None else 0
+    if state is None or state['answer_history'] != list(answer_history[:k]) or state['design_history'] != list(design_history[:k]) or k > len(answer_history):
+        state = new_grid_state(theta_params, grid_size)
+    else:
+        state = dict(state)
+
+    state = add_answers(state, theta_params, answer_history, design_history, likelihood_pdf, profile, log_likelihood_pdf)
+
+    if refine and 1 / np.sum(get_weights(state)**2) < refine_ess_fraction * len(state['points']):
+        state = refine_grid(state, theta_params, grid_size, likelihood_pdf, profile, log_likelihood_pdf)
+
+    if cache_key is not None:
+        with grid_cache_lock:
+            grid_cache[cache_key] = state
+            grid_cache.move_to_end(cache_key)
+            while len(grid_cache) > max_cached_grids:
+                grid_cache.popitem(last=False)
+
+    thetas = pd.DataFrame(state['points'], columns=list(theta_params)).astype(get_dtype(precision))
+    return systematic_sample(thetas, get_weights(state), N)
@@ -0,0 +1,154 @@
+import math
+
+import numpy as np
+
+from .particles import accepts_arrays
+
+# Optional JIT-compiled likelihood path (requires numba, CPU only).
+# A config can supply a scalar log-likelihood kernel in user_config:
+#
+#     def log_likelihood_kernel(answer, theta, design):
+#         # answer: index of the answer in `answers`
+#         # theta: 1-D float64 array of preference parameters, in the order of theta_params
+#         # design: 1-D float64 array of design attributes, in the order of design_params,
+#         #         with categorical attributes as integer codes (position in the list of values)
+#         return log Prob(answer | theta, design)
+#
+# With likelihood_jit = True, the kernel is compiled with numba and fused with the reductions of PMC (sum of log-likelihoods
+# over the answer history) and mutual information (means of l and l*log(l) over particles) in single loops over particles,
+# without temporary arrays. Compiled functions are cached on disk (in __pycache__) so warm starts skip compilation.
+# compile_config checks the kernel against log_likelihood_pdf (or likelihood_pdf) at startup.
+# The kernel does not receive the profile, and stacked computations (several designs at once) use the Python likelihood.
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+def jit(function, signature=None):
+    return numba.njit(signature, cache=True)(function)
+
+# The fused loops are defined at module level and compiled ahead of time for a kernel typed by its signature
+# (a first-class function), so that numba can cache them on disk. Loops that close over the kernel, or take it as a
+# dispatcher, are recompiled at every start.
+
+def lklhd_logpdf_loop(log_likelihood, thetas, answer_indices, designs):
+    n = thetas.shape[0]
+    out = np.zeros(n)
+    for i in range(n):
+        total = 0.0
+        for k in range(answer_indices.shape[0]):
+            total += log_likelihood(answer_indices[k], thetas[i], designs[k])
+        out[i] = total if not math.isnan(total) else -math.inf
+    return out
+
+def mutual_information_loop(log_likelihood, thetas, design, n_answers):
+    n = thetas.shape[0]
+    sum_l = np.zeros(n_answers)
+    sum_l_log_l = np.zeros(n_answers)
+    for i in range(n):
+        for a in range(n_answers):
+            log_l = log_likelihood(a, thetas[i], design)
+            if log_l > -math.inf:
+                l = math.exp(log_l)
+                sum_l[a] += l
+                sum_l_log_l[a] += l * log_l
+    mutual_info = 0.0
+    for a in range(n_answers):
+        mean_l = sum_l[a] / n
+        mutual_info += sum_l_log_l[a] / n
+        if mean_l > 0:
+            mutual_info -= mean_l * math.log(mean_l)
+    return mutual_info
+
+if numba is not None:
+    from numba import types
+
+    # log_likelihood_kernel(answer, theta, design) -> float
+    kernel_signature = types.float64(types.int64, types.float64[::1], types.float64[::1])
+    kernel_type = types.FunctionType(kernel_signature)
+
+    lklhd_logpdf_loop = jit(lklhd_logpdf_loop, types.float64[::1](kernel_type, types.float64[:, ::1], types.int64[::1], types.float64[:, ::1]))
+    mutual_information_loop = jit(mutual_information_loop, types.float64(kernel_type, types.float64[:, ::1], types.float64[::1], types.int64))
+
+def compile_kernels(kernel):
+    """
+    Compile the user's kernel and the loops that use it.
+
+    Returns:
+        lklhd_logpdf: function(thetas (n x d), answer_indices (k,), designs (k x m)) -> (n,) log-likelihood of the history
+        mutual_information: function(thetas (n x d), design (m,), n_answers) -> mutual information of the design
+    """
+    log_likelihood = jit(kernel, kernel_signature)
+
+    def lklhd_logpdf(thetas, answer_indices, designs):
+        return lklhd_logpdf_loop(log_likelihood, thetas, answer_indices, designs)
+
+    def mutual_information(thetas, design, n_answers):
+        return mutual_information_loop(log_likelihood, thetas, design, n_answers)
+
+    return lklhd_logpdf, mutual_information
+
+class KernelLikelihood:
+    """
+    Log-likelihood with fused compiled loops for PMC and mutual information (see compile_kernels).
+    Called like any log_likelihood_pdf, it delegates to the Python log-likelihood, which is used wherever the
+    compiled loops do not apply (e.g. stacked designs).
+    """
+    def __init__(self, kernel, log_likelihood_pdf, answers, design_keys, design_encoding, encode_designs):
+        self.__wrapped__ = log_likelihood_pdf
+        self.accepts_arrays = accepts_arrays(log_likelihood_pdf)
+        self.answer_index = {str(answer): i for i, answer in enumerate(answers)}
+        self.n_answers = len(answers)
+        self.design_keys = list(design_keys)
+        self.design_encoding = design_encoding
+        self.encode_designs = encode_designs
+        self.compiled_lklhd_logpdf, self.compiled_mutual_information = compile_kernels(kernel)
+
+    def __call__(self, answer, thetas, design, profile=None):
+        return self.__wrapped__(answer, thetas, design, profile)
+
+    def design_vector(self, design):
+        # Design attributes as floats in the order of design_params, with categorical labels replaced by codes
+        return np.array([
+            self.design_encoding[key].index(design[key]) if key in self.design_encoding and not self.encode_designs else design[key]
+            for key in self.design_keys
+        ], dtype=np.float64)
+
+    def lklhd_logpdf(self, thetas, answer_history, design_history):
+        answer_indices = np.array([self.answer_index[str(answer)] for answer in answer_history], dtype=np.int64)
+        designs = np.array([self.design_vector(design) for design in design_history], dtype=np.float64).reshape(len(design_history), len(self.design_keys))
+        return self.compiled_lklhd_logpdf(particle_values(thetas), answer_indices, designs)
+
+    def mutual_information(self, thetas, design):
+        return self.compiled_mutual_information(particle_values(thetas), self.design_vector(design), self.n_answers)
+
+def particle_values(thetas):
+    # (n x d) float64 array of a particle DataFrame or Particles
+    return np.ascontiguousarray(thetas.values, dtype=np.float64)
+
+def uses_kernel(log_likelihood_pdf):
+    return isinstance(log_likelihood_pdf, KernelLikelihood)
+
+def check_kernel(kernel_likelihood, log_likelihood_pdf, likelihood_pdf, answers, thetas, designs):
+    """
+    Compare the compiled kernel with the Python likelihood on a sample of particles and designs.
+
+    Returns:
+        problems: list of descriptions of mismatches found
+    """
+    problems = []
+    for design in designs:
+        for answer in answers:
+            if log_likelihood_pdf is not None:
+                expected = np.asarray(log_likelihood_pdf(answer, thetas, design, None), dtype=np.float64)
+            else:
+                with np.errstate(divide='ignore'):
+                    expected = np.log(np.asarray(likelihood_pdf(answer, thetas, design, None), dtype=np.float64))
+            compiled = kernel_likelihood.lklhd_logpdf(thetas, [answer], [design])
+            expected = np.broadcast_to(expected, compiled.shape)
+            # Python likelihoods may clip probabilities, so compare where they are not clipped
+            mask = expected > np.log(1e-9)
+            if not np.allclose(compiled[mask], expected[mask], rtol=1e-6, atol=1e-9):
+                problems.append(f'log_likelihood_kernel does not match the likelihood for answer {answer} and design {design}.')
+    return problems
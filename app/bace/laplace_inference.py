@@ -0,0 +1,182 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr, ndtri
+from scipy.stats import qmc
+
+from .pmc_inference import pmc, get_dtype, compute_lklhd_logpdf, systematic_sample
+
+# Gaussian (Laplace) approximation of the posterior.
+# Preference parameters are mapped to z = Phi^-1(F(theta)), where F is the prior CDF of each parameter, so the prior of z
+# is a standard normal and z is unbounded. The mode of the log-posterior in z is found with a few Newton steps
+# (gradient and Hessian of the log-likelihood by central differences, evaluated in one vectorized likelihood call),
+# and the posterior is approximated by a normal distribution at the mode with the inverse negative Hessian as covariance.
+#
+# The posterior sample is a randomized quasi-Monte Carlo (scrambled Halton) sample of N points from the Gaussian
+# (widened by proposal_scale), mapped back to theta and resampled with importance weights (posterior / Gaussian density),
+# which corrects for moderate departures from normality at the cost of one likelihood evaluation per point and answer
+# (one PMC round instead of J). If the effective sample size is below min_ess times its value for an exactly Gaussian
+# posterior, the posterior is too far from Gaussian and PMC is run instead.
+#
+# Modes are cached per profile to warm-start Newton after the next answer.
+#
+# Select with inference = 'laplace' in user_config (laplace_min_ess optional).
+
+step = 1e-3
+max_newton_steps = 20
+proposal_scale = 1.5 # Sampling from a wider Gaussian keeps the importance weights stable when the posterior has heavier tails
+max_cached_modes = 1024
+
+mode_cache = OrderedDict()
+mode_cache_lock = threading.Lock()
+
+def to_thetas(z, theta_params):
+    # Map points in z space ((K x d) array) to a DataFrame of preference parameters
+    u = np.clip(ndtr(z), 1e-15, 1 - 1e-15)
+    return pd.DataFrame({key: dist.ppf(u[:, k]) for k, (key, dist) in enumerate(theta_params.items())})
+
+def log_posterior(z, theta_params, answer_history, design_history, likelihood_pdf, profile=None, log_likelihood_pdf=None):
+    # Unnormalized log-posterior density of z, up to a constant
+    log_lklhd = compute_lklhd_logpdf(to_thetas(z, theta_params), answer_history, design_history, likelihood_pdf, profile, log_likelihood_pdf)
+    return log_lklhd - 0.5 * np.sum(z**2, axis=1)
+
+def stencil(d):
+    # Offsets (in units of step) for the value, gradient and Hessian of a function by central differences
+    offsets = [np.zeros(d)]
+    for i in range(d):
+        for sign in [1, -1]:
+            offset = np.zeros(d)
+            offset[i] = sign
+            offsets.append(offset)
+    for i in range(d):
+        for j in range(i + 1, d):
+            for si, sj in [(1, 1), (1, -1), (-1, 1), (-1, -1)]:
+                offset = np.zeros(d)
+                offset[i], offset[j] = si, sj
+                offsets.append(offset)
+    return np.array(offsets)
+
+def gradient_hessian(f, d):
+    """
+    Value, gradient and Hessian of f at 0 from its values at the stencil points (see stencil).
+    """
+    f0 = f[0]
+    plus, minus = f[1:2*d+1:2], f[2:2*d+1:2]
+    gradient = (plus - minus) / (2 * step)
+    hessian = np.diag((plus - 2 * f0 + minus) / step**2)
+
+    k = 2 * d + 1
+    for i in range(d):
+        for j in range(i + 1, d):
+            pp, pm, mp, mm = f[k:k+4]
+            hessian[i, j] = hessian[j, i] = (pp - pm - mp + mm) / (4 * step**2)
+            k += 4
+    return f0, gradient, hessian
+
+def find_mode(z0, theta_params, answer_history, design_history, likelihood_pdf, profile=None, log_likelihood_pdf=None):
+    """
+    Maximize the log-posterior in z with damped Newton steps.
+
+    Returns:
+        mode: (d,) mode in z space
+        covariance: (d x d) inverse of the negative Hessian at the mode, or None if it is not positive definite
+    """
+    def evaluate(z):
+        return log_posterior(np.atleast_2d(z), theta_params, answer_history, design_history, likelihood_pdf, profile, log_likelihood_pdf)
+
+    d = len(z0)
+    offsets = stencil(d) * step
+    z = np.array(z0, dtype=np.float64)
+
+    for _ in range(max_newton_steps):
+        value, gradient, hessian = gradient_hessian(evaluate(z + offsets), d)
+        if not np.isfinite(value):
+            return z, None
+
+        # Newton direction, damped towards gradient ascent if the Hessian is not negative definite
+        damping = 0
+        while True:
+            try:
+                L = np.linalg.cholesky(-hessian + damping * np.eye(d))
+                break
+            except np.linalg.LinAlgError:
+                damping = max(2 * damping, 1e-3)
+        direction = np.linalg.solve(L.T, np.linalg.solve(L, gradient))
+
+        # Backtracking line search
+        t = 1.0
+        while t > 1e-4 and not evaluate(z + t * direction)[0] >= value:
+            t /= 2
+        z = z + t * direction
+
+        if np.linalg.norm(t * direction) < 1e-6:
+            break
+
+    value, gradient, hessian = gradient_hessian(evaluate(z + offsets), d)
+    try:
+        L = np.linalg.cholesky(-hessian)
+    except np.linalg.LinAlgError:
+        return z, None
+    L_inv = np.linalg.inv(L)
+    return z, L_inv.T @ L_inv
+
+def gaussian_sample(mode, covariance, N, seed=None):
+    # Scrambled Halton sample of size N from N(mode, covariance), in random order: consecutive Halton points follow a
+    # periodic pattern that aliases with the even spacing of systematic resampling and biases the resampled population.
+    d = len(mode)
+    u = qmc.Halton(d, scramble=True, seed=seed).random(N)
+    u = np.clip(u, 1e-12, 1 - 1e-12)[np.random.default_rng(seed).permutation(N)]
+    return mode + ndtri(u) @ np.linalg.cholesky(covariance).T
+
+def effective_sample_fraction(log_w):
+    w = np.exp(log_w - np.max(log_w))
+    return np.sum(w)**2 / np.sum(w**2) / len(w)
+
+def laplace_posterior(theta_params, answer_history, design_history, likelihood_pdf, N, J=5, min_ess=0.5, cache_key=None, profile=None, precision=None, log_likelihood_pdf=None):
+    """
+    Sample from a Gaussian approximation of the posterior, or from PMC if the approximation is poor.
+
+    Input:
+        (as in pmc_inference.pmc)
+        min_ess: smallest effective sample size of the importance weights, relative to an exactly Gaussian posterior, for which the approximation is used
+        cache_key: key of the cached mode (e.g. the profile id), used as the starting point of Newton
+
+    Returns:
+        thetas: (N x d DataFrame) posterior sample
+    """
+    d = len(theta_params)
+    z0 = np.zeros(d)
+    if cache_key is not None:
+        with mode_cache_lock:
+            z0 = mode_cache.get(cache_key, z0)
+
+    mode, covariance = find_mode(z0, theta_params, answer_history, design_history, likelihood_pdf, profile, log_likelihood_pdf)
+
+    if covariance is not None:
+        if cache_key is not None:
+            with mode_cache_lock:
+                mode_cache[cache_key] = mode
+                mode_cache.move_to_end(cache_key)
+                while len(mode_cache) > max_cached_modes:
+                    mode_cache.popitem(last=False)
+
+        # Draw from the widened Gaussian and correct by importance weights. The effective sample size checks the approximation.
+        proposal_covariance = proposal_scale**2 * covariance
+        z = gaussian_sample(mode, proposal_covariance, N)
+        residual = np.linalg.solve(np.linalg.cholesky(proposal_covariance), (z - mode).T)
+        log_q = -0.5 * np.sum(residual**2, axis=0)
+        log_w = np.nan_to_num(log_posterior(z, theta_params, answer_history, design_history, likelihood_pdf, profile, log_likelihood_pdf) - log_q, nan=-np.inf)
+
+        # Effective sample fraction relative to its value if the posterior were exactly the Gaussian approximation
+        max_ess = (np.sqrt(2 * proposal_scale**2 - 1) / proposal_scale**2)**d
+        if not np.any(np.isfinite(log_w)) or effective_sample_fraction(log_w) / max_ess < min_ess:
+            print('Posterior is not close to Gaussian. Using PMC.')
+        else:
+            w = np.exp(log_w - np.max(log_w))
+            return systematic_sample(to_thetas(z, theta_params).astype(get_dtype(precision)), w / np.sum(w), N)
+    else:
+        print('Gaussian approximation failed. Using PMC.')
+
+    return pmc(theta_params, answer_history, design_history, likelihood_pdf, N, J=J, profile=profile, precision=precision, log_likelihood_pdf=log_likelihood_pdf)
@@ -0,0 +1,100 @@
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+# Memoization of mutual information by design and particle set.
+# Mango often proposes the same design more than once (especially when all attributes are categorical), and design searches
+# for the same particles (e.g. precomputed first designs under a shared prior sample, or repeated searches after a retry)
+# score the same designs again. The objective looks up each design in an LRU cache keyed by
+# (particle set fingerprint, likelihood, profile, design) before computing its mutual information.
+# The fingerprint is a hash of the particle values, computed once per particle DataFrame.
+# Set mi_cache_size in user_config (0 disables the cache). Hit rates are available from mi_cache.stats().
+
+class MICache:
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.fingerprints = dict() # id(thetas) -> (weak reference to thetas, fingerprint)
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, thetas):
+        # Hash of the particle values, cached for each particle DataFrame while it is alive
+        with self.lock:
+            cached = self.fingerprints.get(id(thetas))
+        if cached is not None and cached[0]() is thetas:
+            return cached[1]
+
+        values = np.ascontiguousarray(thetas.values)
+        fingerprint = hashlib.blake2b(values.tobytes() + str(values.shape).encode(), digest_size=16).hexdigest()
+        with self.lock:
+            try:
+                self.fingerprints[id(thetas)] = (weakref.ref(thetas), fingerprint)
+            except TypeError:
+                pass
+            # Drop entries of particle sets that no longer exist
+            if len(self.fingerprints) > 64:
+                self.fingerprints = {key: value for key, value in self.fingerprints.items() if value[0]() is not None}
+        return fingerprint
+
+    def score(self, thetas, designs, scope, compute):
+        """
+        Mutual information of designs, from the cache where available.
+
+        Input:
+            thetas: particle population
+            designs: list of designs
+            scope: hashable key of everything else the scores depend on (answers, likelihoods, profile)
+            compute: function taking a list of designs and returning their scores (called for the misses only)
+
+        Returns:
+            scores: list of scores, in the order of designs
+        """
+        if self.max_size <= 0:
+            return list(compute(designs))
+
+        prefix = (self.fingerprint(thetas), scope)
+        keys = [prefix + (design_key(design),) for design in designs]
+        scores = [None] * len(designs)
+        with self.lock:
+            for i, key in enumerate(keys):
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    scores[i] = self.entries[key]
+        missing = [i for i, score in enumerate(scores) if score is None]
+
+        # Score each distinct missing design once
+        unique = list(OrderedDict((keys[i], i) for i in missing).values())
+        computed = dict(zip((keys[i] for i in unique), compute([designs[i] for i in unique]))) if unique else dict()
+
+        with self.lock:
+            self.hits += len(designs) - len(unique)
+            self.misses += len(unique)
+            for key, score in computed.items():
+                self.entries[key] = score
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+        return [score if score is not None else computed[keys[i]] for i, score in enumerate(scores)]
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return dict(hits=self.hits, misses=self.misses, hit_rate=self.hits / total if total else 0.0, size=len(self.entries))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.fingerprints.clear()
+            self.hits = 0
+            self.misses = 0
+
+def design_key(design):
+    # Hashable key of a design, with numpy scalars converted to Python values
+    return tuple(sorted((key, value.item() if isinstance(value, np.generic) else value) for key, value in design.items()))
+
+mi_cache = MICache()
@@ -0,0 +1,117 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Multi-core scoring of candidate designs within a request.
+# When the objective is called with a batch of designs (successive halving, or Mango with batch_size > 1),
+# the batch is split into chunks that are scored on a persistent thread pool. NumPy releases the GIL in the
+# heavy kernels, so chunks run in parallel on otherwise idle cores.
+# Batches too small to split (in particular the single design per objective call of the default Mango search) are
+# scored one design at a time, with the particles of each design split into blocks instead (see map_blocks):
+# mutual information is computed from sums over particles, so the blocks' partial sums are added up.
+# The degree of parallelism backs off under load: cores are shared between the requests scoring at the same time
+# in this process, and batches are scored serially if the machine is already saturated (e.g. by other server workers).
+# Set scoring_threads in user_config (1 disables it, 'auto' uses every available core).
+
+class scoring_context:
+    max_threads = 1         # Upper bound on threads per batch
+    min_chunk_size = 8      # Do not split batches into chunks smaller than this
+    min_block_size = 1024   # Do not split the particles of a design into blocks smaller than this
+
+pool = None
+pool_pid = None
+pool_lock = threading.Lock()
+active_batches = 0
+local = threading.local() # local.in_parallel is set while scoring a chunk of a batch that is already split
+
+def get_cpu_count():
+    # Cores available to this process (respects CPU affinity, e.g. in containers)
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def set_max_threads(scoring_threads):
+    scoring_context.max_threads = get_cpu_count() if scoring_threads == 'auto' else max(1, int(scoring_threads))
+
+def get_pool():
+    # One pool per process. The pool is created on first use, so server workers forked after startup get their own.
+    global pool, pool_pid
+    with pool_lock:
+        if pool is None or pool_pid != os.getpid():
+            pool = ThreadPoolExecutor(max_workers=scoring_context.max_threads, thread_name_prefix='bace-scoring')
+            pool_pid = os.getpid()
+        return pool
+
+def get_degree(n_items, n_active, min_size=None):
+    """
+    Number of chunks to split n_items into (designs, or particles with min_size=min_block_size),
+    given n_active batches being scored in this process.
+    """
+    min_size = min_size or scoring_context.min_chunk_size
+    degree = min(scoring_context.max_threads, get_cpu_count() // max(1, n_active), n_items // min_size)
+    if degree > 1 and hasattr(os, 'getloadavg') and os.getloadavg()[0] >= get_cpu_count():
+        degree = 1
+    return max(1, degree)
+
+def run_in_parallel(function, *args):
+    # Run a chunk of a split batch. Chunks are not split further, so the pool never waits on itself.
+    local.in_parallel = True
+    try:
+        return function(*args)
+    finally:
+        local.in_parallel = False
+
+def map_blocks(function, n_rows):
+    """
+    Apply function(start, stop) to contiguous blocks of rows, on the pool if cores are available.
+    Used to split the particles of a single design (see design_optimization.mutual_information_stacked).
+
+    Returns:
+        results: list of the results for each block, in order
+    """
+    degree = 1
+    if scoring_context.max_threads > 1 and not getattr(local, 'in_parallel', False):
+        with pool_lock:
+            n_active = max(1, active_batches)
+        degree = get_degree(n_rows, n_active, scoring_context.min_block_size)
+    if degree == 1:
+        return [function(0, n_rows)]
+
+    bounds = np.linspace(0, n_rows, degree + 1).astype(int)
+    futures = [get_pool().submit(run_in_parallel, function, start, stop) for start, stop in zip(bounds[1:-1], bounds[2:])]
+    results = [run_in_parallel(function, bounds[0], bounds[1])]
+    return results + [future.result() for future in futures]
+
+def score_designs(score, designs):
+    """
+    Score a batch of designs, in parallel chunks if cores are available.
+
+    Input:
+        score: function taking a list of designs and returning a list of scores
+        designs: list of designs
+
+    Returns:
+        scores: list of scores, in the order of designs
+    """
+    global active_batches
+    with pool_lock:
+        active_batches += 1
+        n_active = active_batches
+
+    try:
+        degree = get_degree(len(designs), n_active)
+        if degree == 1:
+            return list(score(designs))
+
+        # Score the first chunk in the calling thread and the others on the pool
+        chunks = [list(chunk) for chunk in np.array_split(np.arange(len(designs)), degree)]
+        futures = [get_pool().submit(run_in_parallel, score, [designs[i] for i in chunk]) for chunk in chunks[1:]]
+        scores = list(run_in_parallel(score, [designs[i] for i in chunks[0]]))
+        for future in futures:
+            scores.extend(future.result())
+        return scores
+    finally:
+        with pool_lock:
+            active_batches -= 1
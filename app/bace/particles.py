@@ -0,0 +1,52 @@
+import pandas as pd
+
+# Particles passed to likelihoods as plain numpy arrays instead of a DataFrame (see bace/runtime_model.py: compile_config).
+
+class Particles:
+    """
+    Columns of a particle population as plain numpy arrays, looked up by parameter name like a DataFrame (thetas['mu']).
+    """
+    def __init__(self, values, columns):
+        self.values = values
+        self.columns = list(columns)
+        self.arrays = {name: values[:, i] for i, name in enumerate(self.columns)}
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    def keys(self):
+        return self.arrays.keys()
+
+def to_particles(thetas):
+    # Convert a particle DataFrame to Particles (one conversion instead of one column lookup per likelihood call)
+    if isinstance(thetas, pd.DataFrame):
+        return Particles(thetas.to_numpy(), thetas.columns)
+    return thetas
+
+def take_rows(thetas, start, stop):
+    # Particles start to stop of a DataFrame or Particles
+    if isinstance(thetas, Particles):
+        return Particles(thetas.values[start:stop], thetas.columns)
+    return thetas.iloc[start:stop]
+
+class ArrayLikelihood:
+    """
+    Likelihood wrapper that passes particles to the user's likelihood as Particles instead of a DataFrame.
+    Created by compile_config only if the likelihood gives the same results for both.
+    """
+    accepts_arrays = True
+
+    def __init__(self, likelihood):
+        self.__wrapped__ = likelihood
+
+    def __call__(self, answer, thetas, design, profile=None):
+        return self.__wrapped__(answer, to_particles(thetas), design, profile)
+
+def accepts_arrays(likelihood):
+    return getattr(likelihood, 'accepts_arrays', False)
@@ -2,16 +2,35 @@ import scipy.stats
 import pandas as pd
 import numpy as np
 
+from .particles import to_particles, accepts_arrays
+from .densities import get_logpdf, normal_logpdf
+from .jit_likelihood import uses_kernel
+
+# Supported precisions for particle arrays, likelihoods and mutual information.
+# Log-weights and their normalization are always accumulated in float64.
+precisions = {
+    'float64': np.float64,
+    'float32': np.float32
+}
+
+def get_dtype(precision=None):
+    # Map a precision setting (e.g. 'float32') to a numpy dtype. Defaults to float64.
+    if precision is None:
+        return np.float64
+    if precision not in precisions:
+        raise ValueError(f'Unknown precision {precision}. Choose one of {list(precisions)}.')
+    return precisions[precision]
+
 # Function to sample from the prior distribution
-def sample_thetas(theta_params, N):
+def sample_thetas(theta_params, N, precision=None):
     return pd.DataFrame({
         key: dist.rvs(size=N) for key, dist in theta_params.items()
-    })
+    }).astype(get_dtype(precision))
 
-def pmc(theta_params, answer_history, design_history, likelihood_pdf, N, J=5, profile=None):
+def pmc(theta_params, answer_history, design_history, likelihood_pdf, N, J=5, profile=None, precision=None, log_likelihood_pdf=None, prior_thetas=None):
 
-    # Sample from prior distribution
-    old_thetas = sample_thetas(theta_params, N)
+    # Sample from prior distribution (unless a prior sample of size N is given, e.g. drawn while the profile was read)
+    old_thetas = prior_thetas if prior_thetas is not None else sample_thetas(theta_params, N, precision)
     scale = 2 * old_thetas.std()
 
     # Initialize variables to store preference parameters and weights
@@ -21,7 +40,7 @@ def pmc(theta_params, answer_history, design_history, likelihood_pdf, N, J=5, pr
     for j in range(J):
 
         # Compute importance weights
-        old_thetas, sampled_thetas, weights = importance_sample(old_thetas, theta_params, scale, answer_history, design_history, likelihood_pdf, N, profile)
+        old_thetas, sampled_thetas, weights = importance_sample(old_thetas, theta_params, scale, answer_history, design_history, likelihood_pdf, N, profile, log_likelihood_pdf)
 
         # Store sampled points and associated weights
         pool_thetas = pd.concat([pool_thetas, sampled_thetas], ignore_index=True)
@@ -33,23 +52,24 @@ def pmc(theta_params, answer_history, design_history, likelihood_pdf, N, J=5, pr
     # Return sample of size N from full set of samples and weights
     return systematic_sample(pool_thetas, w/np.sum(w), N=N)
 
-def importance_sample(old_thetas, theta_params, scale, answer_history, design_history, likelihood_pdf, N=None, profile=None):
+def importance_sample(old_thetas, theta_params, scale, answer_history, design_history, likelihood_pdf, N=None, profile=None, log_likelihood_pdf=None):
     if N is None:
         N = len(old_thetas)
 
     # Importance sample around existing points.
+    # New particles keep the precision of the existing population.
     new_thetas = pd.DataFrame(
         data = scipy.stats.norm.rvs(size=old_thetas.shape, loc=old_thetas, scale=scale),
         columns = list(old_thetas.columns)
-    )
+    ).astype(old_thetas.dtypes)
 
     # Compute importance weight components w = pi / q = lklhd * prior / q
     log_q = compute_q_logpdf(new_thetas, old_thetas, scale)
     log_prior = compute_prior_logpdf(new_thetas, theta_params)
-    log_pi = compute_lklhd_logpdf(new_thetas, answer_history, design_history, likelihood_pdf, profile)
+    log_pi = compute_lklhd_logpdf(new_thetas, answer_history, design_history, likelihood_pdf, profile, log_likelihood_pdf)
 
-    # Calculate weights. Use of M is better for numerical stability.
-    log_w = log_pi + log_prior - log_q
+    # Calculate weights in float64 (even in reduced precision). Use of M is better for numerical stability.
+    log_w = np.asarray(log_pi + log_prior - log_q, dtype=np.float64)
     M = np.max(log_w)
     w = np.exp(log_w - M)
     w[np.isnan(w)] = 0
@@ -62,18 +82,20 @@ def importance_sample(old_thetas, theta_params, scale, answer_history, design_hi
     return next_thetas, new_thetas, w
 
 def compute_prior_logpdf(thetas, theta_params):
+  thetas = to_particles(thetas) # Look up columns as arrays
   prior_pdf = np.zeros(len(thetas)) # Initialize zeros
   for param_name, param_dist in theta_params.items():
 
-    param_pdf = param_dist.logpdf(thetas[param_name]) # Compute logpdf of observed values given prior
+    param_pdf = get_logpdf(param_dist)(thetas[param_name]) # Compute logpdf of observed values given prior (closed form for common priors, see bace/densities.py)
     prior_pdf += param_pdf
 
   return prior_pdf
 
 def compute_q_logpdf(new_thetas, old_thetas, scale):
-    return np.sum(scipy.stats.norm.logpdf(new_thetas, loc=old_thetas, scale=scale), axis=1)
+    # Log-density of the normal proposal around old_thetas, computed in closed form
+    return np.sum(normal_logpdf(new_thetas, loc=old_thetas, scale=scale), axis=1)
 
-def compute_lklhd_logpdf(thetas, answer_history, design_history, likelihood_pdf, profile=None):
+def compute_lklhd_logpdf(thetas, answer_history, design_history, likelihood_pdf, profile=None, log_likelihood_pdf=None):
     """
     Computes the logpdf of the observed answer history given the population of thetas and design_history.
     Inputs:
@@ -81,21 +103,39 @@ def compute_lklhd_logpdf(thetas, answer_history, design_history, likelihood_pdf,
         answer_history: Array of answers to previously asked designs.
         design_history: DataFrame of designs that have been asked
         likelihood_pdf: Function that computes pdf of observing answer given thetas and a given design.
+        log_likelihood_pdf: (optional) Function that computes the logpdf directly. Used instead of log(likelihood_pdf) if provided.
     Returns:
         lklhd_logpdf: log(P(answer_history | thetas, design_history))
     """
     ND = len(design_history)
-    # Initialize lklhd_logpdf
-    lklhd_logpdf = 0
+
+    # Compiled kernel loop over particles and answers (see bace/jit_likelihood.py)
+    if uses_kernel(log_likelihood_pdf):
+        return log_likelihood_pdf.lklhd_logpdf(thetas, answer_history[:ND], design_history)
+
+    # Convert particles to arrays once if the likelihood accepts them (see bace/runtime_model.py: compile_config)
+    if accepts_arrays(log_likelihood_pdf if log_likelihood_pdf is not None else likelihood_pdf):
+        thetas = to_particles(thetas)
+
+    # Initialize lklhd_logpdf. Accumulate in float64 so long histories stay accurate in reduced precision.
+    lklhd_logpdf = np.zeros(len(thetas))
     for i in range(ND):
-        # Compute p(answer_i | thetas, design_i)
-        lklhd = likelihood_pdf(answer_history[i], thetas, design_history[i], profile)
 
-        with np.errstate(divide='ignore', invalid='ignore'):
-            log_lklhd = np.log(lklhd)
-            log_lklhd[np.isnan(log_lklhd)] = -np.inf
+        if log_likelihood_pdf is not None:
+            # Compute log p(answer_i | thetas, design_i) directly
+            log_lklhd = np.asarray(log_likelihood_pdf(answer_history[i], thetas, design_history[i], profile))
+        else:
+            # Compute p(answer_i | thetas, design_i)
+            lklhd = np.asarray(likelihood_pdf(answer_history[i], thetas, design_history[i], profile))
 
-        lklhd_logpdf += log_lklhd
+            # In reduced precision, likelihoods clipped at 1 - 1e-10 round to 1, so floor at the smallest normal number instead of 0.
+            if lklhd.dtype == np.float32:
+                lklhd = np.maximum(lklhd, np.finfo(np.float32).tiny)
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                log_lklhd = np.log(lklhd)
+
+        lklhd_logpdf += np.where(np.isnan(log_lklhd), -np.inf, log_lklhd)
 
     return lklhd_logpdf
 
@@ -116,3 +156,125 @@ def systematic_sample(df, weights, N):
     sampled_indices = np.searchsorted(cumulative_w, u)
 
     return df.iloc[sampled_indices, :].reset_index(drop=True).copy()
+
+# Stacked PMC: run PMC for R respondents at once.
+# Respondent r's particles are rows r*N to (r+1)*N - 1 of a single (R*N x d) DataFrame, so that priors, proposals
+# and likelihoods are evaluated with one vectorized call per question instead of one call per respondent.
+def pmc_stacked(theta_params, answer_histories, design_histories, likelihood_pdf, N, J=5, precision=None, log_likelihood_pdf=None):
+    """
+    Population Monte Carlo for several respondents at once.
+
+    Inputs:
+        answer_histories: List of R answer histories. All respondents must have answered the same number of questions.
+        design_histories: List of R design histories (lists of designs).
+        likelihood_pdf: As in pmc(). Each design attribute is passed as an array aligned with the rows of thetas,
+            so the likelihood must use elementwise operations (as in the example configs). The profile is not passed.
+    Returns:
+        thetas: (R*N x d DataFrame) posterior sample of size N for each respondent, stacked in the order of the histories.
+    """
+    R = len(answer_histories)
+
+    # Sample from prior distribution
+    old_thetas = sample_thetas(theta_params, R * N, precision)
+    scale = 2 * np.repeat(old_thetas.to_numpy().reshape(R, N, -1).std(axis=1, ddof=1), N, axis=0)
+
+    # Store sampled points and associated weights for each round
+    pool_thetas, pool_w = [], []
+
+    for j in range(J):
+
+        # Compute importance weights
+        old_thetas, sampled_thetas, weights = importance_sample_stacked(old_thetas, theta_params, scale, answer_histories, design_histories, likelihood_pdf, N, log_likelihood_pdf)
+
+        pool_thetas.append(sampled_thetas.to_numpy().reshape(R, N, -1))
+        pool_w.append(weights)
+
+    # Arrange the pool so that each respondent's J*N particles are contiguous
+    pool_thetas = pd.DataFrame(
+        data = np.concatenate(pool_thetas, axis=1).reshape(R * J * N, -1),
+        columns = list(old_thetas.columns)
+    ).astype(old_thetas.dtypes)
+    w = normalize_rows(np.concatenate(pool_w, axis=1))
+
+    # Return sample of size N for each respondent from full set of samples and weights
+    return systematic_sample_stacked(pool_thetas, w, N)
+
+def importance_sample_stacked(old_thetas, theta_params, scale, answer_histories, design_histories, likelihood_pdf, N, log_likelihood_pdf=None):
+    R = len(answer_histories)
+
+    # Importance sample around existing points.
+    new_thetas = pd.DataFrame(
+        data = scipy.stats.norm.rvs(size=old_thetas.shape, loc=old_thetas.to_numpy(), scale=scale),
+        columns = list(old_thetas.columns)
+    ).astype(old_thetas.dtypes)
+
+    # Compute importance weight components w = pi / q = lklhd * prior / q
+    log_q = compute_q_logpdf(new_thetas, old_thetas.to_numpy(), scale)
+    log_prior = compute_prior_logpdf(new_thetas, theta_params)
+    log_pi = compute_lklhd_logpdf_stacked(new_thetas, answer_histories, design_histories, likelihood_pdf, N, log_likelihood_pdf)
+
+    # Calculate weights separately for each respondent, in float64.
+    log_w = np.asarray(log_pi + log_prior - log_q, dtype=np.float64).reshape(R, N)
+    with np.errstate(invalid='ignore'):
+        w = np.exp(log_w - np.max(log_w, axis=1, keepdims=True))
+    w[np.isnan(w)] = 0
+    w = normalize_rows(w)
+
+    next_thetas = systematic_sample_stacked(new_thetas, w, N)
+    return next_thetas, new_thetas, w
+
+def compute_lklhd_logpdf_stacked(thetas, answer_histories, design_histories, likelihood_pdf, N, log_likelihood_pdf=None):
+    # Computes log(P(answer_history | thetas, design_history)) for stacked respondents (see pmc_stacked).
+    ND = len(design_histories[0]) if len(design_histories) > 0 else 0
+    lklhd_logpdf = np.zeros(len(thetas))
+
+    for i in range(ND):
+
+        # Stack the i-th design of every respondent, repeated for each of their particles
+        design = stack_designs([design_history[i] for design_history in design_histories], N)
+        answers_i = [answer_history[i] for answer_history in answer_histories]
+        answers_i_str = np.array([str(answer) for answer in answers_i])
+
+        # Evaluate the likelihood once per distinct answer, on the rows of the respondents who gave it
+        for answer_str in np.unique(answers_i_str):
+            answered = answers_i_str == answer_str
+            rows = np.repeat(answered, N)
+            answer = answers_i[np.argmax(answered)]
+
+            lklhd_logpdf[rows] += compute_lklhd_logpdf(
+                thetas[rows].reset_index(drop=True),
+                [answer],
+                [{key: values[rows] for key, values in design.items()}],
+                likelihood_pdf,
+                log_likelihood_pdf=log_likelihood_pdf
+            )
+
+    return lklhd_logpdf
+
+def stack_designs(designs, N):
+    # Convert a list of designs into a single design with each attribute as an array, repeating each design N times
+    return {key: np.repeat(np.array([design[key] for design in designs]), N) for key in designs[0]}
+
+def normalize_rows(w):
+    # Normalize weights for each respondent (rows of w). Respondents with no valid weights get uniform weights.
+    total = np.sum(w, axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        w = np.where(total > 0, w / total, 1 / w.shape[1])
+    return w
+
+def systematic_sample_stacked(df, weights, N):
+    # Systematic sampling of N rows for each respondent. weights is (R x M) and df holds R blocks of M rows.
+    R, M = weights.shape
+
+    # Offset respondent r's cumulative weights and draws by r so a single search covers all respondents
+    offset = np.arange(R)[:, None]
+    u = (np.random.random((R, 1)) + np.arange(N)) / N + offset
+
+    cumulative_w = np.cumsum(weights, axis=1)
+    cumulative_w[:, -1] = 1
+    cumulative_w += offset
+
+    # Find indices to keep.
+    sampled_indices = np.minimum(np.searchsorted(cumulative_w.ravel(), u.ravel()), R * M - 1)
+
+    return df.iloc[sampled_indices, :].reset_index(drop=True).copy()
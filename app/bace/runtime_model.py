@@ -0,0 +1,258 @@
+import numbers
+import random
+
+import numpy as np
+
+from .pmc_inference import precisions, sample_thetas
+from .particles import to_particles, ArrayLikelihood
+from .design_optimization import design_searches, Codes
+from .first_designs import uses_profile
+from .jit_likelihood import numba, KernelLikelihood, check_kernel
+
+# Config compilation.
+# compile_config checks user_config once (at startup or with tools/validation/check_config.py) and builds a RuntimeModel:
+#   - the encoding of categorical design attributes (lists of non-numeric values) as integer codes,
+#     used end to end (optimizer, likelihoods, stored histories) if design_encoding = 'codes' in user_config,
+#   - likelihoods wrapped to take particles as plain arrays (see bace/particles.py) if they give the same results as with DataFrames.
+#   - with likelihood_jit = True, a numba-compiled log_likelihood_kernel fused with the PMC and MI loops (see bace/jit_likelihood.py).
+# The hot loops in bace/pmc_inference.py and bace/design_optimization.py then convert the particle DataFrame to arrays once
+# per call instead of looking up DataFrame columns for every answer and question.
+
+required_settings = ['answers', 'design_params', 'theta_params', 'likelihood_pdf', 'size_thetas', 'conf_dict', 'max_opt_time']
+
+# design_encoding in user_config:
+#   'labels': designs hold the values listed in design_params (e.g. 'Blue'). This is the default.
+#   'codes': categorical attributes hold the position of the value in design_params (e.g. 1 for 'Blue' in ['Black', 'Blue'])
+#       in the optimizer, likelihoods, constraints and stored design histories. Designs are decoded to labels only for output
+#       (before user_convert.convert_design and user_surveycto.convert_design_surveycto). Likelihoods compare integers
+#       instead of strings, e.g. `design['color_a'] == BLUE` with `BLUE = design_params['color_a'].index('Blue')`.
+#       Profiles stored with labels cannot be continued after switching to codes.
+#       The optimizer still treats the codes as unordered categories (see design_optimization.Codes).
+design_encodings = ['labels', 'codes']
+
+# Inference engines (inference in user_config): 'pmc' (bace/pmc_inference.py), 'grid' (bace/grid_inference.py)
+# or 'laplace' (bace/laplace_inference.py)
+inference_engines = ['pmc', 'grid', 'laplace']
+
+class RuntimeModel:
+    def __init__(self, user_config, likelihood_pdf, log_likelihood_pdf, design_encoding, encode_designs=False):
+        self.answers = list(user_config.answers)
+        self.design_encoding = design_encoding
+        self.encode_designs = encode_designs
+        self.design_params = get_search_params(user_config.design_params, design_encoding) if encode_designs else user_config.design_params
+        self.likelihood_pdf = likelihood_pdf
+        self.log_likelihood_pdf = log_likelihood_pdf
+
+    def decode(self, design):
+        # Design with labels, for output
+        return decode_design(design, self.design_encoding) if self.encode_designs else design
+
+def get_design_encoding(design_params):
+    """
+    Categorical design attributes: those specified as lists with at least one non-numeric value (e.g. ['Black', 'Blue']).
+
+    Returns:
+        design_encoding: dict mapping each categorical attribute to its list of categories. Category i has integer code i.
+    """
+    return {
+        key: list(values) for key, values in design_params.items()
+        if isinstance(values, (list, tuple)) and not all(isinstance(v, numbers.Number) for v in values)
+    }
+
+def encode_design(design, design_encoding):
+    # Replace categorical values with their integer codes
+    return {key: design_encoding[key].index(value) if key in design_encoding else value for key, value in design.items()}
+
+def decode_design(design, design_encoding):
+    # Replace integer codes with their categorical values
+    return {key: design_encoding[key][int(value)] if key in design_encoding else value for key, value in design.items()}
+
+def get_search_params(design_params, design_encoding):
+    # Design parameters for the optimizer with categorical attributes replaced by their integer codes
+    # (searched as categories, not as ordinal integers, see design_optimization.Codes)
+    return {
+        key: Codes(range(len(design_encoding[key]))) if key in design_encoding else values
+        for key, values in design_params.items()
+    }
+
+def sample_random_design(design_params):
+    # Random design without constraints, for checking the config
+    return {
+        key: random.choice(values) if isinstance(values, (list, tuple)) else values.rvs()
+        for key, values in design_params.items()
+    }
+
+def same_with_particles(likelihood, answer, particles, design, expected):
+    # Whether a likelihood gives the expected values when called with Particles (False if it fails with them)
+    try:
+        values = np.asarray(likelihood(answer, particles, design, None), dtype=np.float64)
+    except Exception:
+        return False
+    return np.allclose(expected, values, equal_nan=True)
+
+def check_likelihoods(user_config, thetas, designs):
+    """
+    Evaluate the likelihoods on a prior sample for a few random designs.
+
+    Returns:
+        problems: list of descriptions of problems found
+        same_with_arrays: True if every likelihood gives the same results with Particles as with a DataFrame
+    """
+    problems = []
+    same_with_arrays = True
+    log_likelihood_pdf = getattr(user_config, 'log_likelihood_pdf', None)
+    particles = to_particles(thetas)
+
+    for design in designs:
+        total = np.zeros(len(thetas))
+        for answer in user_config.answers:
+            try:
+                likelihood = np.broadcast_to(np.asarray(user_config.likelihood_pdf(answer, thetas, design, None), dtype=np.float64), (len(thetas),))
+            except Exception as e:
+                return problems + [f'likelihood_pdf(answer, thetas, design, profile) raised {type(e).__name__}: {e}'], False
+
+            if not np.all(np.isfinite(likelihood)) or np.any(likelihood < 0) or np.any(likelihood > 1):
+                problems.append(f'likelihood_pdf returned values outside [0, 1] for answer {answer} and design {design}.')
+            same_with_arrays = same_with_arrays and same_with_particles(user_config.likelihood_pdf, answer, particles, design, likelihood)
+            total += likelihood
+
+            if log_likelihood_pdf is not None:
+                try:
+                    log_likelihood = np.broadcast_to(np.asarray(log_likelihood_pdf(answer, thetas, design, None), dtype=np.float64), (len(thetas),))
+                except Exception as e:
+                    return problems + [f'log_likelihood_pdf(answer, thetas, design, profile) raised {type(e).__name__}: {e}'], False
+
+                # Compare where the likelihood is not clipped
+                mask = (likelihood > 1e-9) & (likelihood < 1 - 1e-9)
+                if not np.allclose(np.exp(log_likelihood[mask]), likelihood[mask], rtol=1e-6, atol=1e-9):
+                    problems.append(f'log_likelihood_pdf does not match log(likelihood_pdf) for answer {answer} and design {design}.')
+                same_with_arrays = same_with_arrays and same_with_particles(log_likelihood_pdf, answer, particles, design, log_likelihood)
+
+        if not np.allclose(total, 1, atol=1e-6):
+            problems.append(f'Likelihoods of all answers do not sum to 1 for design {design} (range {total.min():.4g} to {total.max():.4g}).')
+
+    return problems, same_with_arrays
+
+def validate_config(user_config, n_check=100, n_designs=5):
+    """
+    Check that user_config has the settings the app needs and that its likelihoods are valid probabilities.
+
+    Returns:
+        problems: list of descriptions of problems found (empty if the config is valid)
+        same_with_arrays: True if the likelihoods can be called with Particles instead of DataFrames
+    """
+    problems = [f'Missing setting: {name}' for name in required_settings if not hasattr(user_config, name)]
+    if problems:
+        return problems, False
+
+    str_answers = [str(answer) for answer in user_config.answers]
+    if len(str_answers) == 0:
+        problems.append('answers is empty.')
+    if len(set(str_answers)) < len(str_answers):
+        problems.append('answers are not unique as strings (answers are received as strings through the API).')
+
+    for name, dist in user_config.theta_params.items():
+        if not (hasattr(dist, 'rvs') and hasattr(dist, 'logpdf')):
+            problems.append(f'theta_params[{name!r}] must be a frozen scipy.stats distribution with rvs and logpdf.')
+
+    for name, values in user_config.design_params.items():
+        if isinstance(values, (list, tuple)):
+            if len(values) == 0:
+                problems.append(f'design_params[{name!r}] is an empty list.')
+        elif not hasattr(values, 'rvs'):
+            problems.append(f'design_params[{name!r}] must be a list or a scipy.stats distribution.')
+
+    if not (isinstance(user_config.size_thetas, numbers.Integral) and user_config.size_thetas > 0):
+        problems.append('size_thetas must be a positive integer.')
+
+    precision = getattr(user_config, 'precision', None)
+    if precision is not None and precision not in precisions:
+        problems.append(f'Unknown precision {precision}. Choose one of {list(precisions)}.')
+
+    design_encoding = getattr(user_config, 'design_encoding', 'labels')
+    if design_encoding not in design_encodings:
+        problems.append(f'Unknown design_encoding {design_encoding}. Choose one of {design_encodings}.')
+
+    inference = getattr(user_config, 'inference', 'pmc')
+    if inference not in inference_engines:
+        problems.append(f'Unknown inference {inference}. Choose one of {inference_engines}.')
+    elif inference == 'grid' and len(user_config.theta_params) > 4:
+        problems.append(f"inference = 'grid' is meant for models with up to 4 preference parameters ({len(user_config.theta_params)} given). Use 'pmc'.")
+
+    if getattr(user_config, 'likelihood_jit', False):
+        if not callable(getattr(user_config, 'log_likelihood_kernel', None)):
+            problems.append('likelihood_jit = True requires a log_likelihood_kernel(answer, theta, design) function (see bace/jit_likelihood.py).')
+        if getattr(user_config, 'log_likelihood_pdf', None) is None:
+            problems.append('likelihood_jit = True requires log_likelihood_pdf, which is used where the compiled kernel does not apply.')
+
+    design_search = getattr(user_config, 'design_search', 'bayesian')
+    if design_search not in design_searches:
+        problems.append(f'Unknown design_search {design_search}. Choose one of {design_searches}.')
+
+    if problems:
+        return problems, False
+
+    design_params = user_config.design_params
+    if design_encoding == 'codes':
+        design_params = get_search_params(design_params, get_design_encoding(design_params))
+
+    # Likelihoods that read the profile cannot be evaluated without one. They are not checked and get particles as DataFrames.
+    if uses_profile(user_config.likelihood_pdf) or uses_profile(getattr(user_config, 'log_likelihood_pdf', None)):
+        print('Likelihoods use the profile and cannot be checked without one. Skipping the likelihood checks.')
+        return problems, False
+
+    thetas = sample_thetas(user_config.theta_params, n_check)
+    designs = [sample_random_design(design_params) for _ in range(n_designs)]
+    likelihood_problems, same_with_arrays = check_likelihoods(user_config, thetas, designs)
+
+    return problems + likelihood_problems, same_with_arrays
+
+def compile_config(user_config, n_check=100):
+    """
+    Validate user_config and build the runtime model. Raises ValueError if the config has problems.
+    """
+    problems, same_with_arrays = validate_config(user_config, n_check)
+    if problems:
+        raise ValueError('Invalid user_config:\n  ' + '\n  '.join(problems))
+
+    likelihood_pdf = user_config.likelihood_pdf
+    log_likelihood_pdf = getattr(user_config, 'log_likelihood_pdf', None)
+    if same_with_arrays:
+        likelihood_pdf = ArrayLikelihood(likelihood_pdf)
+        log_likelihood_pdf = ArrayLikelihood(log_likelihood_pdf) if log_likelihood_pdf is not None else None
+    else:
+        print('Likelihoods were not confirmed to give the same results with arrays as with DataFrames. Passing particles as DataFrames.')
+
+    design_encoding = get_design_encoding(user_config.design_params)
+    encode_designs = (getattr(user_config, 'design_encoding', 'labels') == 'codes')
+
+    if getattr(user_config, 'likelihood_jit', False):
+        log_likelihood_pdf = compile_kernel_likelihood(user_config, log_likelihood_pdf, design_encoding, encode_designs, n_check)
+
+    return RuntimeModel(user_config, likelihood_pdf, log_likelihood_pdf, design_encoding, encode_designs=encode_designs)
+
+def compile_kernel_likelihood(user_config, log_likelihood_pdf, design_encoding, encode_designs, n_check=100, n_designs=5):
+    """
+    Compile user_config.log_likelihood_kernel with numba and check it against the Python log-likelihood.
+    Returns the log-likelihood to use: a KernelLikelihood, or log_likelihood_pdf if numba is not installed
+    or the likelihood depends on the profile. Raises ValueError if the kernel does not match.
+    """
+    if numba is None:
+        print('likelihood_jit requires numba (pip install numba). Using the Python likelihood.')
+        return log_likelihood_pdf
+    if uses_profile(user_config.likelihood_pdf) or uses_profile(user_config.log_likelihood_pdf):
+        print('likelihood_jit is ignored because the likelihood depends on the profile.')
+        return log_likelihood_pdf
+
+    kernel_likelihood = KernelLikelihood(
+        user_config.log_likelihood_kernel, log_likelihood_pdf, user_config.answers, user_config.design_params, design_encoding, encode_designs
+    )
+
+    design_params = get_search_params(user_config.design_params, design_encoding) if encode_designs else user_config.design_params
+    thetas = sample_thetas(user_config.theta_params, n_check)
+    designs = [sample_random_design(design_params) for _ in range(n_designs)]
+    problems = check_kernel(kernel_likelihood, log_likelihood_pdf, user_config.likelihood_pdf, user_config.answers, thetas, designs)
+    if problems:
+        raise ValueError('Invalid user_config:\n  ' + '\n  '.join(problems))
+
+    return kernel_likelihood
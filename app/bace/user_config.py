@@ -1,10 +1,24 @@
 # Example configuration file
 import scipy.stats
 import numpy as np
+import math
 
 author       = 'Pen Example Application' # Your name here
 size_thetas  = 2500                      # Size of sample drawn from prior distribution over preference parameters.
 max_opt_time = 5                         # Stop Bayesian Optimization process after max_opt_time seconds and return best design.
+precision    = 'float64'                 # Precision of particle math: 'float64' or 'float32' (halves memory traffic; weights are still normalized in float64). With float32, likelihoods with steps (e.g. at utility ties) should compute utilities in float64. Check with tools/validation/precision_check.py.
+estimates_accuracy = 'high'              # Accuracy of /estimates: 'high' re-runs PMC with 10x particles unless already done; 'standard' reuses the estimates from the last answer.
+estimates_mode = 'inline'                # 'inline' computes /estimates within the request; 'background' records the answer and computes estimates on a worker (poll /estimates GET).
+db_write_mode = 'sync'                   # 'sync' waits for database writes; 'write_behind' queues writes and responds without waiting (not on AWS Lambda).
+first_design_pool_size = 0               # If > 0 and bace/first_designs.json is missing or outdated, compute this many first designs at cold start (see tools/first_designs).
+design_encoding = 'labels'               # 'labels' passes categorical design values as listed in design_params; 'codes' uses their integer positions end to end (see bace/runtime_model.py).
+inference = 'pmc'                        # 'pmc' (population Monte Carlo), 'grid' (exact posterior on a grid of grid_size points, for up to 4 preference parameters) or 'laplace' (Gaussian approximation, falls back to PMC).
+design_search = 'bayesian'               # 'bayesian' optimizes designs with Mango; 'successive_halving' screens many random designs on growing subsets of particles.
+design_refinement = False                # If True, refine the continuous attributes of the chosen design by gradient ascent on mutual information.
+likelihood_jit = False                   # If True, compile log_likelihood_kernel below with numba (must be installed) for PMC and mutual information.
+mi_cache_size = 10000                    # Number of (particle set, design) mutual information scores to memoize (0 disables the cache).
+scoring_threads = 1                      # Threads for scoring batches of candidate designs within a request (1, a number, or 'auto' for all cores). Batches of 16+ designs are split by design; single designs (the default Mango search) by particles.
+scoring_batch_window = 0                 # If > 0, a threaded server scores designs of concurrent requests together, collecting them for this many milliseconds (see bace/batch_scoring.py).
 
 # example constraint: Remove designs where pen A is Blue and pen B is Black (i.e., ensuring color_a <= color_b)
 # to be added to `conf_dict` below
@@ -50,20 +64,26 @@ design_params = dict(
     type_b    = ['Ballpoint', 'Gel']
 )
 
+# Utility of pen B relative to pen A given preferences thetas
+def utility_diff(thetas, design):
+
+    base_U_a = - design['price_a'] + thetas['blue_ink'] * (design['color_a'] == 'Blue') + thetas['gel_pen'] * (design['type_a'] == 'Gel')
+    base_U_b = - design['price_b'] + thetas['blue_ink'] * (design['color_b'] == 'Blue') + thetas['gel_pen'] * (design['type_b'] == 'Gel')
+
+    return base_U_b - base_U_a
+
 # Specify likelihood function
 # Returns Prob(answer | thetas, design) for each answer in answers
 # Optionally allow for user's profile to be used as an input
 def likelihood_pdf(answer, thetas, design, profile=None):
 
-    base_U_a = - design['price_a'] + thetas['blue_ink'] * (design['color_a'] == 'Blue') + thetas['gel_pen'] * (design['type_a'] == 'Gel')
-    base_U_b = - design['price_b'] + thetas['blue_ink'] * (design['color_b'] == 'Blue') + thetas['gel_pen'] * (design['type_b'] == 'Gel')
-    base_utility_diff = base_U_b - base_U_a
+    base_utility_diff = utility_diff(thetas, design)
 
     # Logit likelihood of choosing B over A with scale parameter thetas['mu']
     likelihood = 1 / (1 + np.exp(-1 * thetas['mu'] * base_utility_diff))
 
     # Likelihood should be strictly between 0 and 1
-    eps = 1e-10
+    eps = likelihood.dtype.type(1e-10) # In the particles' precision (see precision above)
     likelihood[likelihood < eps] = eps
     likelihood[likelihood > (1 - eps)] = 1 - eps
 
@@ -75,3 +95,37 @@ def likelihood_pdf(answer, thetas, design, profile=None):
     else:
         # choose A
         return 1 - likelihood
+
+# (Optional) Specify log-likelihood function
+# Returns log Prob(answer | thetas, design) for each answer in answers
+# If specified, it is used instead of likelihood_pdf for inference and mutual information.
+# Working with logs directly is more accurate for sharp posteriors and does not require clipping likelihoods.
+def log_likelihood_pdf(answer, thetas, design, profile=None):
+
+    base_utility_diff = utility_diff(thetas, design)
+
+    # Log of the logit likelihood: log(1 / (1 + exp(-x))) = -log(exp(0) + exp(-x))
+    if str(answer) == '1':
+        # choose B
+        return -np.logaddexp(0, -1 * thetas['mu'] * base_utility_diff)
+    else:
+        # choose A
+        return -np.logaddexp(0, thetas['mu'] * base_utility_diff)
+
+# (Optional) Specify a scalar log-likelihood kernel, compiled with numba if likelihood_jit = True (see bace/jit_likelihood.py)
+# Returns log Prob(answer | theta, design) for a single particle and design:
+#   answer: index of the answer in answers
+#   theta:  array of preference parameters in the order of theta_params (blue_ink, gel_pen, mu)
+#   design: array of design attributes in the order of design_params (price_a, price_b, color_a, color_b, type_a, type_b),
+#           with categorical attributes as the position of their value (e.g. color 1 = 'Blue', type 1 = 'Gel')
+# Use only scalar math (e.g. the math module) so that numba can compile it.
+# def log_likelihood_kernel(answer, theta, design):
+#
+#     x = theta[2] * (design[0] - design[1] + theta[0] * (design[3] - design[2]) + theta[1] * (design[5] - design[4]))
+#
+#     # log(1 / (1 + exp(-x))) for choosing B, log(1 / (1 + exp(x))) for choosing A
+#     if answer == 0:
+#         x = -x
+#     if x > 0:
+#         return -math.log1p(math.exp(-x))
+#     return x - math.log1p(math.exp(x))
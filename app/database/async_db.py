@@ -0,0 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import traceback
+import atexit
+import time
+
+# Wrapper around a database table (boto3 Table or LocalTable) that overlaps database I/O with computation.
+#   get_item_async starts a read on a background thread and returns a future, so a route can do other work while waiting.
+#   With write_behind=True, put_item and update_item are queued and return immediately; the response does not wait
+#   for the write. Writes for the same key are applied in order, and reads in this process wait for pending writes
+#   to the same key, so a profile is never read back stale by the process that wrote it. Failed writes are retried.
+#   Pending writes are flushed when the process exits.
+# Do not use write-behind on AWS Lambda: the execution environment can be frozen once a response is returned.
+class AsyncTable:
+    def __init__(self, table, write_behind=False, max_workers=4, max_retries=3, key_name='profile_id'):
+        self.table = table
+        self.write_behind = write_behind
+        self.max_retries = max_retries
+        self.key_name = key_name
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = dict() # Last queued write for each key
+        self.lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def wait_for_writes(self, key_value):
+        with self.lock:
+            future = self.pending.get(key_value)
+        if future is not None:
+            future.exception() # Wait without raising. Errors are logged by the writer.
+
+    def get_item(self, Key):
+        self.wait_for_writes(Key[self.key_name])
+        return self.table.get_item(Key=Key)
+
+    def get_item_async(self, Key):
+        return self.executor.submit(self.get_item, Key)
+
+    def put_item(self, Item):
+        return self.write(Item[self.key_name], self.table.put_item, Item=Item)
+
+    def update_item(self, Key, **kwargs):
+        return self.write(Key[self.key_name], self.table.update_item, Key=Key, **kwargs)
+
+    def write(self, key_value, method, **kwargs):
+        if not self.write_behind:
+            return method(**kwargs)
+
+        with self.lock:
+            previous = self.pending.get(key_value)
+            future = self.executor.submit(self.run_write, previous, method, kwargs)
+            self.pending[key_value] = future
+        future.add_done_callback(lambda f: self.clear_pending(key_value, f))
+
+        return {}
+
+    def run_write(self, previous, method, kwargs):
+        # Apply writes to the same key in the order they were queued.
+        # The previous write was queued first, so it has already been started by the pool.
+        if previous is not None:
+            previous.exception()
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                return method(**kwargs)
+            except Exception:
+                if attempt == self.max_retries:
+                    print(f'Write-behind failed after {attempt + 1} attempts for {kwargs.get("Key") or kwargs["Item"].get(self.key_name)}')
+                    traceback.print_exc()
+                    raise
+                time.sleep(0.1 * 2**attempt)
+
+    def clear_pending(self, key_value, future):
+        with self.lock:
+            if self.pending.get(key_value) is future:
+                del self.pending[key_value]
+
+    def flush(self):
+        # Wait for all queued writes
+        with self.lock:
+            futures = list(self.pending.values())
+        for future in futures:
+            future.exception()
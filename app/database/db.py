@@ -1,16 +1,22 @@
 from decimal import Decimal
 import json
+import os
 import boto3
 
-db_type = 'dynamodb'
+db_type = os.environ.get('BACE_DB_TYPE', 'dynamodb') # Set the environment variable BACE_DB_TYPE=local to use an in-memory table without AWS (e.g. for local load tests)
 table_name = 'bace-db' # Update this if the name of the db table in template.yaml is changed
-# Update table_region below to the region name created by `sam deploy --guided`, saved in the SAM configuration file (samconfig.toml by default)
-#   if different from the default region in ~/.aws/config (or C:\Users\USERNAME\.aws\config)
-table_region = boto3.Session().region_name # example if changed: table_region = 'us-east-2'
 
-# Store database connection
-ddb = boto3.resource(db_type, region_name = table_region)
-table = ddb.Table(table_name)
+if db_type == 'local':
+    from .local_db import LocalTable
+    table = LocalTable()
+else:
+    # Update table_region below to the region name created by `sam deploy --guided`, saved in the SAM configuration file (samconfig.toml by default)
+    #   if different from the default region in ~/.aws/config (or C:\Users\USERNAME\.aws\config)
+    table_region = boto3.Session().region_name # example if changed: table_region = 'us-east-2'
+
+    # Store database connection
+    ddb = boto3.resource(db_type, region_name = table_region)
+    table = ddb.Table(table_name)
 
 # Functions for converting output
 def float_to_decimal(data):
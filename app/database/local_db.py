@@ -0,0 +1,37 @@
+import copy
+import threading
+
+# In-memory stand-in for a DynamoDB table, for running the app locally without AWS (e.g. load tests).
+# Implements the subset of the boto3 Table interface used by the app. Items are kept per process and lost on exit.
+class LocalTable:
+    def __init__(self, key_name='profile_id'):
+        self.key_name = key_name
+        self.items = dict()
+        self.lock = threading.Lock()
+
+    def get_item(self, Key):
+        with self.lock:
+            item = self.items.get(Key[self.key_name])
+            return {'Item': copy.deepcopy(item)} if item is not None else {}
+
+    def put_item(self, Item):
+        with self.lock:
+            self.items[Item[self.key_name]] = copy.deepcopy(Item)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, ExpressionAttributeNames, ReturnValues=None):
+        # Supports expressions of the form 'SET #a=:a,#b=:b' as created by update_db_item
+        updates = dict()
+        for assignment in UpdateExpression.replace('SET ', '', 1).split(','):
+            name, value = assignment.strip().split('=')
+            updates[ExpressionAttributeNames[name]] = copy.deepcopy(ExpressionAttributeValues[value])
+
+        with self.lock:
+            item = self.items.setdefault(Key[self.key_name], dict(Key))
+            item.update(updates)
+
+        return {'Attributes': updates}
+
+    def scan(self, **kwargs):
+        with self.lock:
+            return {'Items': copy.deepcopy(list(self.items.values()))}
@@ -0,0 +1,67 @@
+import argparse
+import os
+from threadpoolctl import threadpool_limits
+from gunicorn.app.base import BaseApplication
+
+# Production server for running the app outside of AWS Lambda (e.g. in a container).
+# The app and user_config are loaded and warmed up once in the master process, then a pool of workers is forked
+# and shares the loaded state (copy-on-write). The same `app` object serves both Lambda events and WSGI requests,
+# so no changes to app.py are needed.
+#
+# By default each worker handles one request at a time, so use one worker per core and limit the threads of numerical libraries
+# in each worker to avoid oversubscription. With --threads > 1, each worker serves several requests on threads, which lets
+# scoring_batch_window in user_config batch the design scoring of concurrent requests (see bace/batch_scoring.py).
+#
+# Install gunicorn first. It is pinned in the root requirements.txt but not in app/requirements.txt, which is packaged
+# for Lambda where it is not used:
+#   pip install -r app/requirements.txt gunicorn==22.0.0
+# Usage (from the app folder):
+#   python serve.py --workers 4 --threads_per_worker 1 --bind 0.0.0.0:8000
+#   Settings can also be given with the environment variables BACE_WORKERS, BACE_THREADS_PER_WORKER, BACE_THREADS, BACE_BIND and BACE_TIMEOUT.
+
+def limit_threads(threads_per_worker):
+    # Called in each worker after it is forked. Limits BLAS/OpenMP thread pools used by numpy, scipy and scikit-learn.
+    def post_fork(server, worker):
+        threadpool_limits(limits=threads_per_worker)
+    return post_fork
+
+def warm_up(app):
+    # Run a request that does not use the database so imports, templates and the design domain are loaded before forking
+    response = app.test_client().get('/random_design')
+    if response.status_code != 200:
+        raise RuntimeError(f'Warm-up request failed with status {response.status_code}')
+
+class BaceServer(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app import app
+        warm_up(app)
+        return app
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Serve the BACE app with a pool of preforked workers.')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('BACE_WORKERS', os.cpu_count())), help='Number of worker processes.')
+    parser.add_argument('--threads_per_worker', type=int, default=int(os.environ.get('BACE_THREADS_PER_WORKER', 1)), help='Threads used by numerical libraries in each worker.')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('BACE_THREADS', 1)), help='Requests served concurrently by each worker.')
+    parser.add_argument('--bind', default=os.environ.get('BACE_BIND', '0.0.0.0:8000'), help='Address to listen on.')
+    parser.add_argument('--timeout', type=int, default=int(os.environ.get('BACE_TIMEOUT', 120)), help='Seconds before a busy worker is restarted.')
+    args = parser.parse_args()
+
+    BaceServer({
+        'bind': args.bind,
+        'workers': args.workers,
+        'worker_class': 'gthread' if args.threads > 1 else 'sync',
+        'threads': args.threads,
+        'preload_app': True,
+        'timeout': args.timeout,
+        'post_fork': limit_threads(args.threads_per_worker),
+        'accesslog': '-',
+    }).run()
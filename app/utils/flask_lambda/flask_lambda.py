@@ -16,22 +16,60 @@
 #
 # This code was adapted from https://github.com/sivel/flask-lambda/ on March 27, 2024.
 # The code implements updates to the import statements and environ definition to allow for compatibility with 2.3.X Flask versions.
+# It was later extended to accept API Gateway HTTP API (payload format 2.0) events and to dispatch JSON routes
+# registered with `native_route` directly, without building a WSGI environ or running Flask's dispatch.
 # A copy of the original distribution license is included in the same folder as original_flasklambda_LICENSE.txt.
 
 import sys
-from urllib.parse import urlencode
+import json
+import base64
+import traceback
+from urllib.parse import urlencode, parse_qsl
 from flask import Flask
 import io
-from flask.wrappers import Request as BaseRequest
+from werkzeug.exceptions import InternalServerError
 
 
 __version__ = '0.0.4'
 
 
+def normalize_event(event):
+    # Read the request from an API Gateway REST API (payload 1.0) or HTTP API (payload 2.0) event
+    if 'httpMethod' in event:
+        method = event['httpMethod']
+        path = event['path']
+        query = event.get('queryStringParameters')
+        source_ip = event['requestContext']['identity']['sourceIp']
+    else:
+        http = event['requestContext']['http']
+        method = http['method']
+        path = event.get('rawPath') or http['path']
+        # Remove the stage name from the path of named stages
+        stage = event['requestContext'].get('stage')
+        if stage and stage != '$default' and path.startswith(f'/{stage}/'):
+            path = path[len(stage) + 1:]
+        query = dict(parse_qsl(event.get('rawQueryString') or ''))
+        source_ip = http.get('sourceIp', '')
+
+    body = event.get('body')
+    if body and event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode()
+
+    return {
+        'method': method,
+        'path': path,
+        'query': query or {},
+        'headers': event.get('headers') or {},
+        'body': body,
+        'source_ip': source_ip
+    }
+
+
 def make_environ(event):
+    request = normalize_event(event)
     environ = {}
 
-    for hdr_name, hdr_value in event['headers'].items():
+    for hdr_name, hdr_value in request['headers'].items():
         hdr_name = hdr_name.replace('-', '_').upper()
         if hdr_name in ['CONTENT_TYPE', 'CONTENT_LENGTH']:
             environ[hdr_name] = hdr_value
@@ -40,12 +78,17 @@ def make_environ(event):
         http_hdr_name = 'HTTP_%s' % hdr_name
         environ[http_hdr_name] = hdr_value
 
-    qs = event['queryStringParameters']
+    environ.setdefault('HTTP_HOST', 'localhost')
+    environ.setdefault('HTTP_X_FORWARDED_PORT', '443')
+    environ.setdefault('HTTP_X_FORWARDED_PROTO', 'https')
+
+    qs = request['query']
+    body = request['body']
 
-    environ['REQUEST_METHOD'] = event['httpMethod']
-    environ['PATH_INFO'] = event['path']
+    environ['REQUEST_METHOD'] = request['method']
+    environ['PATH_INFO'] = request['path']
     environ['QUERY_STRING'] = urlencode(qs) if qs else ''
-    environ['REMOTE_ADDR'] = event['requestContext']['identity']['sourceIp']
+    environ['REMOTE_ADDR'] = request['source_ip']
     environ['HOST'] = '%(HTTP_HOST)s:%(HTTP_X_FORWARDED_PORT)s' % environ
     environ['SCRIPT_NAME'] = ''
 
@@ -53,22 +96,31 @@ def make_environ(event):
     environ['SERVER_PROTOCOL'] = 'HTTP/1.1'
 
     environ['CONTENT_LENGTH'] = str(
-        len(event['body']) if event['body'] else ''
+        len(body) if body else ''
     )
 
     environ['wsgi.url_scheme'] = environ['HTTP_X_FORWARDED_PROTO']
-    environ['wsgi.input'] = io.BytesIO((event['body'] or '').encode()) # Updated to use io.BytesIO()
+    environ['wsgi.input'] = io.BytesIO((body or '').encode()) # Updated to use io.BytesIO()
     environ['wsgi.version'] = (1, 0)
     environ['wsgi.errors'] = sys.stderr
     environ['wsgi.multithread'] = False
     environ['wsgi.run_once'] = True
     environ['wsgi.multiprocess'] = False
 
-    BaseRequest(environ)
-
     return environ
 
 
+def get_native_data(request):
+    # Parameters of the request, as returned by utils/app_utils.py: get_request
+    if request['method'] == 'GET':
+        return dict(request['query'])
+
+    headers = {name.lower(): value for name, value in request['headers'].items()}
+    if headers.get('content-type') == 'application/json':
+        return json.loads(request['body'] or 'null')
+    return dict(parse_qsl(request['body'] or ''))
+
+
 class LambdaResponse(object):
     def __init__(self):
         self.status = None
@@ -80,13 +132,50 @@ class LambdaResponse(object):
 
 
 class FlaskLambda(Flask):
+    def __init__(self, *args, **kwargs):
+        super(FlaskLambda, self).__init__(*args, **kwargs)
+        self.native_routes = {}
+
+    def native_route(self, rule, methods=['GET']):
+        # Register handler(data, method) for Lambda events with this path and method.
+        # The handler returns (body, status, headers) as utils/app_utils.py: format_response.
+        def decorator(handler):
+            for method in methods:
+                self.native_routes[(method, rule)] = handler
+            return handler
+        return decorator
+
+    def call_native(self, handler, request):
+        try:
+            body, status, headers = handler(get_native_data(request), request['method'])
+        except Exception:
+            # Same response as the app's error handler for unhandled errors
+            traceback.print_exc()
+            error = InternalServerError()
+            body, status, headers = json.dumps({
+                'code': error.code,
+                'name': error.name,
+                'description': error.description,
+            }), error.code, {'Content-Type': 'application/json'}
+
+        return {
+            'statusCode': status,
+            'headers': headers,
+            'body': body
+        }
+
     def __call__(self, event, context):
-        if 'httpMethod' not in event:
+        if 'REQUEST_METHOD' in event:
             # In this "context" `event` is `environ` and
             # `context` is `start_response`, meaning the request didn't
             # occur via API Gateway and Lambda
             return super(FlaskLambda, self).__call__(event, context)
 
+        request = normalize_event(event)
+        handler = self.native_routes.get((request['method'], request['path']))
+        if handler is not None:
+            return self.call_native(handler, request)
+
         response = LambdaResponse()
 
         body = next(self.wsgi_app(
@@ -98,4 +187,4 @@ class FlaskLambda(Flask):
             'statusCode': response.status,
             'headers': response.response_headers,
             'body': body
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,27 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import traceback
+
+# Queue for running jobs (e.g. high-accuracy estimates) outside of the web request.
+# LocalJobQueue runs jobs on a pool of local workers, which suits long-running servers.
+# On AWS Lambda, the execution environment can be frozen once a response is returned,
+# so replace it with any object that has a `submit(job, *args)` method (e.g. one that sends a message to SQS).
+
+def log_exception(future):
+    # Print errors raised by a job, since nobody waits on its result
+    e = future.exception()
+    if e is not None:
+        traceback.print_exception(type(e), e, e.__traceback__)
+
+class LocalJobQueue:
+    def __init__(self, max_workers=1, use_processes=False):
+        # Threads share the app's database connection. Processes require jobs that can be pickled (module-level functions).
+        executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self.executor = executor(max_workers=max_workers)
+
+    def submit(self, job, *args, **kwargs):
+        future = self.executor.submit(job, *args, **kwargs)
+        future.add_done_callback(log_exception)
+        return future
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,108 @@
+import threading
+from concurrent.futures import Future
+
+# Idempotent answer submission.
+# Survey platforms retry requests that time out (Qualtrics web services, the SurveyCTO plugin). Without a way to
+# recognize a retry, the answer is appended to the history again and inference and the design search run again.
+# A submission is identified by either:
+#   - idempotency_key: any string unique to the submission (stored with the answer in the profile's answer_keys), or
+#   - question_number: the number of the question whose design the request returns (as sent by the Qualtrics template),
+#     i.e. the submission answers question (question_number - 1).
+# Without either, an answer that arrives when all designs in the profile are already answered (e.g. a retry of the final
+# answer sent to /estimates or /surveyCTO with return_estimates) is taken as a repeat of the last answer.
+# A submission whose answer is already in the profile is a replay: the stored next design is returned without
+# running inference or the optimizer. Submissions that are still being computed are shared with their retries
+# (see InFlightSubmissions).
+
+def get_answer_index(profile, request_data):
+    # Index in the answer history of the answer carried by the request, or None if the request does not identify it
+    key = request_data.get('idempotency_key')
+    if key is not None and str(key).strip() != '':
+        keys = profile.get('answer_keys') or []
+        return keys.index(str(key)) if str(key) in keys else len(profile.get('answer_history', []))
+
+    try:
+        question_number = int(request_data.get('question_number'))
+    except (TypeError, ValueError):
+        question_number = None
+    if question_number is not None and question_number >= 2:
+        return question_number - 2
+
+    # Without an identifier, an answer that arrives when every design shown has been answered repeats the last answer
+    answer_history = profile.get('answer_history', [])
+    if len(answer_history) > 0 and len(answer_history) >= len(profile.get('design_history', [])):
+        return len(answer_history) - 1
+    return None
+
+def is_replay(profile, request_data):
+    # Whether the request's answer is already in the profile's answer history
+    index = get_answer_index(profile, request_data)
+    if index is None or index >= len(profile.get('answer_history', [])):
+        return False
+
+    stored = profile['answer_history'][index]
+    if str(stored) != str(request_data.get('answer')):
+        print(f'Repeated submission for question {index + 1} with answer {request_data.get("answer")} (stored answer: {stored}). Keeping the stored answer.')
+    return True
+
+def get_replayed_design(profile, request_data):
+    """
+    Design already computed after the request's answer.
+
+    Returns:
+        design: the stored next design, or None if the request is not a replay or no design followed its answer (e.g. the last question)
+    """
+    if not is_replay(profile, request_data):
+        return None
+    index = get_answer_index(profile, request_data)
+    design_history = profile.get('design_history', [])
+    return design_history[index + 1] if index + 1 < len(design_history) else None
+
+def record_answer(profile, answer, request_data):
+    # Append the answer to the history, with its idempotency key if the request has one. Returns the fields to store.
+    profile['answer_history'].append(answer)
+    updates = {'answer_history': profile['answer_history']}
+
+    key = request_data.get('idempotency_key')
+    if key is not None and str(key).strip() != '':
+        keys = list(profile.get('answer_keys') or [])
+        keys += [None] * (len(profile['answer_history']) - 1 - len(keys))
+        profile['answer_keys'] = keys + [str(key)]
+        updates['answer_keys'] = profile['answer_keys']
+    return updates
+
+def submission_key(profile, request_data):
+    # Key of a submission among those in flight: the profile and the position of the answer
+    index = get_answer_index(profile, request_data)
+    return (profile.get('profile_id'), index if index is not None else len(profile.get('answer_history', [])))
+
+class InFlightSubmissions:
+    """
+    Submissions being processed in this process. A retry that arrives while the original request is still computing
+    waits for the original's result instead of computing it again.
+    """
+    def __init__(self):
+        self.futures = dict()
+        self.lock = threading.Lock()
+
+    def run(self, key, compute):
+        with self.lock:
+            future = self.futures.get(key)
+            owner = future is None
+            if owner:
+                future = self.futures[key] = Future()
+
+        if not owner:
+            print(f'Submission {key} is already being processed. Waiting for its result.')
+            return future.result()
+
+        try:
+            result = compute()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.futures[key]
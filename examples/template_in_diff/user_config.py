@@ -50,7 +50,7 @@ design_params    = dict(
 
 # Specify likelihood function
 # Returns Prob(answer | thetas, design) for each answer in answers
-def likelihood_pdf(answer, thetas, design):
+def likelihood_pdf(answer, thetas, design, profile=None):
 
     eps = 1e-10
 
@@ -67,6 +67,7 @@ def likelihood_pdf(answer, thetas, design):
 
     # Logit likelihood of choosing B over A with scale parameter thetas['mu']
     likelihood = 1 / (1 + np.exp(-1 * thetas['mu'] * base_utility_diff))
+    eps = likelihood.dtype.type(eps)
 
     likelihood[likelihood < eps] = eps
     likelihood[likelihood > (1 - eps)] = 1 - eps
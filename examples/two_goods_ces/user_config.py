@@ -44,15 +44,17 @@ def ces(x, y, r):
 # Returns Prob(answer | thetas, design) for each answer in answers
 # Optionally allow for user's profile to be used as an input
 def likelihood_pdf(answer, thetas, design, profile=None):
-    u1 = ces(design['x1'], design['y1'], thetas['r'])
-    u2 = ces(design['x2'], design['y2'], thetas['r'])
+    # Utilities in float64 even if particles are float32 (precision = 'float32'): rounding would flip the step at ties
+    r = np.asarray(thetas['r'], dtype=np.float64)
+    u1 = ces(design['x1'], design['y1'], r)
+    u2 = ces(design['x2'], design['y2'], r)
 
     base_utility_diff = u2 - u1
 
     # Choose higher utility option with probability p. Randomly otherwise.
     likelihood = (base_utility_diff > 0) * thetas['p'] + (1/2) * (1 - thetas['p'])
 
-    eps = 1e-10
+    eps = likelihood.dtype.type(1e-10)
     likelihood[likelihood < eps] = eps
     likelihood[likelihood > (1 - eps)] = 1 - eps
 
@@ -46,6 +46,7 @@ const buttons_per_row = getPluginParameter("buttons_per_row") || buttons_per_row
 const button_label = getPluginParameter("button_label") || button_label_default;
 const profile_enumerator = getPluginParameter("profile_enumerator") || profile_enumerator_default;
 const loading_message = getPluginParameter("loading_message") || loading_message_default;
+const question_number = getPluginParameter("question_number"); // Number of this BACE question (e.g. ${scenario_number}). Lets BACE recognize retried requests.
 
 // Get answers parameters then store as array.
 function answersArray(n) {
@@ -368,6 +369,11 @@ var request_data = {
     return_estimates: (final_question) ? 1 : 0
 }
 
+// Question number, so that BACE returns the stored result if this request is sent again
+if (question_number){
+    request_data['question_number'] = question_number;
+}
+
 // If first question and add_to_profile_vars is not empty. Add variables to request data
 let add_to_request_vars = getPluginParameter("add_to_request_vars");
 console.log('Add to request');
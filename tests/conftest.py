@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Import app modules the way the app does (relative to the app folder), with the in-memory database instead of DynamoDB
+os.environ.setdefault('BACE_DB_TYPE', 'local')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
@@ -0,0 +1,24 @@
+import numpy as np
+import scipy.stats
+
+# Model for testing the inference engines: one preference parameter with a probit likelihood,
+# so the exact posterior can be computed by quadrature
+theta_params = {'theta': scipy.stats.norm(loc=0, scale=1)}
+design_history = [{'x': -1.0}, {'x': 0.5}, {'x': 0.0}, {'x': 1.5}, {'x': 0.2}]
+answer_history = [1, 0, 1, 1, 0]
+
+def likelihood_pdf(answer, thetas, design, profile=None):
+    likelihood = scipy.stats.norm.cdf(2 * (np.asarray(thetas['theta']) - design['x']))
+    return likelihood if str(answer) == '1' else 1 - likelihood
+
+def exact_moments(answer_history, design_history):
+    theta = np.linspace(-8, 8, 200001)
+    log_post = theta_params['theta'].logpdf(theta)
+    with np.errstate(divide='ignore'):
+        for answer, design in zip(answer_history, design_history):
+            log_post += np.log(likelihood_pdf(answer, {'theta': theta}, design))
+    w = np.exp(log_post - log_post.max())
+    w /= w.sum()
+    mean = np.sum(w * theta)
+    return mean, np.sqrt(np.sum(w * (theta - mean)**2))
+
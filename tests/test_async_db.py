@@ -0,0 +1,64 @@
+import time
+
+from database.async_db import AsyncTable
+from database.local_db import LocalTable
+from database.db import update_db_item
+
+class SlowTable(LocalTable):
+    # Local table whose writes take a while and can fail a given number of times
+    def __init__(self, delay=0.05, failures=0):
+        super().__init__()
+        self.delay = delay
+        self.failures = failures
+        self.writes = 0
+
+    def update_item(self, **kwargs):
+        time.sleep(self.delay)
+        self.writes += 1
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError('Write failed')
+        return super().update_item(**kwargs)
+
+def test_sync_writes_are_applied_before_returning():
+    table = AsyncTable(SlowTable(delay=0))
+    table.put_item(Item={'profile_id': 'a', 'answer_history': []})
+    update_db_item(table, {'profile_id': 'a'}, {'answer_history': [1]})
+    assert table.table.items['a']['answer_history'] == [1]
+
+def test_write_behind_returns_before_the_write():
+    table = AsyncTable(SlowTable(delay=0.2), write_behind=True)
+    table.put_item(Item={'profile_id': 'a', 'answer_history': []})
+
+    start = time.time()
+    update_db_item(table, {'profile_id': 'a'}, {'answer_history': [1]})
+    assert time.time() - start < 0.1
+    table.flush()
+    assert table.table.items['a']['answer_history'] == [1]
+
+def test_write_behind_applies_writes_in_order_and_reads_own_writes():
+    table = AsyncTable(SlowTable(delay=0.02), write_behind=True)
+    table.put_item(Item={'profile_id': 'a', 'answer_history': []})
+    for n in range(1, 6):
+        update_db_item(table, {'profile_id': 'a'}, {'answer_history': list(range(n))})
+
+    # The read waits for the pending writes to the same profile
+    assert table.get_item(Key={'profile_id': 'a'})['Item']['answer_history'] == [0, 1, 2, 3, 4]
+    assert table.get_item_async(Key={'profile_id': 'a'}).result()['Item']['answer_history'] == [0, 1, 2, 3, 4]
+
+def test_write_behind_retries_failed_writes():
+    table = AsyncTable(SlowTable(delay=0, failures=2), write_behind=True)
+    update_db_item(table, {'profile_id': 'a'}, {'answer_history': [1]})
+    table.flush()
+    assert table.table.writes == 3
+    assert table.table.items['a']['answer_history'] == [1]
+
+def test_reads_of_other_profiles_do_not_wait():
+    table = AsyncTable(SlowTable(delay=0.5), write_behind=True)
+    table.put_item(Item={'profile_id': 'b', 'answer_history': [0]})
+    update_db_item(table, {'profile_id': 'a'}, {'answer_history': [1]})
+
+    start = time.time()
+    assert table.get_item(Key={'profile_id': 'b'})['Item']['answer_history'] == [0]
+    assert time.time() - start < 0.25
+    table.flush()
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+import scipy.stats
+
+from bace.densities import get_logpdf, normal_logpdf
+
+@pytest.mark.parametrize('dist', [
+    scipy.stats.norm(loc=1, scale=2),
+    scipy.stats.uniform(loc=-1, scale=3),
+    scipy.stats.lognorm(s=0.5, scale=2),
+    scipy.stats.beta(a=2, b=3, loc=0, scale=2),
+    scipy.stats.gamma(a=2, scale=1.5),
+])
+def test_closed_form_matches_scipy(dist):
+    # Inside and outside the support
+    x = np.linspace(-3, 6, 91)
+    np.testing.assert_allclose(get_logpdf(dist)(x), dist.logpdf(x), rtol=1e-10, atol=1e-12)
+
+def test_float32_input_is_evaluated_in_float64():
+    dist = scipy.stats.norm(loc=0.1, scale=0.3)
+    x = np.linspace(-1, 1, 11, dtype=np.float32)
+    values = get_logpdf(dist)(x)
+    assert values.dtype == np.float64
+    np.testing.assert_allclose(values, dist.logpdf(x.astype(np.float64)), rtol=1e-12)
+
+def test_other_distributions_use_scipy():
+    dist = scipy.stats.t(df=3)
+    assert get_logpdf(dist) == dist.logpdf
+
+def test_normal_logpdf_with_arrays_of_locations_and_scales():
+    x = np.array([[0.0, 1.0], [2.0, -1.0]])
+    loc = np.array([[0.5, 0.5], [1.0, 1.0]])
+    scale = np.array([1.0, 2.0])
+    np.testing.assert_allclose(normal_logpdf(x, loc, scale), scipy.stats.norm.logpdf(x, loc=loc, scale=scale), rtol=1e-12)
@@ -0,0 +1,102 @@
+import base64
+import json
+
+from utils.flask_lambda.flask_lambda import FlaskLambda
+from utils.app_utils import format_response
+
+def make_app(calls):
+    app = FlaskLambda(__name__)
+
+    @app.native_route('/echo', methods=['GET', 'POST'])
+    def echo(data, method):
+        calls.append((data, method))
+        return format_response({'data': data, 'method': method})
+
+    @app.native_route('/fail', methods=['POST'])
+    def fail(data, method):
+        raise ValueError('Handler failed')
+
+    @app.route('/wsgi_only', methods=['GET'])
+    def wsgi_only():
+        return {'served_by': 'wsgi'}
+
+    return app
+
+def v1_event(method, path, body=None, query=None, headers=None, base64_encoded=False):
+    # API Gateway REST API event (payload format 1.0)
+    return {
+        'httpMethod': method,
+        'path': path,
+        'queryStringParameters': query,
+        'headers': headers or {},
+        'body': body,
+        'isBase64Encoded': base64_encoded,
+        'requestContext': {'identity': {'sourceIp': '127.0.0.1'}}
+    }
+
+def v2_event(method, path, body=None, query='', headers=None, stage='$default'):
+    # API Gateway HTTP API event (payload format 2.0)
+    return {
+        'version': '2.0',
+        'rawPath': path,
+        'rawQueryString': query,
+        'headers': headers or {},
+        'body': body,
+        'isBase64Encoded': False,
+        'requestContext': {'stage': stage, 'http': {'method': method, 'path': path, 'sourceIp': '127.0.0.1'}}
+    }
+
+def test_v1_json_post_is_dispatched_natively():
+    calls = []
+    app = make_app(calls)
+    body = json.dumps({'profile_id': 'a', 'answer': 1})
+    response = app(v1_event('POST', '/echo', body=body, headers={'Content-Type': 'application/json'}), None)
+
+    assert response['statusCode'] == 200
+    assert calls == [({'profile_id': 'a', 'answer': 1}, 'POST')]
+    assert json.loads(response['body']) == {'data': {'profile_id': 'a', 'answer': 1}, 'method': 'POST'}
+
+def test_v1_base64_form_post():
+    calls = []
+    app = make_app(calls)
+    body = base64.b64encode(b'profile_id=a&answer=1').decode()
+    app(v1_event('POST', '/echo', body=body, headers={'content-type': 'application/x-www-form-urlencoded'}, base64_encoded=True), None)
+    assert calls == [({'profile_id': 'a', 'answer': '1'}, 'POST')]
+
+def test_v2_get_with_query_and_named_stage():
+    calls = []
+    app = make_app(calls)
+    response = app(v2_event('GET', '/prod/echo', query='profile_id=a&answer=0', stage='prod'), None)
+
+    assert response['statusCode'] == 200
+    assert calls == [({'profile_id': 'a', 'answer': '0'}, 'GET')]
+
+def test_v2_json_post_is_dispatched_natively():
+    calls = []
+    app = make_app(calls)
+    app(v2_event('POST', '/echo', body=json.dumps({'answer': 1}), headers={'content-type': 'application/json'}), None)
+    assert calls == [({'answer': 1}, 'POST')]
+
+def test_handler_errors_return_json_500():
+    app = make_app([])
+    response = app(v2_event('POST', '/fail', body='{}', headers={'content-type': 'application/json'}), None)
+    assert response['statusCode'] == 500
+    assert json.loads(response['body'])['code'] == 500
+
+def test_other_routes_go_through_wsgi():
+    calls = []
+    app = make_app(calls)
+    for event in [v1_event('GET', '/wsgi_only'), v2_event('GET', '/wsgi_only')]:
+        response = app(event, None)
+        assert response['statusCode'] == 200
+        assert json.loads(response['body']) == {'served_by': 'wsgi'}
+
+    # A method without a native handler falls through to WSGI (where /echo is not registered in this app)
+    response = app(v1_event('DELETE', '/echo'), None)
+    assert response['statusCode'] == 404
+    assert calls == []
+
+def test_standard_wsgi_requests():
+    app = make_app([])
+    response = app.test_client().get('/wsgi_only')
+    assert response.get_json() == {'served_by': 'wsgi'}
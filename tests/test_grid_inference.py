@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+import bace.grid_inference as grid_inference
+from bace.grid_inference import grid_posterior
+from probit_model import theta_params, answer_history, design_history, likelihood_pdf, exact_moments
+
+def test_grid_posterior_matches_quadrature():
+    mean, std = exact_moments(answer_history, design_history)
+    thetas = grid_posterior(theta_params, answer_history, design_history, likelihood_pdf, 10000, grid_size=2000)
+    assert thetas['theta'].mean() == pytest.approx(mean, abs=0.02)
+    assert thetas['theta'].std() == pytest.approx(std, abs=0.02)
+
+def test_grid_state_is_extended_with_new_answers():
+    grid_inference.grid_cache.clear()
+    grid_posterior(theta_params, answer_history[:3], design_history[:3], likelihood_pdf, 100, grid_size=500, refine=False, cache_key='a')
+    grid_posterior(theta_params, answer_history, design_history, likelihood_pdf, 100, grid_size=500, refine=False, cache_key='a')
+    fresh = grid_inference.add_answers(grid_inference.new_grid_state(theta_params, 500), theta_params, answer_history, design_history, likelihood_pdf)
+
+    cached = grid_inference.grid_cache['a']
+    assert cached['answer_history'] == answer_history
+    np.testing.assert_allclose(cached['log_lklhd'], fresh['log_lklhd'], rtol=1e-12)
+
+def test_grid_state_is_rebuilt_if_the_history_changed():
+    grid_inference.grid_cache.clear()
+    grid_posterior(theta_params, [0, 0], design_history[:2], likelihood_pdf, 100, grid_size=500, refine=False, cache_key='a')
+    grid_posterior(theta_params, answer_history[:3], design_history[:3], likelihood_pdf, 100, grid_size=500, refine=False, cache_key='a')
+    fresh = grid_inference.add_answers(grid_inference.new_grid_state(theta_params, 500), theta_params, answer_history[:3], design_history[:3], likelihood_pdf)
+    np.testing.assert_allclose(grid_inference.grid_cache['a']['log_lklhd'], fresh['log_lklhd'], rtol=1e-12)
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+import scipy.stats
+
+import bace.laplace_inference as laplace_inference
+from bace.laplace_inference import laplace_posterior
+from probit_model import theta_params, answer_history, design_history, likelihood_pdf, exact_moments
+
+def test_laplace_posterior_matches_quadrature(capsys):
+    np.random.seed(0)
+    laplace_inference.mode_cache.clear()
+    mean, std = exact_moments(answer_history, design_history)
+    thetas = laplace_posterior(theta_params, answer_history, design_history, likelihood_pdf, 10000, cache_key='a')
+
+    assert 'Using PMC' not in capsys.readouterr().out
+    assert thetas['theta'].mean() == pytest.approx(mean, abs=0.02)
+    assert thetas['theta'].std() == pytest.approx(std, abs=0.02)
+    assert 'a' in laplace_inference.mode_cache
+
+def test_laplace_falls_back_to_pmc_for_bimodal_posteriors(capsys):
+    np.random.seed(0)
+
+    # Answer 1 means |theta| > 1, so the posterior has a mode on each side of 0
+    def bimodal_likelihood_pdf(answer, thetas, design, profile=None):
+        likelihood = scipy.stats.norm.cdf(5 * (np.abs(np.asarray(thetas['theta'])) - 1))
+        return likelihood if str(answer) == '1' else 1 - likelihood
+
+    thetas = laplace_posterior(theta_params, [1, 1, 1], [{}, {}, {}], bimodal_likelihood_pdf, 2000)
+    assert 'Using PMC' in capsys.readouterr().out
+    assert np.mean(thetas['theta'] > 0) == pytest.approx(0.5, abs=0.15)
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from bace.mi_cache import MICache, mi_cache, design_key
+from bace.design_optimization import get_objective, mutual_information, context
+
+answers = [0, 1]
+
+def likelihood_pdf(answer, thetas, design, profile=None):
+    scale = profile['scale'] if profile is not None else 1
+    likelihood = 1 / (1 + np.exp(-scale * (thetas['a'] - design['x'])))
+    return likelihood if str(answer) == '1' else 1 - likelihood
+
+@pytest.fixture
+def thetas():
+    return pd.DataFrame({'a': np.random.default_rng(0).normal(size=500)})
+
+class Counter:
+    # Scoring function that records the designs it scores
+    def __init__(self):
+        self.designs = []
+
+    def __call__(self, designs):
+        self.designs += designs
+        return [float(design['x']) for design in designs]
+
+def test_hits_are_not_recomputed(thetas):
+    cache, compute = MICache(), Counter()
+    assert cache.score(thetas, [{'x': 1}, {'x': 2}], 'scope', compute) == [1.0, 2.0]
+    assert cache.score(thetas, [{'x': 2}, {'x': 3}, {'x': 3}], 'scope', compute) == [2.0, 3.0, 3.0]
+
+    # Repeated designs within a batch are scored once
+    assert compute.designs == [{'x': 1}, {'x': 2}, {'x': 3}]
+    assert cache.stats() == dict(hits=2, misses=3, hit_rate=0.4, size=3)
+
+def test_keys_are_scoped_by_particles_and_scope(thetas):
+    cache, compute = MICache(), Counter()
+    cache.score(thetas, [{'x': 1}], 'scope', compute)
+
+    # A copy of the same particles hits; other particles or another scope miss
+    cache.score(thetas.copy(), [{'x': 1}], 'scope', compute)
+    cache.score(thetas + 1, [{'x': 1}], 'scope', compute)
+    cache.score(thetas, [{'x': 1}], 'other scope', compute)
+    assert len(compute.designs) == 3
+
+def test_least_recently_used_entries_are_evicted(thetas):
+    cache, compute = MICache(max_size=2), Counter()
+    cache.score(thetas, [{'x': 1}, {'x': 2}], 'scope', compute)
+    cache.score(thetas, [{'x': 1}], 'scope', compute)
+    cache.score(thetas, [{'x': 3}], 'scope', compute)
+    cache.score(thetas, [{'x': 1}, {'x': 2}], 'scope', compute)
+    assert compute.designs == [{'x': 1}, {'x': 2}, {'x': 3}, {'x': 2}]
+
+def test_disabled_cache_computes_everything(thetas):
+    cache, compute = MICache(max_size=0), Counter()
+    cache.score(thetas, [{'x': 1}], 'scope', compute)
+    cache.score(thetas, [{'x': 1}], 'scope', compute)
+    assert len(compute.designs) == 2
+
+def test_numpy_values_have_the_same_key():
+    assert design_key({'x': np.float64(1.5), 'color': 'Blue'}) == design_key({'color': 'Blue', 'x': 1.5})
+
+def test_objective_scores_are_scoped_by_profile(thetas):
+    mi_cache.clear()
+    context.thetas = thetas
+    designs = [{'x': 0.0}, {'x': 0.5}]
+    profile_a = {'profile_id': 'a', 'scale': 1}
+    profile_b = {'profile_id': 'b', 'scale': 5}
+
+    scores_a = get_objective(answers, likelihood_pdf, profile_a)(designs)
+    scores_b = get_objective(answers, likelihood_pdf, profile_b)(designs)
+    assert mi_cache.stats()['misses'] == 4
+
+    # The profile-dependent likelihood gives different scores, and each profile gets its own
+    assert scores_a != scores_b
+    assert scores_b == pytest.approx([mutual_information(thetas, answers, likelihood_pdf, design, profile_b) for design in designs])
+    assert get_objective(answers, likelihood_pdf, profile_a)(designs) == scores_a
+    assert mi_cache.stats()['hits'] == 2
+
+def test_profiles_without_id_are_not_cached(thetas):
+    mi_cache.clear()
+    context.thetas = thetas
+    get_objective(answers, likelihood_pdf, {'scale': 2})([{'x': 0.0}])
+    assert mi_cache.stats()['size'] == 0
@@ -0,0 +1,186 @@
+import threading
+import time
+
+import pytest
+
+from utils.submissions import get_answer_index, is_replay, get_replayed_design, record_answer, InFlightSubmissions
+
+def make_profile(n_answers, n_designs):
+    return {
+        'profile_id': 'a',
+        'answer_history': [str(i % 2) for i in range(n_answers)],
+        'design_history': [{'x': i} for i in range(n_designs)]
+    }
+
+def test_answer_index_from_question_number():
+    profile = make_profile(2, 3)
+    assert get_answer_index(profile, {'question_number': '3'}) == 1
+    assert get_answer_index(profile, {'question_number': 4}) == 2
+
+def test_answer_index_from_idempotency_key():
+    profile = make_profile(2, 3)
+    profile['answer_keys'] = ['k1', 'k2']
+    assert get_answer_index(profile, {'idempotency_key': 'k2'}) == 1
+    assert get_answer_index(profile, {'idempotency_key': 'k3'}) == 2
+
+def test_answer_index_without_identifier():
+    # Unknown while a design is waiting for its answer; the last answer once every design is answered
+    assert get_answer_index(make_profile(2, 3), {'answer': '1'}) is None
+    assert get_answer_index(make_profile(3, 3), {'answer': '1'}) == 2
+    assert get_answer_index(make_profile(0, 0), {'answer': '1'}) is None
+
+def test_replays():
+    profile = make_profile(2, 3)
+    assert is_replay(profile, {'answer': '1', 'question_number': '3'})
+    assert get_replayed_design(profile, {'answer': '1', 'question_number': '3'}) == {'x': 2}
+    assert not is_replay(profile, {'answer': '1', 'question_number': '4'})
+    assert get_replayed_design(profile, {'answer': '1', 'question_number': '4'}) is None
+
+    # Replay of the last answer, after which no design was computed
+    profile = make_profile(3, 3)
+    assert is_replay(profile, {'answer': '0'})
+    assert get_replayed_design(profile, {'answer': '0'}) is None
+
+def test_record_answer_stores_keys_aligned_with_answers():
+    profile = make_profile(2, 3)
+    updates = record_answer(profile, '1', {'answer': '1', 'idempotency_key': 'k3'})
+    assert profile['answer_history'] == ['0', '1', '1']
+    assert updates['answer_keys'] == [None, None, 'k3']
+
+    updates = record_answer(profile, '0', {'answer': '0'})
+    assert 'answer_keys' not in updates
+
+def test_retries_in_flight_share_the_result():
+    submissions = InFlightSubmissions()
+    calls = []
+    started = threading.Event()
+
+    def compute():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return 'design'
+
+    results = []
+    original = threading.Thread(target=lambda: results.append(submissions.run(('a', 1), compute)))
+    original.start()
+    started.wait()
+    retries = [threading.Thread(target=lambda: results.append(submissions.run(('a', 1), compute))) for _ in range(3)]
+    for thread in retries:
+        thread.start()
+    for thread in [original] + retries:
+        thread.join()
+
+    assert calls == [1]
+    assert results == ['design'] * 4
+    assert submissions.futures == dict()
+
+def test_errors_are_raised_to_retries_in_flight():
+    submissions = InFlightSubmissions()
+    started = threading.Event()
+
+    def compute():
+        started.set()
+        time.sleep(0.2)
+        raise ValueError('Inference failed')
+
+    errors = []
+    def submit():
+        try:
+            submissions.run(('a', 1), compute)
+        except ValueError as e:
+            errors.append(e)
+
+    original = threading.Thread(target=submit)
+    original.start()
+    started.wait()
+    retry = threading.Thread(target=submit)
+    retry.start()
+    original.join()
+    retry.join()
+
+    assert len(errors) == 2
+    assert submissions.futures == dict()
+
+# Replayed submissions through the app's routes (in-memory database)
+
+@pytest.fixture(scope='module')
+def bace_app():
+    from bace import user_config
+    user_config.max_opt_time = 0.3
+    import app
+    return app
+
+def count_calls(monkeypatch, module, name):
+    calls = []
+    function = getattr(module, name)
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return function(*args, **kwargs)
+    monkeypatch.setattr(module, name, counted)
+    return calls
+
+def get_profile(bace_app, profile_id):
+    return bace_app.table.get_item(Key={'profile_id': profile_id})['Item']
+
+def test_update_profile_replay(bace_app, monkeypatch):
+    client = bace_app.app.test_client()
+    calls = count_calls(monkeypatch, bace_app, 'select_next_design')
+    profile_id = client.post('/create_profile', json={}).get_json()['profile_id']
+
+    first = client.post('/update_profile', json={'profile_id': profile_id, 'answer': 1, 'question_number': '2'}).get_json()
+    retry = client.post('/update_profile', json={'profile_id': profile_id, 'answer': 1, 'question_number': '2'}).get_json()
+
+    assert retry == first
+    assert len(calls) == 1
+    profile = get_profile(bace_app, profile_id)
+    assert len(profile['answer_history']) == 1
+    assert len(profile['design_history']) == 2
+
+def test_concurrent_update_profile_retries(bace_app, monkeypatch):
+    client = bace_app.app.test_client()
+    calls = count_calls(monkeypatch, bace_app, 'select_next_design')
+    profile_id = client.post('/create_profile', json={}).get_json()['profile_id']
+
+    responses = []
+    def submit():
+        responses.append(client.post('/update_profile', json={'profile_id': profile_id, 'answer': 0, 'idempotency_key': 'q1'}).get_json())
+    threads = [threading.Thread(target=submit) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert all(response == responses[0] for response in responses)
+    assert get_profile(bace_app, profile_id)['answer_history'] == [0]
+
+def test_estimates_replay_without_identifier(bace_app, monkeypatch):
+    client = bace_app.app.test_client()
+    profile_id = client.post('/create_profile', json={}).get_json()['profile_id']
+    client.post('/update_profile', json={'profile_id': profile_id, 'answer': '1', 'question_number': '2'})
+
+    calls = count_calls(monkeypatch, bace_app, 'compute_estimates')
+    first = client.post('/estimates', json={'profile_id': profile_id, 'answer': '0'}).get_json()
+    retry = client.post('/estimates', json={'profile_id': profile_id, 'answer': '0'}).get_json()
+
+    assert retry == first
+    assert len(calls) == 1
+    assert get_profile(bace_app, profile_id)['answer_history'] == ['1', '0']
+
+def test_surveycto_replays(bace_app, monkeypatch):
+    client = bace_app.app.test_client()
+    client.post('/surveyCTO', json={'profile_id': 'surveycto_replay'})
+    calls = count_calls(monkeypatch, bace_app, 'infer_thetas')
+
+    first = client.post('/surveyCTO', json={'profile_id': 'surveycto_replay', 'answer': '1', 'question_number': '2'}).get_json()
+    retry = client.post('/surveyCTO', json={'profile_id': 'surveycto_replay', 'answer': '1', 'question_number': '2'}).get_json()
+    assert retry == first
+
+    # The final answer is sent with return_estimates and no identifier
+    estimates = client.post('/surveyCTO', json={'profile_id': 'surveycto_replay', 'answer': '0', 'return_estimates': 1}).get_json()
+    retry = client.post('/surveyCTO', json={'profile_id': 'surveycto_replay', 'answer': '0', 'return_estimates': 1}).get_json()
+    assert retry == estimates
+
+    assert len(calls) == 2
+    assert get_profile(bace_app, 'surveycto_replay')['answer_history'] == ['1', '0']
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from bace.first_designs import uses_profile
+from bace.particles import ArrayLikelihood
+
+def without_profile(answer, thetas, design, profile=None):
+    return 1 / (1 + np.exp(-(thetas['a'] - design['x'])))
+
+def with_profile(answer, thetas, design, profile=None):
+    return 1 / (1 + np.exp(-(thetas['a'] - design['x'] * profile['scale'])))
+
+def with_renamed_profile(answer, thetas, design, respondent):
+    return 1 / (1 + np.exp(-(thetas['a'] - design['x'] * respondent['scale'])))
+
+def with_profile_in_closure(answer, thetas, design, profile=None):
+    scale = lambda: profile['scale']
+    return 1 / (1 + np.exp(-(thetas['a'] - design['x'] * scale())))
+
+@pytest.mark.parametrize('likelihood, expected', [
+    (without_profile, False),
+    (with_profile, True),
+    (with_renamed_profile, True),
+    (with_profile_in_closure, True),
+    (lambda answer, thetas, design: thetas['a'], False),
+    (None, False),
+])
+def test_functions(likelihood, expected):
+    assert uses_profile(likelihood) == expected
+
+@pytest.mark.parametrize('likelihood, expected', [(without_profile, False), (with_profile, True)])
+def test_array_wrappers(likelihood, expected):
+    assert uses_profile(ArrayLikelihood(likelihood)) == expected
+    assert uses_profile(ArrayLikelihood(ArrayLikelihood(likelihood))) == expected
+
+@pytest.mark.parametrize('likelihood, expected', [(without_profile, False), (with_profile, True)])
+def test_kernel_wrapper_of_array_wrapper(likelihood, expected):
+    pytest.importorskip('numba')
+    from bace.jit_likelihood import KernelLikelihood
+
+    def log_likelihood_kernel(answer, theta, design):
+        return -np.log1p(np.exp(design[0] - theta[0])) if answer == 1 else -np.log1p(np.exp(theta[0] - design[0]))
+
+    wrapped = KernelLikelihood(log_likelihood_kernel, ArrayLikelihood(likelihood), [0, 1], ['x'], dict(), False)
+    assert uses_profile(wrapped) == expected
@@ -0,0 +1,79 @@
+import numpy as np
+import importlib.util
+import argparse
+import random
+import time
+import sys
+from pathlib import Path
+
+# Compile the design tree for the first questions of a survey and save it next to the app's config (app/bace/design_tree.json).
+# The app serves questions in the tree by lookup, without running PMC or the design optimization (see app/bace/design_tree.py).
+# The tree has 1 + A + ... + A^(depth-1) designs for A possible answers, so keep the depth small.
+#
+# Usage (from the repository root):
+#   python tools/design_tree/build_design_tree.py --depth 3
+#   Rebuild after changing app/bace/user_config.py.
+
+root = Path(__file__).resolve().parents[2]
+sys.path.append(str(root))
+
+from app.bace.design_optimization import get_conf_dict, context
+from app.bace.estimates import get_config_version
+from app.bace.runtime_model import compile_config
+from app.bace.first_designs import uses_profile
+from app.bace.design_tree import compile_design_tree, save_design_tree, design_tree_file
+
+def load_config(path):
+    spec = importlib.util.spec_from_file_location('user_config', path)
+    user_config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(user_config)
+    return user_config
+
+def main(args):
+
+    start_time = time.time()
+    user_config = load_config(args.config)
+    model = compile_config(user_config)
+    log_likelihood_pdf = model.log_likelihood_pdf
+
+    profile_dependent = getattr(user_config, 'profile_dependent_likelihood', None)
+    if profile_dependent is None:
+        profile_dependent = uses_profile(user_config.likelihood_pdf) or uses_profile(log_likelihood_pdf)
+    if profile_dependent:
+        sys.exit('The likelihood depends on the profile, so designs differ between profiles and cannot be precomputed.')
+
+    n_nodes = sum(len(user_config.answers)**d for d in range(args.depth))
+    print(f'Compiling {n_nodes} designs for the first {args.depth} questions...')
+
+    context.max_opt_time = args.max_opt_time if args.max_opt_time is not None else user_config.max_opt_time
+    nodes = compile_design_tree(
+        user_config.theta_params,
+        user_config.answers,
+        model.likelihood_pdf,
+        model.design_params,
+        get_conf_dict(user_config.conf_dict),
+        args.size_thetas or user_config.size_thetas,
+        args.depth,
+        J=args.J,
+        precision=getattr(user_config, 'precision', None),
+        log_likelihood_pdf=log_likelihood_pdf
+    )
+
+    save_design_tree(args.output, nodes, args.depth, get_config_version(user_config))
+    print(f'Saved design tree with {len(nodes)} designs to {args.output} in {time.time() - start_time:.1f}s.')
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Precompute the designs for the first questions of a survey.')
+    parser.add_argument('--config', default=str(root / 'app' / 'bace' / 'user_config.py'), help='user_config.py used by the app.')
+    parser.add_argument('--output', default=str(root / 'app' / 'bace' / design_tree_file), help='Output file (bundled with the app).')
+    parser.add_argument('--depth', type=int, default=3, help='Number of questions to precompute.')
+    parser.add_argument('--size_thetas', type=int, default=None, help='Particles for each posterior. Defaults to size_thetas in the config.')
+    parser.add_argument('--J', type=int, default=5, help='Number of PMC rounds.')
+    parser.add_argument('--max_opt_time', type=float, default=None, help='Optimization time per design. Defaults to max_opt_time in the config.')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    main(args)
@@ -0,0 +1,72 @@
+import numpy as np
+import importlib.util
+import argparse
+import random
+import sys
+from pathlib import Path
+
+# Build the pool of first designs under the prior and save it next to the app's config (app/bace/first_designs.json),
+# so it is bundled with the deployment and new profiles get their first design without running the optimizer.
+# The app only uses the file if it was built from the same user_config (see app/bace/first_designs.py).
+#
+# Usage (from the repository root):
+#   python tools/first_designs/build_first_designs.py --n_designs 50
+#   Rebuild after changing app/bace/user_config.py.
+
+root = Path(__file__).resolve().parents[2]
+sys.path.append(str(root))
+
+from app.bace.design_optimization import get_conf_dict, context
+from app.bace.estimates import get_config_version
+from app.bace.runtime_model import compile_config
+from app.bace.first_designs import uses_profile, compute_first_designs, save_first_designs, first_designs_file
+
+def load_config(path):
+    spec = importlib.util.spec_from_file_location('user_config', path)
+    user_config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(user_config)
+    return user_config
+
+def main(args):
+
+    user_config = load_config(args.config)
+    model = compile_config(user_config)
+    log_likelihood_pdf = model.log_likelihood_pdf
+
+    profile_dependent = getattr(user_config, 'profile_dependent_likelihood', None)
+    if profile_dependent is None:
+        profile_dependent = uses_profile(user_config.likelihood_pdf) or uses_profile(log_likelihood_pdf)
+    if profile_dependent:
+        sys.exit('The likelihood depends on the profile, so first designs differ between profiles and cannot be precomputed.')
+
+    context.max_opt_time = args.max_opt_time if args.max_opt_time is not None else user_config.max_opt_time
+
+    designs = compute_first_designs(
+        user_config.theta_params,
+        user_config.answers,
+        model.likelihood_pdf,
+        model.design_params,
+        get_conf_dict(user_config.conf_dict),
+        user_config.size_thetas,
+        args.n_designs,
+        getattr(user_config, 'precision', None),
+        log_likelihood_pdf
+    )
+
+    save_first_designs(args.output, designs, get_config_version(user_config))
+    mutual_info = [d['mutual_information'] for d in designs]
+    print(f'Saved {len(designs)} first designs to {args.output}. Mutual information: min {min(mutual_info):.4f}, mean {np.mean(mutual_info):.4f}, max {max(mutual_info):.4f}.')
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Precompute first designs under the prior for new profiles.')
+    parser.add_argument('--config', default=str(root / 'app' / 'bace' / 'user_config.py'), help='user_config.py used by the app.')
+    parser.add_argument('--output', default=str(root / 'app' / 'bace' / first_designs_file), help='Output file (bundled with the app).')
+    parser.add_argument('--n_designs', type=int, default=50, help='Number of designs in the pool.')
+    parser.add_argument('--max_opt_time', type=float, default=None, help='Optimization time per design. Defaults to max_opt_time in the config.')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    main(args)
@@ -0,0 +1,223 @@
+import numpy as np
+import pandas as pd
+import argparse
+import random
+import json
+import time
+import uuid
+import sys
+import os
+import re
+from pathlib import Path
+from urllib.parse import urlencode
+from concurrent.futures import ProcessPoolExecutor
+
+# Local load test for the BACE app, without AWS.
+# Each simulated user runs in its own process with its own copy of the app and an in-memory table
+# (app/database/local_db.py, selected with BACE_DB_TYPE=local). Requests go through the same entry point as on
+# AWS Lambda (FlaskLambda called with API Gateway events), or through Flask's WSGI test client with --mode wsgi.
+# Simulated users run complete respondent flows over the JSON API (/create_profile, /update_profile, /estimates),
+# the HTML survey (/survey) and SurveyCTO (/surveyCTO), and the script reports latency percentiles per route
+# and throughput for each concurrency level.
+#
+# Usage (from the repository root):
+#   python tools/load_test/local_load_test.py --concurrency 1 2 4 --flows_per_user 3 --n_questions 5
+#   Optional: --max_opt_time 0.5 to shorten design optimization, --output results.csv to save every request.
+
+root = Path(__file__).resolve().parents[2]
+app_dir = root / 'app'
+
+flows = ['api', 'survey', 'surveycto']
+
+# Client that calls the app like AWS Lambda does (API Gateway REST API events)
+class LambdaClient:
+    def __init__(self, app):
+        self.app = app
+
+    def request(self, method, path, json_data=None, form=None, query=None):
+        headers = {'Host': 'localhost', 'X-Forwarded-Port': '443', 'X-Forwarded-Proto': 'https'}
+        body = None
+        if json_data is not None:
+            headers['Content-Type'] = 'application/json'
+            body = json.dumps(json_data)
+        elif form is not None:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            body = urlencode(form)
+
+        event = {
+            'httpMethod': method,
+            'path': path,
+            'headers': headers,
+            'queryStringParameters': query,
+            'body': body,
+            'requestContext': {'identity': {'sourceIp': '127.0.0.1'}}
+        }
+        response = self.app(event, None)
+        body = response['body']
+        return response['statusCode'], body.decode() if isinstance(body, bytes) else body
+
+# Client that calls the app through its WSGI interface
+class WsgiClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, json_data=None, form=None, query=None):
+        response = self.client.open(path, method=method, json=json_data, data=form, query_string=query)
+        return response.status_code, response.get_data(as_text=True)
+
+def load_app(mode, max_opt_time):
+    # Import the app with the in-memory table. Runs once in every worker process.
+    os.environ['BACE_DB_TYPE'] = 'local'
+    sys.path.insert(0, str(app_dir))
+    import app as app_module
+
+    if max_opt_time is not None:
+        app_module.context.max_opt_time = max_opt_time
+
+    client = LambdaClient(app_module.app) if mode == 'lambda' else WsgiClient(app_module.app)
+    return app_module, client
+
+class Recorder:
+    # Time each request and record its route, status and latency
+    def __init__(self, client, user_no):
+        self.client = client
+        self.user_no = user_no
+        self.records = []
+
+    def request(self, route, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            status, body = self.client.request(method, path, **kwargs)
+            error = None if status == 200 else f'HTTP {status}'
+        except Exception as e:
+            status, body, error = None, '', f'{type(e).__name__}: {e}'
+        self.records.append(dict(
+            user_no=self.user_no,
+            route=route,
+            status=status,
+            error=error,
+            latency=time.perf_counter() - start
+        ))
+        if error is not None:
+            raise RuntimeError(f'{route} failed with {error}')
+        return body
+
+def run_api_flow(recorder, answers, n_questions):
+    design = json.loads(recorder.request('POST /create_profile', 'POST', '/create_profile', json_data={'survey_id': 'load_test'}))
+    profile_id = design['profile_id']
+
+    for _ in range(n_questions - 1):
+        recorder.request('POST /update_profile', 'POST', '/update_profile', json_data={'profile_id': profile_id, 'answer': random.choice(answers)})
+
+    recorder.request('POST /estimates', 'POST', '/estimates', json_data={'profile_id': profile_id, 'answer': random.choice(answers)})
+    recorder.request('GET /estimates', 'GET', '/estimates', query={'profile_id': profile_id})
+
+def run_survey_flow(recorder, answers, n_questions):
+    recorder.request('GET /survey', 'GET', '/survey')
+    page = recorder.request('POST /survey (start)', 'POST', '/survey', form={'survey_id': 'load_test'})
+    profile_id = re.search(r'name="profile_id" value="([^"]+)"', page).group(1)
+
+    for _ in range(n_questions):
+        recorder.request('POST /survey (answer)', 'POST', '/survey', form={'profile_id': profile_id, 'answer': random.choice(answers)})
+
+def run_surveycto_flow(recorder, answers, n_questions):
+    recorder.request('GET /surveyCTO', 'GET', '/surveyCTO')
+    profile_id = str(uuid.uuid4())
+    recorder.request('POST /surveyCTO (start)', 'POST', '/surveyCTO', json_data={'profile_id': profile_id})
+
+    for j in range(n_questions):
+        data = {'profile_id': profile_id, 'answer': random.choice(answers)}
+        if j == n_questions - 1:
+            data['return_estimates'] = 1
+        recorder.request('POST /surveyCTO (answer)', 'POST', '/surveyCTO', json_data=data)
+
+flow_functions = {
+    'api': run_api_flow,
+    'survey': run_survey_flow,
+    'surveycto': run_surveycto_flow
+}
+
+def run_user(user_no, args):
+
+    if not args.verbose:
+        # Hide the app's logging and progress bars. Failed requests are recorded in the output.
+        sys.stdout = sys.stderr = open(os.devnull, 'w')
+
+    random.seed(args.seed + user_no)
+    np.random.seed(args.seed + user_no)
+
+    app_module, client = load_app(args.mode, args.max_opt_time)
+    app_module.nquestions = args.n_questions # Questions per /survey flow
+    recorder = Recorder(client, user_no)
+
+    # Warm up imports and caches before timing
+    client.request('GET', '/')
+
+    start = time.time()
+    for i in range(args.flows_per_user):
+        flow = args.flows[(user_no + i) % len(args.flows)]
+        try:
+            recorder.request('GET /random_design', 'GET', '/random_design')
+            flow_functions[flow](recorder, app_module.answers, args.n_questions)
+        except RuntimeError as e:
+            print(f'User {user_no}: {flow} flow stopped ({e}).', file=sys.__stdout__)
+
+    return recorder.records, start, time.time()
+
+def run_level(concurrency, args):
+    # Run `concurrency` simulated users at the same time
+    with ProcessPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(run_user, range(concurrency), [args] * concurrency))
+
+    records = pd.DataFrame([record for result in results for record in result[0]])
+    records.insert(0, 'concurrency', concurrency)
+    wall_time = max(result[2] for result in results) - min(result[1] for result in results)
+
+    return records, wall_time
+
+def summarize(records, wall_time):
+    latency_ms = records.groupby('route')['latency'].describe(percentiles=[0.5, 0.9, 0.99]) * 1000
+    summary = pd.DataFrame({
+        'requests': records.groupby('route').size(),
+        'errors': records.groupby('route')['error'].count(),
+        'p50_ms': latency_ms['50%'],
+        'p90_ms': latency_ms['90%'],
+        'p99_ms': latency_ms['99%'],
+        'max_ms': latency_ms['max']
+    })
+    throughput = len(records) / wall_time if wall_time > 0 else np.nan
+    return summary.round(1), throughput
+
+def main(args):
+
+    output = []
+    for concurrency in args.concurrency:
+        print(f'Running {concurrency} concurrent users ({args.flows_per_user} flows each, {args.n_questions} questions per flow)...')
+        records, wall_time = run_level(concurrency, args)
+        summary, throughput = summarize(records, wall_time)
+
+        print(summary.to_string())
+        print(f'Concurrency {concurrency}: {len(records)} requests in {wall_time:.1f}s ({throughput:.2f} requests/s).\n')
+        output.append(records)
+
+    output = pd.concat(output, ignore_index=True)
+    if args.output is not None:
+        output.to_csv(args.output, index=False)
+        print(f'Saved {len(output)} requests to {args.output}')
+
+    return output
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Load test the BACE app locally with an in-memory database.')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4], help='Numbers of concurrent users to test.')
+    parser.add_argument('--flows_per_user', type=int, default=3, help='Respondent flows run by each user.')
+    parser.add_argument('--n_questions', type=int, default=5, help='Questions answered in each flow.')
+    parser.add_argument('--flows', nargs='+', default=flows, choices=flows, help='Flows to cycle through.')
+    parser.add_argument('--mode', default='lambda', choices=['lambda', 'wsgi'], help='Call the app with API Gateway events (lambda) or the WSGI test client.')
+    parser.add_argument('--max_opt_time', type=float, default=None, help='Override max_opt_time in user_config.py (seconds).')
+    parser.add_argument('--verbose', action='store_true', help="Show the app's output.")
+    parser.add_argument('--output', default=None, help='If specified, save every request to this csv.')
+    parser.add_argument('--seed', type=int, default=42)
+
+    main(parser.parse_args())
@@ -0,0 +1,190 @@
+import numpy as np
+import pandas as pd
+import importlib.util
+import argparse
+import time
+import sys
+import os
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Bulk re-estimation of preference parameters for a whole study.
+# Reads the csv exported by data/save_data.py, groups respondents by the number of answered questions,
+# and runs stacked PMC (app/bace/pmc_inference.py: pmc_stacked) on blocks of respondents across a pool of processes.
+# This is the command-line counterpart of tools/notebooks/Reestimate_preferences.ipynb.
+#
+# Usage (from the repository root):
+#   python tools/reestimate/reestimate.py --input data/dynamodb_contents.csv --output reestimation.csv
+#   Optional: --config path/to/user_config.py (e.g. with a new prior), --particles_dir to save posterior samples.
+
+root = Path(__file__).resolve().parents[2]
+sys.path.append(str(root))
+
+import app.bace.pmc_inference as pmc_inference
+from app.bace.estimates import summarize_thetas
+
+id_column = 'profile_id' # Unique ID column for each profile
+
+def load_config(path):
+    spec = importlib.util.spec_from_file_location('user_config', path)
+    user_config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(user_config)
+    return user_config
+
+def read_histories(file_in, user_config):
+    """
+    Rebuild each respondent's design and answer histories from the export of data/save_data.py
+    (one row per answered question, with design attributes as columns and `q_number` giving the question order).
+    Questions without a valid answer are dropped, as in the re-estimation notebook.
+    """
+    df = pd.read_csv(file_in, dtype={id_column: str, 'answer_history': str})
+    df = df.sort_values([id_column, 'q_number'])
+
+    str_answers = [str(answer) for answer in user_config.answers]
+    design_columns = list(user_config.design_params)
+
+    profiles = []
+    for profile_id, rows in df.groupby(id_column, sort=False):
+
+        # Profile-level variables (e.g. survey_id) are repeated on every row
+        profile = rows.drop(columns=design_columns + ['answer_history', 'q_number'], errors='ignore').iloc[0].to_dict()
+
+        rows = rows[rows['answer_history'].isin(str_answers)]
+        rows = rows.dropna(subset=design_columns)
+
+        profiles.append(dict(
+            profile_id=profile_id,
+            answer_history=list(rows['answer_history']),
+            design_history=rows[design_columns].to_dict('records'),
+            profile=profile
+        ))
+
+    return profiles
+
+def get_blocks(profiles, block_size):
+    # Group respondents with the same number of answered questions, then split each group into blocks
+    groups = dict()
+    for profile in profiles:
+        groups.setdefault(len(profile['answer_history']), []).append(profile)
+
+    blocks = []
+    for n_designs in sorted(groups):
+        group = groups[n_designs]
+        blocks.extend(group[i:i + block_size] for i in range(0, len(group), block_size))
+
+    return blocks
+
+def estimate_block(block, block_no, config_path, size_thetas, J, precision, per_profile, particles_dir, seed):
+
+    user_config = load_config(config_path)
+    log_likelihood_pdf = getattr(user_config, 'log_likelihood_pdf', None)
+    np.random.seed(seed + block_no)
+
+    n_designs = len(block[0]['answer_history'])
+    if n_designs == 0:
+        return [dict(profile_id=p['profile_id'], n_designs=0, reestimation_successful=0) for p in block]
+
+    thetas = None
+    if not per_profile:
+        try:
+            # Estimate all respondents in the block at once
+            thetas = pmc_inference.pmc_stacked(
+                user_config.theta_params,
+                [p['answer_history'] for p in block],
+                [p['design_history'] for p in block],
+                user_config.likelihood_pdf,
+                size_thetas,
+                J=J,
+                precision=precision,
+                log_likelihood_pdf=log_likelihood_pdf
+            )
+            thetas = [thetas.iloc[i * size_thetas:(i + 1) * size_thetas] for i in range(len(block))]
+        except Exception as e:
+            print(f'Stacked estimation failed for block {block_no} ({type(e).__name__}: {e}). Estimating respondents one at a time.')
+
+    if thetas is None:
+        # Estimate each respondent separately (also passes the profile to the likelihood)
+        thetas = []
+        for p in block:
+            try:
+                thetas.append(pmc_inference.pmc(
+                    user_config.theta_params,
+                    p['answer_history'],
+                    p['design_history'],
+                    user_config.likelihood_pdf,
+                    size_thetas,
+                    J=J,
+                    profile=p['profile'],
+                    precision=precision,
+                    log_likelihood_pdf=log_likelihood_pdf
+                ))
+            except Exception as e:
+                print(f'Estimation failed for {p["profile_id"]} ({type(e).__name__}: {e}).')
+                thetas.append(None)
+
+    output = []
+    for p, posterior_thetas in zip(block, thetas):
+        output.append(dict(
+            profile_id=p['profile_id'],
+            n_designs=n_designs,
+            reestimation_successful=int(posterior_thetas is not None),
+            **(summarize_thetas(posterior_thetas) if posterior_thetas is not None else {})
+        ))
+
+    # Optionally save posterior samples for the block
+    if particles_dir is not None:
+        particles = pd.concat(
+            [t.assign(**{id_column: p['profile_id']}) for p, t in zip(block, thetas) if t is not None],
+            ignore_index=True
+        )
+        particles.to_csv(os.path.join(particles_dir, f'particles_{n_designs}_{block_no}.csv.gz'), index=False)
+
+    return output
+
+def main(args):
+
+    start_time = time.time()
+    user_config = load_config(args.config)
+    size_thetas = args.size_thetas or user_config.size_thetas
+
+    profiles = read_histories(args.input, user_config)
+    blocks = get_blocks(profiles, args.block_size)
+    print(f'Re-estimating {len(profiles)} profiles in {len(blocks)} blocks with {args.workers} workers...')
+
+    if args.particles_dir is not None:
+        os.makedirs(args.particles_dir, exist_ok=True)
+
+    output = []
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [
+            executor.submit(estimate_block, block, block_no, args.config, size_thetas, args.J, args.precision, args.per_profile, args.particles_dir, args.seed)
+            for block_no, block in enumerate(blocks)
+        ]
+        for i, future in enumerate(as_completed(futures)):
+            output.extend(future.result())
+            print(f'Finished block {i+1} of {len(blocks)}. Elapsed time: {time.time() - start_time:.1f}s.')
+
+    # Convert output to dataframe and write to .csv
+    output_df = pd.json_normalize(output)
+    output_df.insert(1, 'estimation_version', args.estimation_version)
+    output_df.to_csv(args.output, index=False)
+
+    print(f'Saved estimates for {len(output_df)} profiles to {args.output} in {time.time() - start_time:.1f}s.')
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Re-estimate preference parameters for every profile in a BACE export.')
+    parser.add_argument('--input', default=str(root / 'data' / 'dynamodb_contents.csv'), help='csv exported by data/save_data.py.')
+    parser.add_argument('--output', default='reestimation.csv', help='Output csv with posterior summaries for each profile.')
+    parser.add_argument('--config', default=str(root / 'app' / 'bace' / 'user_config.py'), help='user_config.py with the prior and likelihood to use.')
+    parser.add_argument('--estimation_version', default='PMC_reestimation', help='Notes to store in the output file.')
+    parser.add_argument('--size_thetas', type=int, default=None, help='Particles per profile. Defaults to size_thetas in the config.')
+    parser.add_argument('--J', type=int, default=5, help='Number of PMC rounds.')
+    parser.add_argument('--precision', default=None, help="Precision of particle math ('float64' or 'float32').")
+    parser.add_argument('--block_size', type=int, default=100, help='Number of profiles estimated together in one stacked PMC.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes.')
+    parser.add_argument('--per_profile', action='store_true', help='Estimate one profile at a time (e.g. if the likelihood uses the profile).')
+    parser.add_argument('--particles_dir', default=None, help='If specified, save posterior samples for each block to this folder.')
+    parser.add_argument('--seed', type=int, default=42)
+
+    main(parser.parse_args())
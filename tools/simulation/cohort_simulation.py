@@ -0,0 +1,210 @@
+import numpy as np
+import pandas as pd
+import argparse
+import random
+import time
+import sys
+import os
+from pathlib import Path
+from mango import Tuner
+
+# Simulate a cohort of respondents in lockstep.
+# All respondents' particle populations are stacked into one (R*N x d) DataFrame (app/bace/pmc_inference.py: pmc_stacked),
+# answers for the whole cohort are drawn with one likelihood call per answer, and designs are selected for all respondents
+# at once by scoring a shared pool of candidate designs with app/bace/design_optimization.py: mutual_information_stacked.
+# Output has the same format as simulation.py (one row per respondent and question, `sim_no` identifies the respondent).
+#
+# Usage (from the repository root): python tools/simulation/cohort_simulation.py --n_sims 1000 --cohort_size 100
+
+root = Path(__file__).resolve().parents[2]
+sys.path.append(str(root))
+
+import app.bace.pmc_inference as pmc_inference
+import app.bace.design_optimization as design_optimization
+import app.bace.user_config as user_config
+
+# Design selection methods for cohorts
+# pool: draw n_candidates random designs each round and give each respondent the one with the highest mutual information.
+# random: give each respondent a random design.
+cohort_methods = [
+    dict(opt_type="BACE", search_type="pool", random_design=False),
+    dict(opt_type="RAND", search_type="random", random_design=True),
+]
+
+def get_design_sampler(design_params, conf_dict):
+    # Mango's domain sampler (respects constraints in conf_dict). The objective is not used.
+    return Tuner(design_params, lambda **design: 0, dict(conf_dict)).ds
+
+def get_random_designs(design_sampler, size):
+    # Constraints can reject samples, so draw until there are enough designs
+    designs = []
+    while len(designs) < size:
+        designs.extend(design_sampler.get_random_sample(size=size - len(designs)))
+    return designs
+
+def select_designs_pool(thetas, R, design_sampler, n_candidates, log_likelihood_pdf=None):
+    # Score every candidate design for every respondent, then pick the best candidate for each respondent
+    candidates = get_random_designs(design_sampler, n_candidates)
+
+    mutual_info = np.array([
+        design_optimization.mutual_information_stacked(
+            thetas, user_config.answers, user_config.likelihood_pdf, candidate, R, log_likelihood_pdf=log_likelihood_pdf
+        ) for candidate in candidates
+    ])
+
+    return [candidates[i] for i in np.argmax(mutual_info, axis=0)]
+
+def get_answers_stacked(answers, true_thetas, designs, likelihood_pdf):
+    # Draw observed answers for all respondents at once. true_thetas has one row per respondent.
+    R = len(designs)
+    design = pmc_inference.stack_designs(designs, 1)
+
+    # Likelihood of choosing each answer (R x number of answers)
+    w = np.column_stack([
+        np.broadcast_to(np.asarray(likelihood_pdf(answer, true_thetas, design), dtype=np.float64), (R,)) for answer in answers
+    ])
+    w = w / np.sum(w, axis=1, keepdims=True)
+
+    # Select observed answers by inverting the cumulative probabilities
+    u = np.random.random((R, 1))
+    observed = np.minimum(np.sum(np.cumsum(w, axis=1) < u, axis=1), len(answers) - 1)
+
+    # Answer with highest likelihood of being chosen
+    true = np.argmax(w, axis=1)
+
+    return [answers[i] for i in observed], [answers[i] for i in true]
+
+def cohort_simulation(sim_params, method, sim_no_start=0):
+
+    R = sim_params['cohort_size']
+    N = sim_params['size_thetas']
+    n_designs = sim_params['n_designs_per_sim']
+    log_likelihood_pdf = getattr(user_config, 'log_likelihood_pdf', None)
+    design_sampler = get_design_sampler(user_config.design_params, user_config.conf_dict)
+
+    # Sample true thetas and form the prior for every respondent
+    true_thetas = pmc_inference.sample_thetas(sim_params['true_params'], R)
+    thetas = pmc_inference.sample_thetas(sim_params['theta_params'], R * N, sim_params.get('precision'))
+
+    answer_histories = [[] for _ in range(R)]
+    design_histories = [[] for _ in range(R)]
+    output = []
+
+    for j in range(n_designs):
+
+        start_round = time.time() # Record start time for round.
+
+        # Calculate next designs.
+        if method['random_design']:
+            designs = get_random_designs(design_sampler, R)
+        else:
+            designs = select_designs_pool(thetas, R, design_sampler, sim_params['n_candidates'], log_likelihood_pdf)
+
+        # Evaluate observed and true answers
+        observed_answers, true_answers = get_answers_stacked(user_config.answers, true_thetas, designs, user_config.likelihood_pdf)
+
+        # Update design and answer histories
+        for r in range(R):
+            design_histories[r].append(designs[r])
+            answer_histories[r].append(observed_answers[r])
+
+        # Update posteriors
+        thetas = pmc_inference.pmc_stacked(
+            sim_params['theta_params'],
+            answer_histories,
+            design_histories,
+            user_config.likelihood_pdf,
+            N,
+            J=sim_params['J'],
+            precision=sim_params.get('precision'),
+            log_likelihood_pdf=log_likelihood_pdf
+        )
+
+        # Record time per respondent for round j.
+        time_round = (time.time() - start_round) / R
+
+        # Calculate estimates
+        estimates = thetas.to_numpy().reshape(R, N, -1).mean(axis=1)
+
+        for r in range(R):
+            output.append(dict(
+                **{f'true_{key}': value for key, value in true_thetas.iloc[r].items()},
+                round_no=j,
+                observed_answer=observed_answers[r],
+                true_answer=true_answers[r],
+                time_round=time_round,
+                **method,
+                **designs[r],
+                **{f'mean_{key}': value for key, value in zip(thetas.columns, estimates[r])},
+                sim_no=sim_no_start + r
+            ))
+
+        print(f"{method['opt_type']}-{method['search_type']}: finished question {j+1} of {n_designs} for {R} respondents. Time per respondent: {time_round:.3f}s.")
+
+    return pd.DataFrame(output)
+
+def print_estimates(output, theta_params, n_designs_per_sim):
+
+    final_rows = output[output['round_no'] == n_designs_per_sim - 1]
+    final_rows = final_rows.groupby(['opt_type', 'search_type'])
+
+    for param in theta_params:
+
+        print(f'Parameter: {param}')
+
+        print('MSE')
+        print(final_rows.apply(lambda df: np.mean((df[f'mean_{param}'] - df[f'true_{param}'])**2)).reset_index())
+
+        print('MAE')
+        print(final_rows.apply(lambda df: np.mean(df[f'mean_{param}'] - df[f'true_{param}'])).reset_index())
+
+def main(sim_params):
+
+    output = pd.DataFrame()
+
+    for method in cohort_methods:
+        for sim_no_start in range(0, sim_params['n_sims'], sim_params['cohort_size']):
+
+            cohort_params = dict(sim_params, cohort_size=min(sim_params['cohort_size'], sim_params['n_sims'] - sim_no_start))
+            output = pd.concat([output, cohort_simulation(cohort_params, method, sim_no_start)], ignore_index=True)
+
+            # Store temporary csv as output since simulation can take long
+            output.to_csv(sim_params['file_out'])
+
+    print_estimates(output, sim_params['theta_params'], sim_params['n_designs_per_sim'])
+
+    return output
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Simulate BACE surveys for cohorts of respondents in lockstep.')
+    parser.add_argument('--n_sims', type=int, default=200, help='Number of simulated respondents per method.')
+    parser.add_argument('--n_designs_per_sim', type=int, default=25, help='Number of questions per respondent.')
+    parser.add_argument('--cohort_size', type=int, default=100, help='Number of respondents simulated together.')
+    parser.add_argument('--n_candidates', type=int, default=500, help='Number of candidate designs scored per question (pool search).')
+    parser.add_argument('--precision', default=None, help="Precision of particle math ('float64' or 'float32').")
+    parser.add_argument('--file_out', default=os.path.join(os.path.dirname(__file__), 'simulation_output', 'cohort_simulation.csv'))
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    # Simulation Parameters. Set true_params distributions to draw from, default to the prior
+    sim_params = dict(
+        n_sims=args.n_sims,
+        size_thetas=user_config.size_thetas,
+        n_designs_per_sim=args.n_designs_per_sim,
+        cohort_size=args.cohort_size,
+        n_candidates=args.n_candidates,
+        theta_params=user_config.theta_params,
+        true_params=user_config.theta_params,
+        J=5,
+        precision=args.precision,
+        file_out=args.file_out
+    )
+
+    # Set seed for random and numpy packages.
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+
+    os.makedirs(os.path.dirname(args.file_out), exist_ok=True)
+    main(sim_params=sim_params)
+    print('Finished simulation')
@@ -4,153 +4,97 @@ import time
 import random
 from IPython.utils.capture import capture_output
 from mango import Tuner
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # For getting parent's module
-import os, sys, importlib
+import os, sys
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+
+# BACE Imports
+import app.bace.pmc_inference as pmc_inference
+import app.bace.user_config as user_config
+import app.bace.design_optimization as design_optimization
+
+# Registry of design strategies to compare.
+# Every strategy is evaluated on the same simulated respondents: the same true theta, the same answer noise,
+# and the same random seeds for prior samples and PMC (common random numbers). Select strategies in sim_params['strategies'].
+sim_strategies = dict(
+    # Bayesian optimization of mutual information with Mango (as in the BACE application)
+    bace_bayesian=dict(opt_type="BACE", search_type="bayesian", random_design=False),
+    # Random search over designs with Mango, maximizing mutual information
+    bace_random_search=dict(opt_type="BACE", search_type="random", random_design=False),
+    # Best of a pool of n_candidates random designs, scored exhaustively
+    bace_pool=dict(opt_type="BACE", search_type="pool", random_design=False),
+    # Successive halving over n_candidates random designs, scored on growing subsets of particles
+    bace_halving=dict(opt_type="BACE", search_type="halving", random_design=False),
+    # The same fixed sequence of designs for every respondent
+    fixed=dict(opt_type="FIXED", search_type="fixed", random_design=False),
+    # A random design for each question
+    rand=dict(opt_type="RAND", search_type="random", random_design=True),
+)
+
 def main(sim_params):
     print("Starting main...")
 
+    # Draw the designs used by the `fixed` strategy once, so that every respondent sees the same sequence
+    if sim_params.get('fixed_designs') is None:
+        design_tuner = Tuner(user_config.design_params, lambda **design: 0, dict(user_config.conf_dict))
+        sim_params['fixed_designs'] = [get_random_design(design_tuner) for _ in range(sim_params['n_designs_per_sim'])]
+
     # Perform simulation
-    simulation_output = simulation(
-        sim_params=sim_params,
-        sim_methods=get_sim_methods()
-    )
+    simulation_output = simulation(sim_params=sim_params)
     simulation_output.to_csv(sim_params["file_out"])
 
-def get_sim_methods():
+# Design tuners are built within each worker process and reused across respondents
+tuners = dict()
 
-    objective = design_optimization.get_objective(user_config.answers, user_config.likelihood_pdf)
-    config = design_optimization.get_conf_dict(user_config.conf_dict)
+def get_sim_methods(strategies):
 
-    config_random = config.copy()
-    config_random['optimizer'] = 'Random'
+    if len(tuners) == 0:
+        objective = design_optimization.get_objective(user_config.answers, user_config.likelihood_pdf, log_likelihood_pdf=getattr(user_config, 'log_likelihood_pdf', None))
+        config = design_optimization.get_conf_dict(user_config.conf_dict)
 
-    tuner_bace = Tuner(
-        user_config.design_params,
-        objective,
-        config
-    )
-    tuner_rand = Tuner(
-        user_config.design_params,
-        objective,
-        config_random
-    )
+        config_random = config.copy()
+        config_random['optimizer'] = 'Random'
+
+        tuners['bayesian'] = Tuner(
+            user_config.design_params,
+            objective,
+            config
+        )
+        tuners['random'] = Tuner(
+            user_config.design_params,
+            objective,
+            config_random
+        )
 
     # Specify different types of simulations
-    sim_methods = [
-        dict(
-            opt_type="BACE",
-            search_type="bayesian",
-            random_design=False,
-            design_tuner=tuner_bace
-        ),
-        # Random search
-        # dict(
-        #     opt_type="BACE",
-        #     search_type="random",
-        #     random_design=False,
-        #     design_tuner=tuner_rand
-        # ),
-        dict(
-            opt_type="RAND",
-            search_type="random",
-            random_design=True,
-            design_tuner=tuner_bace
-        ),
-    ]
+    sim_methods = []
+    for strategy in strategies:
+        method = dict(strategy=strategy, **sim_strategies[strategy])
+        method['design_tuner'] = tuners['random'] if method['search_type'] == 'random' else tuners['bayesian']
+        sim_methods.append(method)
 
     return sim_methods
 
-def simulation(sim_params, sim_methods):
+def simulation(sim_params):
 
     # Initialize output DataFrame
     print("Starting simulation...")
     output = pd.DataFrame()
-    i = 0
 
-    for _ in range(sim_params["n_sims"]):
+    # One task per simulated respondent and strategy. Tasks run in parallel worker processes.
+    tasks = [(sim_no, strategy) for sim_no in range(sim_params["n_sims"]) for strategy in sim_params['strategies']]
 
+    with ProcessPoolExecutor(max_workers=sim_params.get('n_workers')) as executor:
 
-        # Sample true thetas from prior distribution
-        true_theta = pmc_inference.sample_thetas(
-            sim_params.get('theta_params'),
-            1
-        )
+        futures = [executor.submit(simulate_respondent, sim_no, strategy, sim_params) for sim_no, strategy in tasks]
 
-        # Create dataframe of true values with sim_params["n_designs_per_sim"] rows.
-        true_thetas = pd.concat(
-            [true_theta] * sim_params.get('n_designs_per_sim'),
-            ignore_index=True
-        )
+        for i, future in enumerate(as_completed(futures)):
 
-        context = sim_params.get('context')
-        # Initialize empty arrays to store information for sim_no
-        for method in sim_methods:
-            context.start_time = None
-            context.thetas = None
-
-            # Sample thetas to form prior distribution
-            thetas = pmc_inference.sample_thetas(
-                sim_params.get('theta_params'),
-                sim_params.get('size_thetas')
-            )
-
-            # Create empty objects to store information
-            round_no, observed_answers, true_answers, time_history = [], [], [], []
-            design_history, estimate_history = [], pd.DataFrame()
-
-            for j in range(sim_params.get('n_designs_per_sim')):
-
-                start_round = time.time() # Record start time for round.
-
-                # Calculate next design.
-                with capture_output():
-                    next_design = calculate_next_design(
-                        design_tuner=method.get('design_tuner'),
-                        thetas=thetas.copy(),
-                        random_design=method.get('random_design')
-                    )
-
-
-                # Evaluate observed and true answers
-                observed_answer, true_answer = get_answers(
-                    answers=user_config.answers,
-                    true_theta=true_theta,
-                    design=next_design,
-                    likelihood_pdf=user_config.likelihood_pdf
-                )
-
-                # Update design and answer histories
-                design_history.append(next_design)
-                observed_answers.append(observed_answer)
-
-                # Update posterior
-                thetas = pmc_inference.pmc(
-                    theta_params=sim_params.get('theta_params'),
-                    answer_history=observed_answers,
-                    design_history=design_history,
-                    likelihood_pdf=user_config.likelihood_pdf,
-                    N=sim_params.get('size_thetas'),
-                    J=sim_params.get('J')
-                )
-
-                # Record end time for round j.
-                end_round = time.time()
-
-                # Calculate estimates
-                estimates = mean_estimates(thetas)
-
-                # Store additional information for output
-                round_no.append(j)
-                true_answers.append(true_answer)
-                time_history.append(end_round - start_round)
-                estimate_history = pd.concat([estimate_history, estimates], ignore_index=True)
-
-            # Combine information for simulation round into single DataFrame
-            round_df = combine_round_info(true_thetas, round_no, observed_answers, true_answers, time_history, method, design_history, estimate_history)
-            round_df["sim_no"] = i
+            round_df = future.result()
 
             # Concatenate round information to output DataFrame
             output = pd.concat([output, round_df], ignore_index=True)
@@ -158,13 +102,118 @@ def simulation(sim_params, sim_methods):
             # Store temporary csv as output since simulation can take long
             output.to_csv(sim_params["file_out"])
 
-            print(f"Finished round {i+1} of {sim_params['n_sims'] * len(sim_methods)}. Avg. Time per QuestionRound Time: {np.mean(time_history)}s.")
-            i += 1
+            print(f"Finished round {i+1} of {len(tasks)} ({round_df['strategy'].iloc[0]}, sim {round_df['sim_no'].iloc[0]}). Avg. Time per QuestionRound Time: {np.mean(round_df['time_round'])}s.")
 
-    print_estimates(output, user_config.theta_params)
+    output = output.sort_values(['sim_no', 'strategy', 'round_no'], ignore_index=True)
+    print_estimates(output, sim_params["theta_params"], sim_params["n_designs_per_sim"])
 
     return output
 
+def simulate_respondent(sim_no, strategy, sim_params):
+
+    method = get_sim_methods([strategy])[0]
+    context = design_optimization.context
+    context.max_opt_time = user_config.max_opt_time
+
+    # Distributions passed to worker processes carry a copy of their random state. Point them back to numpy's global state
+    # so that they follow the seeds set below.
+    for dist in [*sim_params['true_params'].values(), *sim_params['theta_params'].values()]:
+        dist.random_state = None
+
+    # Common random numbers: the respondent's true theta and answer noise only depend on (seed, sim_no)
+    set_seed([sim_params['seed'], sim_no])
+
+    # Sample true thetas from prior distribution
+    true_theta = pmc_inference.sample_thetas(
+        sim_params.get('true_params'),
+        1
+    )
+
+    # Uniform draws that determine the observed answer to each question
+    answer_noise = np.random.random(sim_params.get('n_designs_per_sim'))
+
+    # Create dataframe of true values with sim_params["n_designs_per_sim"] rows.
+    true_thetas = pd.concat(
+        [true_theta] * sim_params.get('n_designs_per_sim'),
+        ignore_index=True
+    )
+
+    context.start_time = None
+    context.thetas = None
+
+    # Sample thetas to form prior distribution
+    thetas = pmc_inference.sample_thetas(
+        sim_params.get('theta_params'),
+        sim_params.get('size_thetas')
+    )
+
+    # Create empty objects to store information
+    round_no, observed_answers, true_answers, time_history = [], [], [], []
+    design_history, estimate_history = [], pd.DataFrame()
+
+    for j in range(sim_params.get('n_designs_per_sim')):
+
+        # Design search and PMC use the same seeds across strategies for each question
+        set_seed([sim_params['seed'], sim_no, j])
+
+        start_round = time.time() # Record start time for round.
+
+        # Calculate next design.
+        with capture_output():
+            next_design = calculate_next_design(
+                method=method,
+                thetas=thetas.copy(),
+                round_no=j,
+                sim_params=sim_params
+            )
+
+        # Evaluate observed and true answers
+        observed_answer, true_answer = get_answers(
+            answers=user_config.answers,
+            true_theta=true_theta,
+            design=next_design,
+            likelihood_pdf=user_config.likelihood_pdf,
+            u=answer_noise[j]
+        )
+
+        # Update design and answer histories
+        design_history.append(next_design)
+        observed_answers.append(observed_answer)
+
+        # Update posterior
+        thetas = pmc_inference.pmc(
+            theta_params=sim_params.get('theta_params'),
+            answer_history=observed_answers,
+            design_history=design_history,
+            likelihood_pdf=user_config.likelihood_pdf,
+            N=sim_params.get('size_thetas'),
+            J=sim_params.get('J'),
+            log_likelihood_pdf=getattr(user_config, 'log_likelihood_pdf', None)
+        )
+
+        # Record end time for round j.
+        end_round = time.time()
+
+        # Calculate estimates
+        estimates = mean_estimates(thetas)
+
+        # Store additional information for output
+        round_no.append(j)
+        true_answers.append(true_answer)
+        time_history.append(end_round - start_round)
+        estimate_history = pd.concat([estimate_history, estimates], ignore_index=True)
+
+    # Combine information for simulation round into single DataFrame
+    round_df = combine_round_info(true_thetas, round_no, observed_answers, true_answers, time_history, method, design_history, estimate_history)
+    round_df["sim_no"] = sim_no
+
+    return round_df
+
+def set_seed(seed):
+    # Set seed for random and numpy packages (Mango uses both).
+    np.random.seed(seed)
+    random.seed(str(seed))
+
 def combine_round_info(true_thetas, round_no, observed_answers, true_answers, time_history, method, design_history, estimate_history):
 
     # Generate starting DataFrame with true parameter values
@@ -184,10 +233,10 @@ def combine_round_info(true_thetas, round_no, observed_answers, true_answers, ti
 
     return output
 
-def print_estimates(output, theta_params):
+def print_estimates(output, theta_params, n_designs_per_sim):
 
-    final_rows = output[output['round_no'] == sim_params.get('n_designs_per_sim')-1]
-    final_rows = final_rows.groupby(['opt_type', 'search_type'])
+    final_rows = output[output['round_no'] == n_designs_per_sim-1]
+    final_rows = final_rows.groupby(['strategy'])
 
     for param in theta_params:
 
@@ -199,6 +248,14 @@ def print_estimates(output, theta_params):
         print('MAE')
         print(final_rows.apply(lambda df: np.mean(df[f'mean_{param}'] - df[f'true_{param}'])).reset_index())
 
+        # With common random numbers, differences between strategies are compared respondent by respondent
+        squared_error = (output[f'mean_{param}'] - output[f'true_{param}'])**2
+        paired = output.assign(squared_error=squared_error)[output['round_no'] == n_designs_per_sim-1].pivot(index='sim_no', columns='strategy', values='squared_error')
+        print('Paired difference in squared error relative to the first strategy (mean, std. error)')
+        for strategy in paired.columns[1:]:
+            diff = paired[strategy] - paired[paired.columns[0]]
+            print(f'  {strategy} - {paired.columns[0]}: {diff.mean():.4f} ({diff.std() / np.sqrt(len(diff)):.4f})')
+
 def get_random_design(design_tuner):
 
     next_design = design_tuner.ds.get_random_sample(size=1)
@@ -207,10 +264,34 @@ def get_random_design(design_tuner):
 
     return next_design[0]
 
-def calculate_next_design(design_tuner, thetas, random_design=False):
+def get_pool_design(design_tuner, thetas, n_candidates):
 
-    if random_design:
+    # Score a pool of random designs and return the one with the highest mutual information
+    candidates = []
+    while len(candidates) < n_candidates:
+        candidates.extend(design_tuner.ds.get_random_sample(size=n_candidates - len(candidates)))
+
+    mutual_info = [
+        design_optimization.mutual_information(
+            thetas, user_config.answers, user_config.likelihood_pdf, design, log_likelihood_pdf=getattr(user_config, 'log_likelihood_pdf', None)
+        ) for design in candidates
+    ]
+
+    return candidates[int(np.argmax(mutual_info))]
+
+def calculate_next_design(method, thetas, round_no, sim_params):
+
+    design_tuner = method.get('design_tuner')
+
+    if method.get('random_design'):
         next_design = get_random_design(design_tuner)
+    elif method.get('search_type') == 'fixed':
+        fixed_designs = sim_params.get('fixed_designs')
+        next_design = fixed_designs[round_no % len(fixed_designs)]
+    elif method.get('search_type') == 'pool':
+        next_design = get_pool_design(design_tuner, thetas, sim_params.get('n_candidates'))
+    elif method.get('search_type') == 'halving':
+        next_design = design_optimization.get_next_design_halving(thetas, design_tuner, n_candidates=sim_params.get('n_candidates'))
     else:
 
         next_design = design_optimization.get_next_design(
@@ -220,13 +301,16 @@ def calculate_next_design(design_tuner, thetas, random_design=False):
 
     return next_design
 
-def get_answers(answers, true_theta, design, likelihood_pdf):
+def get_answers(answers, true_theta, design, likelihood_pdf, u=None):
 
     # Likelihood of choosing each answer
-    w = [float(likelihood_pdf(answer, true_theta, design)) for answer in answers]
+    w = np.array([float(np.squeeze(likelihood_pdf(answer, true_theta, design))) for answer in answers])
+    w = w / np.sum(w)
 
-    # Select observed answer
-    observed_answer = np.random.choice(answers, p=w)
+    # Select observed answer. A common uniform draw u gives the same answer noise across strategies.
+    if u is None:
+        u = np.random.random()
+    observed_answer = answers[min(np.searchsorted(np.cumsum(w), u, side='right'), len(answers) - 1)]
 
     # Answer with highest likelihood of being chosen
     true_answer = answers[np.argmax(w)]
@@ -244,42 +328,21 @@ def mean_estimates(thetas):
 
     return thetas
 
-def import_parents(level=1):
-    global __package__
-    file = Path(os.path.abspath('')).resolve()
-    parent, top = file.parent, file.parents[level - 1]
-
-    sys.path.append(str(top))
-    try:
-        sys.path.remove(str(parent))
-    except ValueError: # already removed
-        pass
-
-    __package__ = '.'.join(parent.parts[len(top.parts):])
-    importlib.import_module(__package__) # won't be needed after that
-
-if __name__ == '__main__' and __package__ is None:
-
-    import_parents(level=2)
-
-    # BACE Imports
-    import app.bace.pmc_inference as pmc_inference
-    import app.bace.user_config as user_config
-    import app.bace.design_optimization as design_optimization
+if __name__ == '__main__':
 
     ###############################
     # Specify Simulation Parameters
 
-    N_sims = 200 # Number of simulated individuals per optimization type
+    N_sims = 200 # Number of simulated individuals (each is simulated under every strategy)
     N_designs_per_sim = 25 # Number of questions per simulation
+    Strategies = ['bace_bayesian', 'rand'] # Strategies to compare (see sim_strategies)
+    N_workers = os.cpu_count() # Number of parallel worker processes
 
     ###############################
 
     # Set true_params distributions to draw from, default to the prior
     true_params = user_config.theta_params
 
-    context = design_optimization.context
-
     # Simulation Parameters
     sim_params = dict(
         n_sims=N_sims,
@@ -288,14 +351,16 @@ if __name__ == '__main__' and __package__ is None:
         theta_params=user_config.theta_params,
         true_params=true_params,
         J=5,
-        context = context,
-        file_out='./simulation_output/simulation.csv'
+        strategies=Strategies,
+        n_candidates=500, # Number of candidate designs for the `bace_pool` strategy
+        fixed_designs=None, # Designs for the `fixed` strategy. Drawn at random once if None.
+        n_workers=N_workers,
+        seed=42,
+        file_out=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'simulation_output', 'simulation.csv')
     )
 
     # Set seed for random and numpy packages.
-    seed = 42
-    random.seed(seed)
-    np.random.seed(seed)
+    set_seed(sim_params['seed'])
 
     main(sim_params=sim_params)
     print('Finished simulation')
@@ -0,0 +1,43 @@
+import importlib.util
+import argparse
+import sys
+from pathlib import Path
+
+# Check a user_config.py before deploying it: required settings, prior and design specifications,
+# and whether the likelihoods return valid probabilities on a prior sample (see app/bace/runtime_model.py).
+# The app runs the same checks at startup and fails to start if the config is invalid.
+#
+# Usage (from the repository root):
+#   python tools/validation/check_config.py --config app/bace/user_config.py
+
+root = Path(__file__).resolve().parents[2]
+sys.path.append(str(root))
+
+from app.bace.runtime_model import validate_config, get_design_encoding
+
+def load_config(path):
+    spec = importlib.util.spec_from_file_location('user_config', path)
+    user_config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(user_config)
+    return user_config
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Validate a BACE user_config.py.')
+    parser.add_argument('--config', default=str(root / 'app' / 'bace' / 'user_config.py'), help='user_config.py to check.')
+    parser.add_argument('--n_check', type=int, default=1000, help='Prior draws used to check the likelihoods.')
+    parser.add_argument('--n_designs', type=int, default=20, help='Random designs used to check the likelihoods.')
+    args = parser.parse_args()
+
+    user_config = load_config(args.config)
+    problems, same_with_arrays = validate_config(user_config, args.n_check, args.n_designs)
+
+    if problems:
+        print(f'{args.config} has {len(problems)} problem(s):')
+        for problem in problems:
+            print(f'  {problem}')
+        sys.exit(1)
+
+    print(f'{args.config} is valid.')
+    print(f'Likelihoods accept particles as arrays: {same_with_arrays}')
+    print(f'Categorical design attributes: {get_design_encoding(user_config.design_params)}')
@@ -0,0 +1,110 @@
+import numpy as np
+import importlib.util
+import argparse
+import sys
+from pathlib import Path
+from mango import Tuner
+
+# Check that reduced-precision (float32) particle math agrees with float64 on the example configs.
+# Usage (from the repository root): python tools/validation/precision_check.py [--configs examples/two_goods_ces/user_config.py ...]
+# float32 is not supported for likelihoods with steps computed in float32 (e.g. an indicator of a utility difference):
+# rounding flips the step near ties. Compute the utilities in float64 (see examples/two_goods_ces/user_config.py).
+# A config that fails to run counts as a failure.
+
+root = Path(__file__).resolve().parents[2]
+sys.path.append(str(root))
+
+import app.bace.pmc_inference as pmc_inference
+import app.bace.design_optimization as design_optimization
+
+def load_config(path):
+    spec = importlib.util.spec_from_file_location(f'user_config_{Path(path).parent.name}', path)
+    user_config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(user_config)
+    return user_config
+
+def simulate_history(user_config, n_questions, tuner):
+
+    # Draw true preferences from the prior and answer random designs
+    true_theta = pmc_inference.sample_thetas(user_config.theta_params, 1)
+    design_history = tuner.ds.get_random_sample(size=n_questions)
+    answer_history = []
+
+    for design in design_history:
+        w = np.array([float(np.squeeze(user_config.likelihood_pdf(answer, true_theta, design))) for answer in user_config.answers])
+        answer_history.append(user_config.answers[np.random.choice(len(w), p=w/np.sum(w))])
+
+    return answer_history, design_history
+
+def check_config(user_config, n_questions, n_designs, seed):
+
+    np.random.seed(seed)
+    tuner = Tuner(user_config.design_params, lambda **design: 0, dict(user_config.conf_dict))
+    answer_history, design_history = simulate_history(user_config, n_questions, tuner)
+    candidates = tuner.ds.get_random_sample(size=n_designs)
+    log_likelihood_pdf = getattr(user_config, 'log_likelihood_pdf', None)
+
+    results = dict()
+    for precision in pmc_inference.precisions:
+
+        # Use common random numbers across precisions
+        np.random.seed(seed)
+        thetas = pmc_inference.pmc(user_config.theta_params, answer_history, design_history, user_config.likelihood_pdf, user_config.size_thetas, J=5, precision=precision, log_likelihood_pdf=log_likelihood_pdf)
+
+        results[precision] = dict(
+            estimates=thetas.astype(np.float64).agg(['mean', 'std']),
+            mutual_info=np.array([
+                design_optimization.mutual_information(thetas, user_config.answers, user_config.likelihood_pdf, design, log_likelihood_pdf=log_likelihood_pdf) for design in candidates
+            ])
+        )
+
+    # Compare posterior means (in posterior standard deviations) and mutual information across candidate designs
+    estimates_64, estimates_32 = results['float64']['estimates'], results['float32']['estimates']
+    mean_diff = ((estimates_32.loc['mean'] - estimates_64.loc['mean']).abs() / estimates_64.loc['std']).max()
+
+    mi_64, mi_32 = results['float64']['mutual_info'], results['float32']['mutual_info']
+    mi_diff = np.max(np.abs(mi_32 - mi_64)) / max(np.max(np.abs(mi_64)), np.finfo(float).eps)
+    same_best = np.argmax(mi_32) == np.argmax(mi_64)
+
+    return mean_diff, mi_diff, same_best
+
+def main(args):
+
+    configs = args.configs or sorted(str(path) for path in (root / 'examples').glob('*/user_config.py'))
+    passed = True
+
+    for path in configs:
+
+        user_config = load_config(path)
+        if len(user_config.theta_params) == 0:
+            print(f'{path}: skipped (no theta_params).')
+            continue
+
+        try:
+            mean_diff, mi_diff, same_best = check_config(user_config, args.n_questions, args.n_designs, args.seed)
+        except Exception as e:
+            print(f'{path}: FAILED ({type(e).__name__}: {e}).')
+            passed = False
+            continue
+
+        ok = (mean_diff <= args.tol_estimates) and (mi_diff <= args.tol_mutual_info)
+        passed = passed and ok
+
+        print(f'{path}: {"OK" if ok else "FAILED"}. '
+              f'max |mean diff| / std = {mean_diff:.3g}, '
+              f'max relative MI diff = {mi_diff:.3g}, '
+              f'same best design = {same_best}.')
+
+    return passed
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Validate float32 particle math against float64 on BACE configs.')
+    parser.add_argument('--configs', nargs='*', help='Paths to user_config.py files. Defaults to all example configs.')
+    parser.add_argument('--n_questions', type=int, default=10, help='Number of simulated answered questions.')
+    parser.add_argument('--n_designs', type=int, default=50, help='Number of candidate designs to score.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--tol_estimates', type=float, default=0.25, help='Tolerance for posterior mean differences, in posterior standard deviations.')
+    parser.add_argument('--tol_mutual_info', type=float, default=0.05, help='Tolerance for relative mutual information differences.')
+
+    sys.exit(0 if main(parser.parse_args()) else 1)